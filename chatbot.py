@@ -5,19 +5,48 @@ Este programa implementa un asistente virtual con capacidad para recordar
 resultados de comandos anteriores y usar esa información en comandos subsecuentes.
 """
 
+import argparse
+import ast
 import asyncio
+import bisect
+import codecs
+import fnmatch
+import gzip
+import hashlib
+import hmac
+import io
+import ipaddress
+import itertools
 import json
 import logging
+import marshal
+import math
+import mmap
+import multiprocessing
 import os
 import platform
+import queue
+import random
 import re
+import secrets
+import shlex
+import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import traceback
-from collections import deque
-from typing import Any, Dict, List, Optional, Tuple, Union
+import unicodedata
+import uuid
+import webbrowser
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import CodeType
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import psutil
 import yaml
@@ -47,6 +76,9 @@ OPENAI_DISPONIBLE = os.getenv("OPENAI_API_KEY") is not None
 # Definir el número máximo de mensajes en el historial de conversación
 MAX_HISTORIAL = 10
 
+# Número máximo de fragmentos de código validados y compilados que se guardan en caché
+MAX_CACHE_CODIGO = 256
+
 # Definir la ruta de la configuración por defecto
 DEFAULT_CONFIG_PATH = "config.yaml"
 
@@ -59,10 +91,54 @@ except ImportError:
     CHROMADB_DISPONIBLE = False
     logger.warning("ChromaDB no está disponible. La búsqueda semántica estará desactivada.")
 
+# Intentar importar aiohttp, necesario solo para el modo servidor
+try:
+    import aiohttp
+    from aiohttp import web
+    AIOHTTP_DISPONIBLE = True
+except ImportError:
+    AIOHTTP_DISPONIBLE = False
+
+# El módulo resource (límites de CPU y memoria del sandbox) solo existe en sistemas Unix
+try:
+    import resource
+    RESOURCE_DISPONIBLE = True
+except ImportError:
+    RESOURCE_DISPONIBLE = False
+
+# Intentar importar numpy, necesario solo para el clasificador de intenciones
+try:
+    import numpy as np
+    NUMPY_DISPONIBLE = True
+except ImportError:
+    NUMPY_DISPONIBLE = False
+
+# Intentar importar charset_normalizer, para detectar la codificación de archivos que no son UTF-8
+try:
+    from charset_normalizer import from_bytes as detectar_codificacion_bytes
+    CHARSET_NORMALIZER_DISPONIBLE = True
+except ImportError:
+    CHARSET_NORMALIZER_DISPONIBLE = False
+
+# Intentar importar PyAudio, necesario solo para reproducir la voz sintetizada
+try:
+    import pyaudio
+    PYAUDIO_DISPONIBLE = True
+except ImportError:
+    PYAUDIO_DISPONIBLE = False
+
+# Intentar importar keyboard, para interrumpir la voz con una tecla
+try:
+    import keyboard
+    KEYBOARD_DISPONIBLE = True
+except ImportError:
+    KEYBOARD_DISPONIBLE = False
+
 # Definir la ruta de la base de datos ChromaDB
 CHROMA_DB_DIR = "chroma_db"
 
-# Plantillas de código predefinidas
+# Plantillas de código predefinidas. Los parámetros no se sustituyen en el texto:
+# la llamada final los lee como variables del espacio de nombres de ejecución.
 PLANTILLAS = {
     "crear_archivo": """
 from pathlib import Path
@@ -77,6 +153,8 @@ def crear_archivo(nombre_archivo, ubicacion="escritorio"):
             ruta_base = obtener_documentos()
         elif ubicacion.lower() == "descargas":
             ruta_base = obtener_descargas()
+        elif ubicacion.lower() == "actual":
+            ruta_base = os.getcwd()
         else:
             ruta_base = ubicacion
             
@@ -94,7 +172,7 @@ def crear_archivo(nombre_archivo, ubicacion="escritorio"):
         return None
 
 # Ejecutar la función
-ruta = crear_archivo("{nombre_archivo}", "{ubicacion}")
+ruta = crear_archivo(nombre_archivo, ubicacion)
 """,
     "crear_y_abrir_archivo": """
 from pathlib import Path
@@ -109,6 +187,8 @@ def crear_y_abrir_archivo(nombre_archivo, ubicacion="escritorio"):
             ruta_base = obtener_documentos()
         elif ubicacion.lower() == "descargas":
             ruta_base = obtener_descargas()
+        elif ubicacion.lower() == "actual":
+            ruta_base = os.getcwd()
         else:
             ruta_base = ubicacion
             
@@ -130,68 +210,5212 @@ def crear_y_abrir_archivo(nombre_archivo, ubicacion="escritorio"):
         print(f"❌ Error al crear o abrir el archivo: {e}")
         return None
 
-# Ejecutar la función
-ruta = crear_y_abrir_archivo("{nombre_archivo}", "{ubicacion}")
-""",
-    "buscar_archivos": """
-import os
-import glob
-from pathlib import Path
+# Ejecutar la función
+ruta = crear_y_abrir_archivo(nombre_archivo, ubicacion)
+""",
+    "buscar_archivos": """
+import os
+
+def buscar_archivos(patron, ubicacion=None):
+    try:
+        # Determinar la ubicación de búsqueda
+        if ubicacion is None or ubicacion.lower() == "actual":
+            ruta_base = os.getcwd()
+        elif ubicacion.lower() == "escritorio":
+            ruta_base = obtener_escritorio()
+        elif ubicacion.lower() == "documentos":
+            ruta_base = obtener_documentos()
+        elif ubicacion.lower() == "descargas":
+            ruta_base = obtener_descargas()
+        else:
+            ruta_base = ubicacion
+        
+        # Buscar también en las subcarpetas, mostrando cada archivo en cuanto aparece
+        archivos_encontrados = []
+        for archivo in buscar_rutas(patron, ruta_base):
+            archivos_encontrados.append(archivo)
+            print(f"{len(archivos_encontrados)}. {archivo}")
+        
+        # Mostrar resultados
+        if archivos_encontrados:
+            print(f"🔍 Se encontraron {len(archivos_encontrados)} archivos")
+        else:
+            print(f"❌ No se encontraron archivos que coincidan con '{patron}' en {ruta_base}")
+        
+        return archivos_encontrados
+    except Exception as e:
+        print(f"❌ Error al buscar archivos: {e}")
+        return []
+
+# Ejecutar la búsqueda
+archivos_encontrados = buscar_archivos(patron, ubicacion)
+"""
+}
+
+# Valores por defecto de los parámetros opcionales de cada plantilla
+DEFECTO_PLANTILLAS = {
+    "crear_archivo": {"ubicacion": "escritorio"},
+    "crear_y_abrir_archivo": {"ubicacion": "escritorio"},
+    "buscar_archivos": {"ubicacion": None},
+}
+
+# Plantillas compiladas una sola vez al cargar el módulo
+PLANTILLAS_COMPILADAS = {
+    intencion: compile(codigo, f"<plantilla {intencion}>", "exec")
+    for intencion, codigo in PLANTILLAS.items()
+}
+
+# Conceptos que se reconocen en los comandos. Cada patrón se aplica sobre el texto
+# normalizado (minúsculas y sin acentos) y ningún par de conceptos debe solaparse.
+# El orden importa: si dos patrones casan en la misma posición gana el primero
+# (por eso "web" va antes que "archivo", para que "google.com" sea una web).
+# Los verbos solo casan en imperativo o infinitivo (con pronombre átono): "borrador",
+# "abril", "ejecutado" o "general" no son órdenes.
+CONCEPTOS_INTENCION = {
+    "crear": r"crea(?:r|me|lo|la)?|genera(?:r|me|lo|la)?|nuev[oa]",
+    "abrir": r"abre(?:me|lo|la|los|las)?|abrir(?:lo|la|los|las)?",
+    "borrar": r"borra(?:r|me|lo|la|los|las)?|elimina(?:r|me|lo|la|los|las)?|suprime|suprimir",
+    "copiar": r"copia(?:r|me|lo|la|los|las)?|duplica(?:r|lo|la)?",
+    "mover": r"mueve(?:me|lo|la|los|las)?|mover(?:lo|la|los|las)?|traslada(?:r|lo|la|los|las)?",
+    "renombrar": r"renombra(?:r|lo|la)?",
+    "leer": r"lee(?:r|me|lo|rlo)?|lea|contenido|(?:ultimas|primeras) \d+ lineas|lineas \d+ (?:a|al|hasta)",
+    "buscar": r"busca(?:r|me|lo|los|las)?|busco|encuentra(?:me)?|encontrar|localiza(?:r|me)?|lista(?:r|me)?",
+    "texto": r"(?<!de )(?:textos?|palabras?|frases?|cadenas?)|dentro de (?:los |las |mis )?(?:archivos|ficheros)",
+    "ejecutar": r"ejecuta(?:r|me|lo)?|(?:corre|lanza)(?= (?:el |la |este |esta )?(?:comando|orden|script|programa))",
+    "web": r"paginas?|web|navegador|sitio|www\.\S+|https?://\S+|[\w-]+\.(?:com|es|org|net|io|dev|edu|gov)(?:\.[a-z]{2})?",
+    "directorio": r"directorios?|carpetas?",
+    "archivo": r"archivos?|ficheros?|documentos?|primer[oa]s|[\w-]+\.[a-z0-9]{1,5}|(?:~|\.{1,2})?/[^\s/]\S*",
+    "comando": r"comandos?|orden|script|terminal|consola",
+    "sistema": r"(?:informacion|info|estado|resumen) del sistema|cpu|procesador|memoria|ram|discos?|bateria|procesos"
+               r"|rendimiento",
+}
+
+# Intenciones con los conceptos requeridos y opcionales. La puntuación es el número de
+# conceptos presentes; solo puntúan las intenciones con todos sus requeridos. En caso
+# de empate gana la que aparece antes, por eso las más específicas van primero.
+# Las que actúan sobre archivos exigen que el comando nombre uno ("archivo", un nombre
+# con extensión o una ruta): el verbo solo no basta.
+INTENCIONES = {
+    "crear_y_abrir_archivo": {"requeridos": ["crear", "abrir", "archivo"], "opcionales": []},
+    "crear_directorio": {"requeridos": ["crear", "directorio"], "opcionales": []},
+    "crear_archivo": {"requeridos": ["crear", "archivo"], "opcionales": []},
+    "borrar_directorio": {"requeridos": ["borrar", "directorio"], "opcionales": []},
+    "borrar_archivo": {"requeridos": ["borrar", "archivo"], "opcionales": []},
+    "copiar_archivo": {"requeridos": ["copiar", "archivo"], "opcionales": []},
+    "mover_archivo": {"requeridos": ["mover", "archivo"], "opcionales": []},
+    "renombrar_archivo": {"requeridos": ["renombrar", "archivo"], "opcionales": []},
+    "leer_archivo": {"requeridos": ["leer", "archivo"], "opcionales": []},
+    "buscar_contenido": {"requeridos": ["buscar", "texto"], "opcionales": ["archivo"]},
+    "buscar_archivos": {"requeridos": ["buscar", "archivo"], "opcionales": []},
+    "abrir_pagina_web": {"requeridos": ["abrir", "web"], "opcionales": []},
+    "abrir_archivo": {"requeridos": ["abrir", "archivo"], "opcionales": []},
+    "ejecutar_comando": {"requeridos": ["ejecutar"], "opcionales": ["comando"]},
+    "obtener_info_sistema": {"requeridos": ["sistema"], "opcionales": []},
+}
+
+# Expresión única con un grupo por concepto: una sola pasada sobre el comando. Los límites
+# de palabra se comprueban con lookarounds (y no con \b) para que una ruta pueda empezar
+# por "/" o "~". Un concepto no puede ir seguido de ".ext", para que "copia.txt" sea un
+# archivo y no "copiar".
+PATRON_CONCEPTOS = re.compile(
+    r"(?<!\w)(?:" + "|".join(f"(?P<{nombre}>{patron})" for nombre, patron in CONCEPTOS_INTENCION.items())
+    + r")(?!\w)(?!\.\w)"
+)
+
+# Intenciones precompiladas como (intención, requeridos, opcionales) con conjuntos
+INTENCIONES_COMPILADAS = [
+    (intencion, frozenset(definicion["requeridos"]), frozenset(definicion["opcionales"]))
+    for intencion, definicion in INTENCIONES.items()
+]
+
+
+# Preguntas que piden una explicación ("¿cómo funciona la memoria RAM?", "¿qué es un proceso?"):
+# aunque nombren un recurso o una acción, las responde el modelo de lenguaje
+PATRON_PREGUNTA_GENERAL = re.compile(
+    r"\b(?:como funcionan?|que (?:es|son|significa)|para que sirven?|por que|explica\w*|diferencias? entre)\b"
+)
+
+
+# Tabla de traducción que quita los acentos de los caracteres latinos (á -> a, ñ -> n, ...)
+TABLA_SIN_ACENTOS = {
+    codigo: unicodedata.normalize("NFD", chr(codigo))[0]
+    for codigo in range(0xC0, 0x250)
+    if len(unicodedata.normalize("NFD", chr(codigo))) > 1
+}
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Pasa un texto a minúsculas y le quita los acentos.
+
+    Args:
+        texto: Texto a normalizar.
+
+    Returns:
+        El texto normalizado.
+    """
+    texto = texto.lower()
+    if texto.isascii():
+        return texto
+    return texto.translate(TABLA_SIN_ACENTOS)
+
+
+def puntuar_intenciones(comando: str) -> Dict[str, int]:
+    """
+    Puntúa todas las intenciones a partir de una única pasada sobre el comando.
+
+    Args:
+        comando: Comando del usuario.
+
+    Returns:
+        Diccionario intención -> número de conceptos presentes, solo con las
+        intenciones cuyos conceptos requeridos aparecen todos, en orden de declaración.
+    """
+    conceptos = {match.lastgroup for match in PATRON_CONCEPTOS.finditer(normalizar_texto(comando))}
+    puntuaciones = {}
+    if not conceptos:
+        return puntuaciones
+    for intencion, requeridos, opcionales in INTENCIONES_COMPILADAS:
+        if requeridos <= conceptos:
+            puntuaciones[intencion] = len(requeridos) + len(opcionales & conceptos)
+    return puntuaciones
+
+
+def detectar_intencion_por_palabras(comando: str) -> Optional[str]:
+    """
+    Devuelve la intención con mayor puntuación (la primera declarada en caso de empate).
+
+    Args:
+        comando: Comando del usuario.
+
+    Returns:
+        La intención detectada o None si ninguna tiene todos sus conceptos requeridos.
+    """
+    puntuaciones = puntuar_intenciones(comando)
+    if not puntuaciones:
+        return None
+    return max(puntuaciones, key=puntuaciones.get)
+
+
+# Comandos etiquetados para medir la precisión de la detección de intenciones
+CASOS_INTENCION = [
+    ("buscar archivos con patrón notas", "buscar_archivos"),
+    ("busca los archivos pdf en descargas", "buscar_archivos"),
+    ("encuentra informe.docx en documentos", "buscar_archivos"),
+    ("lista los ficheros del escritorio", "buscar_archivos"),
+    ("busca los archivos de texto en documentos", "buscar_archivos"),
+    ("busca la palabra factura en documentos", "buscar_contenido"),
+    ("busca 'TODO' dentro de los archivos .py", "buscar_contenido"),
+    ("encuentra los ficheros que contengan el texto error", "buscar_contenido"),
+    ("lee el archivo notas.txt", "leer_archivo"),
+    ("muéstrame el contenido de config.yaml", "leer_archivo"),
+    ("leer archivo /tmp/registro.log", "leer_archivo"),
+    ("muéstrame las últimas 50 líneas de /var/log/syslog", "leer_archivo"),
+    ("lee las líneas 10 a 20 de notas.txt", "leer_archivo"),
+    ("crea un archivo llamado notas.txt", "crear_archivo"),
+    ("crear archivo ideas.md en documentos", "crear_archivo"),
+    ("genera un documento nuevo", "crear_archivo"),
+    ("crea el archivo lista.txt y ábrelo", "crear_y_abrir_archivo"),
+    ("crear y abrir archivo tareas.txt", "crear_y_abrir_archivo"),
+    ("borra el archivo viejo.txt", "borrar_archivo"),
+    ("elimina temporal.log", "borrar_archivo"),
+    ("copia el archivo a.txt a documentos", "copiar_archivo"),
+    ("copiar archivo foto.png a descargas", "copiar_archivo"),
+    ("mueve notas.txt a la carpeta proyectos", "mover_archivo"),
+    ("mover archivo informe.pdf a documentos", "mover_archivo"),
+    ("renombra notas.txt a ideas.txt", "renombrar_archivo"),
+    ("renombrar archivo a.txt a b.txt", "renombrar_archivo"),
+    ("crea una carpeta llamada fotos", "crear_directorio"),
+    ("crear directorio proyectos en documentos", "crear_directorio"),
+    ("elimina la carpeta temporal", "borrar_directorio"),
+    ("borrar directorio /tmp/pruebas", "borrar_directorio"),
+    ("dime cuánta memoria RAM estoy usando", "obtener_info_sistema"),
+    ("muestra los procesos en ejecución", "obtener_info_sistema"),
+    ("información del sistema", "obtener_info_sistema"),
+    ("¿cuál es el uso de CPU?", "obtener_info_sistema"),
+    ("cuánto espacio libre queda en el disco", "obtener_info_sistema"),
+    ("uso de CPU en los últimos 5 minutos", "obtener_info_sistema"),
+    ("ejecuta el comando ls -la", "ejecutar_comando"),
+    ("ejecutar comando git status", "ejecutar_comando"),
+    ("abre la página web google.com", "abrir_pagina_web"),
+    ("abrir página web https://github.com", "abrir_pagina_web"),
+    ("abre wikipedia.org en el navegador", "abrir_pagina_web"),
+    ("abre el archivo informe.pdf", "abrir_archivo"),
+    ("abre los tres primeros", "abrir_archivo"),
+    ("abre /tmp/informe", "abrir_archivo"),
+    ("abre la calculadora", None),
+    ("abre spotify", None),
+    ("abre una terminal", None),
+    ("abre la carpeta de descargas", None),
+    ("¿qué hora es?", None),
+    ("cuéntame un chiste", None),
+    ("hola jarvis", None),
+    ("¿quién eres?", None),
+    ("traduce 'hello' al español", None),
+    # Falsos positivos: palabras clave fuera de una orden sobre archivos o el sistema
+    ("explícame qué es un sistema operativo", None),
+    ("¿cómo funciona la memoria RAM?", None),
+    ("lista la compra: leche, huevos", None),
+    ("busca información sobre la revolución francesa", None),
+    ("escribe dos líneas en notas.txt", None),
+    ("añade una línea a notas.txt", None),
+    ("lanza un dado", None),
+    ("el proceso se ha ejecutado bien", None),
+    ("¿qué tiempo hará en abril?", None),
+    ("revisa el borrador del correo", None),
+    ("genera una contraseña segura", None),
+    ("dame información general sobre Python", None),
+]
+
+
+def evaluar_intenciones(casos: List[Tuple[str, Optional[str]]] = None,
+                        repeticiones: int = 1000) -> Dict[str, float]:
+    """
+    Mide la precisión de la detección de intenciones sobre casos etiquetados
+    y su coste medio por comando.
+
+    Args:
+        casos: Pares (comando, intención esperada); por defecto CASOS_INTENCION.
+        repeticiones: Veces que se clasifica cada caso en el micro-benchmark.
+
+    Returns:
+        Diccionario con aciertos, total, precisión y microsegundos por comando.
+    """
+    casos = casos or CASOS_INTENCION
+    fallos = []
+    for comando, esperada in casos:
+        obtenida, _ = detectar_intencion_local(comando)
+        if obtenida != esperada:
+            fallos.append((comando, esperada, obtenida))
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for comando, _ in casos:
+            detectar_intencion_local(comando)
+    microsegundos = (time.perf_counter() - inicio) / (repeticiones * len(casos)) * 1e6
+
+    aciertos = len(casos) - len(fallos)
+    for comando, esperada, obtenida in fallos:
+        print(f"  ✗ '{comando}': esperada {esperada}, obtenida {obtenida}")
+    print(f"Detección de intenciones: {aciertos}/{len(casos)} aciertos "
+          f"({aciertos / len(casos):.1%}), {microsegundos:.1f} µs por comando")
+    return {"aciertos": aciertos, "total": len(casos),
+            "precision": aciertos / len(casos), "us_por_comando": microsegundos}
+
+
+# Alias de ubicaciones conocidas
+ALIAS_UBICACIONES = {
+    "escritorio": "escritorio", "desktop": "escritorio",
+    "documentos": "documentos", "documents": "documentos",
+    "descargas": "descargas", "downloads": "descargas",
+    "actual": "actual", "aqui": "actual", "carpeta actual": "actual", "directorio actual": "actual",
+}
+
+# Palabras que por sí solas no son un parámetro: si una ranura captura solo una de ellas
+# ("ejecuta la orden de", "busca los archivos de") la frase no se resuelve localmente
+PALABRAS_VACIAS = {"a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los", "mi", "mis", "o",
+                   "para", "por", "que", "su", "sus", "un", "una", "y"}
+
+# Fragmentos reutilizables de la gramática de parámetros (sobre texto normalizado)
+SINONIMOS_GRAMATICA = {
+    "{crear}": r"(?:crea\w*|genera\w*|haz|hazme)",
+    "{buscar}": r"(?:busc\w*|encontr\w*|encuentr\w*|localiz\w*|list\w*)",
+    "{leer}": r"(?:lee\w*|leer|muestra\w*|ensena\w*|ver)",
+    "{borrar}": r"(?:borr\w*|elimin\w*|suprim\w*)",
+    "{copiar}": r"(?:copi\w*|duplic\w*)",
+    "{mover}": r"(?:mueve\w*|mover|traslad\w*)",
+    "{renombrar}": r"(?:renombr\w*|cambia(?:r)? el nombre (?:de|del))",
+    "{ejecutar}": r"(?:ejecut\w*|corre|lanza)",
+    "{abrir}": r"(?:abr\w*)",
+    "{art}": r"(?:(?:el|la|los|las|un|una|unos|unas|mi|mis|todos los|todas las) )?",
+    "{archivo}": r"(?:(?:archivos?|ficheros?|documentos?) )?",
+    "{directorio}": r"(?:directorios?|carpetas?)",
+    "{ubic}": r"(?: (?:en|dentro de|de|del) (?:el |la |mis? )?(?:carpeta |directorio )?(?P<ubicacion>{UBICACION}))?",
+    # Una ubicación es un alias conocido, una ruta, un texto entre comillas o el nombre que sigue
+    # a "carpeta"/"directorio"; así "archivos de texto" no se toma como la carpeta "texto"
+    "{UBICACION}": r"(?:(?:" + "|".join(sorted(ALIAS_UBICACIONES, key=len, reverse=True)) + r")(?!\S)"
+                   r"|(?:~|\.{1,2})?/\S*|[a-z]:[\\/]\S*|\"[^\"]+\"|'[^']+'|(?<=carpeta )\S+|(?<=directorio )\S+)",
+    "{fin}": r"[\s?.!]*$",
+    "{vacia}": r"(?:" + "|".join(sorted(PALABRAS_VACIAS)) + r")",
+    "{RUTA}": r"(?:\"[^\"]+\"|'[^']+'|\S+)",
+    "{NOMBRE}": r"(?:\"[^\"]+\"|'[^']+'|[\w.~/\\-]*\.\w+)",
+    "{URL}": r"(?:https?://\S+|www\.\S+|[\w-]+(?:\.[\w-]+)+(?:/\S*)?)",
+}
+
+# Gramática declarativa por intención: patrones alternativos (en orden de preferencia),
+# tipo de cada ranura, valores por defecto y un patrón de rescate opcional que busca
+# el parámetro en cualquier parte del comando (para frases que reconoce el clasificador)
+GRAMATICA_PARAMETROS = {
+    "buscar_archivos": {
+        "patrones": [
+            r"buscar archivos con patron (?P<patron>.+?){ubic}{fin}",
+            r"{buscar} {art}(?:archivos?|ficheros?|documentos?) (?:en|de|del|dentro de) (?:el |la |mis? )?"
+            r"(?:carpeta |directorio )?(?P<ubicacion>{UBICACION}){fin}",
+            r"{buscar} {art}{archivo}(?:con (?:el )?(?:patron|nombre) |que (?:contengan|se llamen) |llamados? "
+            r"|de tipo |con extension )?(?P<patron>{RUTA}){ubic}{fin}",
+            r"{buscar} {art}(?:archivos?|ficheros?|documentos?){fin}",
+        ],
+        "ranuras": {"patron": "glob", "ubicacion": "ubicacion"},
+        "defecto": {"patron": ""},
+    },
+    "buscar_contenido": {
+        "patrones": [
+            r"{buscar} {art}(?:texto|palabra|frase|cadena) (?P<texto>{RUTA})(?: (?:en|dentro de) {art}"
+            r"(?:archivos?|ficheros?)(?: (?P<patron>\*?\.\w+))?)?{ubic}{fin}",
+            r"{buscar} {art}(?:archivos?|ficheros?|documentos?)(?: (?P<patron>\*?\.\w+))? (?:que contengan?|con) "
+            r"(?:el |la )?(?:texto|palabra|frase|cadena) (?P<texto>{RUTA}){ubic}{fin}",
+            r"{buscar} (?P<texto>{RUTA}) dentro de {art}(?:archivos?|ficheros?)(?: (?P<patron>\*?\.\w+))?{ubic}{fin}",
+        ],
+        "ranuras": {"texto": "texto", "patron": "glob", "ubicacion": "ubicacion"},
+        "defecto": {"patron": ""},
+    },
+    "leer_archivo": {
+        "patrones": [
+            r"{leer} {art}(?P<final>ultimas|primeras) (?P<lineas>\d+) lineas (?:de |del ){art}{archivo}"
+            r"(?P<ruta>{RUTA}){ubic}{fin}",
+            r"{leer} {art}lineas (?:de la |desde la )?(?P<desde>\d+) (?:a|al|hasta)(?: la)? (?P<hasta>\d+) "
+            r"(?:de |del ){art}{archivo}(?P<ruta>{RUTA}){ubic}{fin}",
+            r"{leer} {art}(?P<final>final) (?:de |del ){art}{archivo}(?P<ruta>{RUTA}){ubic}{fin}",
+            r"{leer} {art}(?:contenido )?(?:de |del )?{art}{archivo}(?P<ruta>{RUTA}){ubic}{fin}",
+        ],
+        "ranuras": {"ruta": "ruta", "ubicacion": "ubicacion", "final": "final", "lineas": "entero",
+                    "desde": "entero", "hasta": "entero"},
+        "rescate": r"(?P<ruta>{NOMBRE})",
+    },
+    "crear_archivo": {
+        "patrones": [
+            r"{crear} y {abrir} {art}{archivo}(?:llamad[oa] )?(?P<nombre_archivo>{NOMBRE}){ubic}{fin}",
+            r"{crear} {art}(?:nuevo |nueva )?{archivo}(?:nuevo |nueva )?(?:llamad[oa] |con (?:el )?nombre "
+            r"|de nombre )(?P<nombre_archivo>{RUTA})(?: y {abrir})?{ubic}(?: y {abrir})?{fin}",
+            r"{crear} {art}(?:nuevo |nueva )?{archivo}(?P<nombre_archivo>{NOMBRE})(?: y {abrir})?{ubic}"
+            r"(?: y {abrir})?{fin}",
+        ],
+        "ranuras": {"nombre_archivo": "texto", "ubicacion": "ubicacion"},
+        "defecto": {"ubicacion": "escritorio"},
+    },
+    "crear_directorio": {
+        "patrones": [
+            r"{crear} {art}(?:nuevo |nueva )?{directorio} (?:nuev[oa] )?(?:llamad[oa] |con (?:el )?nombre "
+            r"|de nombre )?(?P<ruta>{RUTA}){ubic}{fin}",
+        ],
+        "ranuras": {"ruta": "ruta", "ubicacion": "ubicacion"},
+    },
+    "borrar_archivo": {
+        "patrones": [r"{borrar} {art}{archivo}(?P<ruta>{RUTA}){ubic}{fin}"],
+        "ranuras": {"ruta": "ruta", "ubicacion": "ubicacion"},
+        "rescate": r"(?P<ruta>{NOMBRE})",
+    },
+    "borrar_directorio": {
+        "patrones": [r"{borrar} {art}{directorio} (?P<ruta>{RUTA}){ubic}{fin}"],
+        "ranuras": {"ruta": "ruta", "ubicacion": "ubicacion"},
+    },
+    "copiar_archivo": {
+        "patrones": [
+            r"{copiar} {art}{archivo}(?P<origen>{RUTA}) (?:a|al|en|hacia|dentro de) (?:el |la |mis? )?"
+            r"(?:carpeta |directorio )?(?P<destino>.+?){fin}",
+        ],
+        "ranuras": {"origen": "ruta", "destino": "ubicacion"},
+    },
+    "mover_archivo": {
+        "patrones": [
+            r"{mover} {art}{archivo}(?P<origen>{RUTA}) (?:a|al|en|hacia|dentro de) (?:el |la |mis? )?"
+            r"(?:carpeta |directorio )?(?P<destino>.+?){fin}",
+        ],
+        "ranuras": {"origen": "ruta", "destino": "ubicacion"},
+    },
+    "renombrar_archivo": {
+        "patrones": [r"{renombrar} {art}{archivo}(?P<origen>{RUTA}) (?:a|como|por) (?P<destino>{RUTA}){fin}"],
+        "ranuras": {"origen": "ruta", "destino": "texto"},
+    },
+    "ejecutar_comando": {
+        "patrones": [
+            r"{ejecutar} {art}(?:(?:comando|orden|script|programa):? )?(?P<comando>\"[^\"]+\"|'[^']+'|`[^`]+`){fin}",
+            r"{ejecutar} {art}(?:comando|orden):? (?P<comando>(?!{vacia} )\S.*?)\s*$",
+            r"{ejecutar} {art}(?:script|programa) (?P<comando>{NOMBRE}(?: .*?)?)\s*$",
+            r"{ejecutar} (?P<comando>(?!(?:{vacia}|este|esta|script|programa) )[\w./~-]+"
+            r"(?: .*?)?)\s*$",
+        ],
+        "ranuras": {"comando": "texto"},
+    },
+    "abrir_pagina_web": {
+        "patrones": [
+            r"{abrir} {art}(?:(?:pagina|web|sitio)(?: web)? )?(?:de |del )?(?P<url>{URL})(?: en {art}navegador)?{fin}",
+        ],
+        "ranuras": {"url": "url"},
+        "rescate": r"(?P<url>{URL})",
+    },
+    "abrir_archivo": {
+        "patrones": [
+            r"{abrir} {art}(?P<cantidad>\d+|dos|tres|cuatro|cinco|seis|siete|ocho|nueve|diez) primer[oa]s"
+            r"(?: (?:archivos?|ficheros?|documentos?|resultados?))?{fin}",
+            r"{abrir} {art}{archivo}(?P<ruta>{RUTA}){ubic}{fin}",
+        ],
+        "ranuras": {"cantidad": "cantidad", "ruta": "ruta", "ubicacion": "ubicacion"},
+        "rescate": r"(?P<ruta>{NOMBRE})",
+    },
+    "obtener_info_sistema": {
+        "patrones": [
+            r"\b(?P<recurso>cpu|procesador|memoria|ram|discos?|procesos|bateria|red)\b(?:.*?\b(?:ultim[oa]s?|pasad[oa]s?) "
+            r"(?P<periodo>(?:\d+ )?(?:segundos?|minutos?|horas?)))?",
+            r"\b(?:ultim[oa]s?|pasad[oa]s?) (?P<periodo>(?:\d+ )?(?:segundos?|minutos?|horas?))\b.*?"
+            r"\b(?P<recurso>cpu|procesador|memoria|ram|discos?|procesos|bateria|red)\b",
+            r"\b(?:informacion|info|estado|resumen) del (?P<recurso>sistema)\b",
+        ],
+        "ranuras": {"recurso": "recurso", "periodo": "duracion"},
+    },
+}
+GRAMATICA_PARAMETROS["crear_y_abrir_archivo"] = GRAMATICA_PARAMETROS["crear_archivo"]
+
+# Parámetros sin los que una intención no se puede resolver localmente
+# (una tupla indica que basta con cualquiera de sus ranuras)
+PARAMETROS_REQUERIDOS = {
+    "buscar_archivos": ["patron"],
+    "buscar_contenido": ["texto"],
+    "leer_archivo": ["ruta"],
+    "crear_archivo": ["nombre_archivo", "ubicacion"],
+    "crear_y_abrir_archivo": ["nombre_archivo", "ubicacion"],
+    "crear_directorio": ["ruta"],
+    "borrar_archivo": ["ruta"],
+    "borrar_directorio": ["ruta"],
+    "copiar_archivo": ["origen", "destino"],
+    "mover_archivo": ["origen", "destino"],
+    "renombrar_archivo": ["origen", "destino"],
+    "ejecutar_comando": ["comando"],
+    "abrir_pagina_web": ["url"],
+    "abrir_archivo": [("ruta", "cantidad")],
+    "obtener_info_sistema": ["recurso"],
+}
+
+# Sinónimos de los recursos del sistema
+ALIAS_RECURSOS = {"procesador": "cpu", "ram": "memoria", "discos": "disco"}
+
+# Números escritos con letra ("abre los tres primeros")
+NUMEROS_PALABRA = {"dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8,
+                   "nueve": 9, "diez": 10}
+
+# Extensiones que, dichas sin punto ("archivos pdf"), se interpretan como extensión
+EXTENSIONES_CONOCIDAS = {
+    "txt", "pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx", "csv", "json", "yaml", "yml", "md",
+    "py", "js", "html", "css", "jpg", "jpeg", "png", "gif", "mp3", "mp4", "zip", "log",
+}
+
+
+def ruta_de_ubicacion(ubicacion: str) -> str:
+    """
+    Convierte un alias de ubicación en una ruta.
+
+    Args:
+        ubicacion: Alias ("escritorio", "documentos", "descargas", "actual") o ruta.
+
+    Returns:
+        La ruta correspondiente.
+    """
+    rutas = {"escritorio": Chatbot.obtener_escritorio, "documentos": Chatbot.obtener_documentos,
+             "descargas": Chatbot.obtener_descargas, "actual": os.getcwd}
+    alias = ALIAS_UBICACIONES.get(normalizar_texto(ubicacion).strip())
+    if alias in rutas:
+        return rutas[alias]()
+    return os.path.expanduser(ubicacion)
+
+
+def normalizar_ranura(tipo: str, valor: str) -> Any:
+    """
+    Normaliza el valor capturado para una ranura según su tipo.
+
+    Args:
+        tipo: Tipo de la ranura (texto, ruta, glob, url, ubicacion, recurso, entero, final, duracion, cantidad).
+        valor: Texto capturado.
+
+    Returns:
+        El valor normalizado.
+    """
+    valor = valor.strip()
+    if len(valor) >= 2 and valor[0] == valor[-1] and valor[0] in "\"'":
+        valor = valor[1:-1]
+    if tipo == "ruta":
+        return os.path.expanduser(valor)
+    if tipo == "glob":
+        return f".{valor.lower()}" if valor.lower() in EXTENSIONES_CONOCIDAS else valor
+    if tipo == "url":
+        return valor if re.match(r"^[a-z][a-z0-9+.-]*://", valor, re.IGNORECASE) else f"https://{valor}"
+    if tipo == "ubicacion":
+        return ALIAS_UBICACIONES.get(normalizar_texto(valor), os.path.expanduser(valor))
+    if tipo == "recurso":
+        valor = normalizar_texto(valor)
+        return ALIAS_RECURSOS.get(valor, valor)
+    if tipo == "entero":
+        return int(valor)
+    if tipo == "final":
+        # "últimas N líneas" o "el final" leen desde el final; "primeras N líneas", desde el principio
+        return not normalizar_texto(valor).startswith("primera")
+    if tipo == "cantidad":
+        valor = normalizar_texto(valor)
+        return NUMEROS_PALABRA.get(valor) or int(valor)
+    if tipo == "duracion":
+        # "5 minutos", "hora" (la última hora)... en segundos
+        cantidad, unidad = re.match(r"(?:(\d+) )?(\w+)", normalizar_texto(valor)).groups()
+        return int(cantidad or 1) * {"s": 1, "m": 60, "h": 3600}[unidad[0]]
+    return valor
+
+
+def compilar_gramatica(patrones: List[str]) -> "re.Pattern":
+    """
+    Combina los patrones alternativos de una intención en una única expresión.
+    Los grupos se renombran con un sufijo (__0, __1, ...) porque Python no admite
+    nombres de grupo repetidos.
+
+    Args:
+        patrones: Patrones de la intención, con los fragmentos de SINONIMOS_GRAMATICA.
+
+    Returns:
+        La expresión compilada.
+    """
+    alternativas = []
+    for indice, patron in enumerate(patrones):
+        for fragmento, expresion in SINONIMOS_GRAMATICA.items():
+            patron = patron.replace(fragmento, expresion)
+        patron = re.sub(r"\(\?P<(\w+)>", rf"(?P<\1__{indice}>", patron)
+        alternativas.append(f"(?:{patron})")
+    return re.compile("|".join(alternativas))
+
+
+# Gramáticas compiladas una sola vez al cargar el módulo
+GRAMATICA_COMPILADA = {
+    intencion: compilar_gramatica(definicion["patrones"])
+    for intencion, definicion in GRAMATICA_PARAMETROS.items()
+}
+GRAMATICA_RESCATE = {
+    intencion: compilar_gramatica([r"(?:^|\s)" + definicion["rescate"] + r"[?.!]*(?:\s|$)"])
+    for intencion, definicion in GRAMATICA_PARAMETROS.items() if "rescate" in definicion
+}
+
+
+def extraer_parametros_gramatica(comando: str, intencion: str) -> Dict[str, Any]:
+    """
+    Extrae los parámetros de un comando con la gramática de su intención, en una sola búsqueda.
+    El patrón se aplica al texto normalizado, pero los valores se toman del texto original
+    para conservar mayúsculas y acentos en nombres de archivo y comandos.
+
+    Args:
+        comando: Comando del usuario.
+        intencion: Intención detectada.
+
+    Returns:
+        Diccionario con los parámetros extraídos.
+    """
+    definicion = GRAMATICA_PARAMETROS.get(intencion)
+    if definicion is None:
+        return {}
+
+    comando = comando.strip()
+    normalizado = normalizar_texto(comando)
+    # La normalización conserva la longitud salvo en casos raros de lower()
+    original = comando if len(normalizado) == len(comando) else normalizado
+
+    parametros = {}
+    match = GRAMATICA_COMPILADA[intencion].search(normalizado)
+    if match is None and intencion in GRAMATICA_RESCATE:
+        match = GRAMATICA_RESCATE[intencion].search(normalizado)
+    if match:
+        for grupo, valor in match.groupdict().items():
+            if valor is None:
+                continue
+            ranura = grupo.split("__", 1)[0]
+            inicio, fin = match.span(grupo)
+            parametros[ranura] = normalizar_ranura(definicion["ranuras"][ranura], original[inicio:fin])
+        if any(valor.strip(" \"'").strip() in PALABRAS_VACIAS or not valor.strip(" \"'")
+               for valor in match.groupdict().values() if valor is not None):
+            logger.info(f"Parámetros sin contenido en '{comando}': se descarta la gramática de {intencion}")
+            parametros, match = {}, None
+
+    # Sin coincidencia de la gramática no se completa nada con valores por defecto: una palabra
+    # clave suelta ("lista la compra") no basta para actuar sin el modelo de lenguaje
+    if match:
+        for ranura, valor in definicion.get("defecto", {}).items():
+            parametros.setdefault(ranura, valor)
+
+    # Las rutas relativas a una ubicación conocida se resuelven directamente
+    if "ruta" in parametros and "ubicacion" in parametros and not os.path.isabs(parametros["ruta"]):
+        parametros["ruta"] = os.path.join(ruta_de_ubicacion(parametros.pop("ubicacion")), parametros["ruta"])
+    return parametros
+
+
+def parametros_completos(intencion: str, parametros: Dict[str, Any]) -> bool:
+    """
+    Indica si están todos los parámetros necesarios para resolver la intención localmente.
+
+    Args:
+        intencion: Intención detectada.
+        parametros: Parámetros extraídos.
+
+    Returns:
+        True si no falta ningún parámetro requerido.
+    """
+    return all(any(alternativa in parametros for alternativa in (ranura if isinstance(ranura, tuple) else (ranura,)))
+               for ranura in PARAMETROS_REQUERIDOS.get(intencion, []))
+
+
+# Ranuras que deben nombrar algo que ya existe para resolver la intención localmente;
+# si no existe, el modelo de lenguaje puede interpretar mejor el comando
+RANURAS_EXISTENTES = {
+    "leer_archivo": "ruta",
+    "abrir_archivo": "ruta",
+    "copiar_archivo": "origen",
+    "mover_archivo": "origen",
+    "renombrar_archivo": "origen",
+}
+
+# Órdenes internas de la shell, que no están en el PATH
+ORDENES_INTERNAS_SHELL = {"cd", "echo", "export", "set", "type", "dir", "pwd", "alias", "ver", "cls"}
+
+# Metacaracteres de la shell: encadenan, redirigen o sustituyen órdenes, así que un comando
+# que los contiene ya no es solo el programa de su primera palabra
+METACARACTERES_SHELL = set(";&|$`()<>\n")
+
+
+def comando_ejecutable(comando: str) -> bool:
+    """
+    Indica si un comando de shell se puede ejecutar sin revisión: es una sola orden (sin
+    metacaracteres de la shell), su primera palabra es un ejecutable del PATH (o una orden
+    interna de la shell) y no borra archivos (ni con find -delete o find -exec rm).
+
+    Args:
+        comando: Comando de shell.
+
+    Returns:
+        True si el comando se puede ejecutar directamente.
+    """
+    partes = comando.split()
+    if not partes or METACARACTERES_SHELL & set(comando) or orden_borra_archivos(comando):
+        return False
+    return partes[0].lower() in ORDENES_INTERNAS_SHELL or shutil.which(partes[0]) is not None
+
+
+def parametros_validos(intencion: str, parametros: Dict[str, Any]) -> bool:
+    """
+    Comprueba que los parámetros extraídos tienen sentido antes de actuar sin el modelo
+    de lenguaje: los archivos de origen existen y los comandos son ejecutables conocidos
+    que no borran nada.
+
+    Args:
+        intencion: Intención detectada.
+        parametros: Parámetros extraídos.
+
+    Returns:
+        True si la intención se puede resolver localmente con estos parámetros.
+    """
+    ranura = RANURAS_EXISTENTES.get(intencion)
+    if ranura and isinstance(parametros.get(ranura), str) and not os.path.exists(parametros[ranura]):
+        return False
+    if intencion == "ejecutar_comando":
+        return comando_ejecutable(parametros["comando"])
+    return True
+
+
+def variables_plantilla(intencion: str, parametros: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Prepara las variables con las que se ejecuta la plantilla de una intención.
+
+    Args:
+        intencion: Intención detectada.
+        parametros: Parámetros extraídos.
+
+    Returns:
+        Diccionario con los parámetros requeridos y los opcionales (o su valor por defecto),
+        o None si falta algún parámetro requerido.
+    """
+    variables = dict(DEFECTO_PLANTILLAS.get(intencion, {}))
+    faltan = [ranura for ranura in PARAMETROS_REQUERIDOS.get(intencion, [])
+              if ranura not in parametros and ranura not in variables]
+    if faltan:
+        logger.error(f"Faltan los parámetros {faltan} para la plantilla de {intencion}")
+        return None
+    for ranura in list(PARAMETROS_REQUERIDOS.get(intencion, [])) + list(variables):
+        if ranura in parametros:
+            variables[ranura] = parametros[ranura]
+    return variables
+
+
+# Máximo de caracteres que devuelve el manejador de leer_archivo
+MAX_CARACTERES_LECTURA = 4000
+
+# Líneas que se leen por defecto del principio o del final de un archivo
+MAX_LINEAS_LECTURA = 100
+
+# Tamaño de los bloques con los que se recorre un archivo
+TAMANO_BLOQUE_LECTURA = 1024 * 1024
+
+# Marcas de orden de bytes y la codificación que indican (las de UTF-32 antes que las de UTF-16)
+MARCAS_CODIFICACION = [
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+
+
+def resolver_destino(destino: str, origen: str) -> str:
+    """
+    Calcula la ruta final de una copia o movimiento: si el destino es un directorio
+    (o un alias de ubicación) el archivo conserva su nombre.
+
+    Args:
+        destino: Destino indicado por el usuario.
+        origen: Ruta del archivo de origen.
+
+    Returns:
+        La ruta de destino.
+    """
+    destino = ruta_de_ubicacion(destino)
+    if os.path.isdir(destino):
+        return os.path.join(destino, os.path.basename(origen.rstrip(os.sep)))
+    return destino
+
+
+def crear_comparador(patron: str, difusa: bool = False) -> Callable[[str], bool]:
+    """
+    Crea la función que decide si un nombre de archivo coincide con el patrón, sin
+    distinguir mayúsculas. Con comodines (*, ?, [) se usa fnmatch; si no, basta con que
+    el nombre contenga el patrón. En modo difuso las letras del patrón tienen que aparecer
+    en orden, aunque haya otras entre medias (y sin tener en cuenta los acentos).
+
+    Args:
+        patron: Patrón de búsqueda ("" coincide con todo).
+        difusa: Si es True se usa la coincidencia difusa.
+
+    Returns:
+        Función nombre -> bool.
+    """
+    patron = patron.strip().lower()
+    if not patron:
+        return lambda nombre: True
+    if difusa:
+        letras = normalizar_texto(patron).replace(" ", "")
+
+        def coincide_difusa(nombre: str) -> bool:
+            restantes = iter(normalizar_texto(nombre))
+            return all(letra in restantes for letra in letras)
+        return coincide_difusa
+    if any(comodin in patron for comodin in "*?["):
+        expresion = re.compile(fnmatch.translate(patron), re.IGNORECASE)
+        return lambda nombre: expresion.match(nombre) is not None
+    return lambda nombre: patron in nombre.lower()
+
+
+def compilar_ignorados(ignorar: Optional[List[str]]) -> Optional["re.Pattern"]:
+    """
+    Compila la lista de nombres de directorio a ignorar (admite comodines) en una sola expresión.
+
+    Args:
+        ignorar: Patrones de nombre, p. ej. [".*", "node_modules"].
+
+    Returns:
+        La expresión compilada o None si la lista está vacía.
+    """
+    return re.compile("|".join(fnmatch.translate(patron) for patron in ignorar)) if ignorar else None
+
+
+# Directorios que no se recorren por defecto al buscar ni al indexar
+IGNORADOS_BUSQUEDA = [".*", "__pycache__", "node_modules", "venv", "site-packages"]
+
+
+class MotorBusqueda:
+    """
+    Búsqueda recursiva de archivos con os.scandir. Cada directorio se lee en un hilo
+    del pool y sus subdirectorios se encolan en cuanto se conocen, así que los primeros
+    resultados llegan enseguida aunque el árbol sea enorme; la búsqueda se detiene al
+    llegar al límite de resultados o cuando el consumidor deja de pedir. No sigue enlaces
+    simbólicos a directorios (evita ciclos) y salta los que coinciden con la lista de ignorados.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el motor.
+
+        Args:
+            config: Sección "busqueda" de la configuración.
+        """
+        config = config or {}
+        self.hilos = max(1, int(config.get("hilos", 8)))
+        self.profundidad_max = config.get("profundidad_max")
+        self.max_resultados = config.get("max_resultados", 1000)
+        self.difusa = bool(config.get("difusa", False))
+        self.ignorados = compilar_ignorados(config.get("ignorar", IGNORADOS_BUSQUEDA))
+
+    def explorar(self, directorio: str, coincide: Callable[[str], bool], incluir_directorios: bool,
+                 cancelado: threading.Event) -> Tuple[List[str], List[str]]:
+        """
+        Lee un directorio.
+
+        Returns:
+            Tupla (rutas que coinciden, subdirectorios a explorar).
+        """
+        encontrados, subdirectorios = [], []
+        try:
+            with os.scandir(directorio) as entradas:
+                for entrada in entradas:
+                    if cancelado.is_set():
+                        break
+                    try:
+                        es_directorio = entrada.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if es_directorio:
+                        if self.ignorados is None or not self.ignorados.match(entrada.name):
+                            subdirectorios.append(entrada.path)
+                        if incluir_directorios and coincide(entrada.name):
+                            encontrados.append(entrada.path)
+                    elif coincide(entrada.name):
+                        encontrados.append(entrada.path)
+        except OSError:
+            # Sin permiso o desaparecido durante la búsqueda: se salta
+            pass
+        encontrados.sort()
+        return encontrados, subdirectorios
+
+    def buscar(self, patron: str, ruta_base: str, profundidad_max: Optional[int] = None,
+               max_resultados: Optional[int] = None, difusa: Optional[bool] = None) -> Iterator[str]:
+        """
+        Busca archivos cuyo nombre coincide con el patrón, devolviéndolos según aparecen.
+        Con el patrón vacío solo se lista el directorio (sin bajar a subcarpetas), como hacía
+        la plantilla original con glob.
+
+        Args:
+            patron: Patrón de búsqueda (ver crear_comparador).
+            ruta_base: Directorio en el que empezar.
+            profundidad_max: Niveles de subcarpetas a recorrer (0, solo ruta_base); por defecto sin límite.
+            max_resultados: Número máximo de resultados; por defecto el de la configuración.
+            difusa: Coincidencia difusa; por defecto la de la configuración.
+
+        Yields:
+            La ruta de cada archivo encontrado.
+        """
+        if profundidad_max is None:
+            profundidad_max = 0 if not patron.strip() else self.profundidad_max
+        if max_resultados is None:
+            max_resultados = self.max_resultados
+        coincide = crear_comparador(patron, self.difusa if difusa is None else difusa)
+        incluir_directorios = not patron.strip()
+
+        cancelado = threading.Event()
+        terminados = queue.Queue()
+        pool = ThreadPoolExecutor(self.hilos, thread_name_prefix="jarvis-busqueda")
+        pendientes = 0
+
+        def lanzar(directorio: str, profundidad: int) -> None:
+            nonlocal pendientes
+            futuro = pool.submit(self.explorar, directorio, coincide, incluir_directorios, cancelado)
+            futuro.profundidad = profundidad
+            futuro.add_done_callback(terminados.put)
+            pendientes += 1
+
+        emitidos = 0
+        try:
+            lanzar(os.path.expanduser(ruta_base), 0)
+            while pendientes:
+                futuro = terminados.get()
+                pendientes -= 1
+                encontrados, subdirectorios = futuro.result()
+                # Primero se encolan los subdirectorios, para que el pool siga trabajando
+                # mientras el consumidor procesa los resultados
+                if profundidad_max is None or futuro.profundidad < profundidad_max:
+                    for subdirectorio in subdirectorios:
+                        lanzar(subdirectorio, futuro.profundidad + 1)
+                for ruta in encontrados:
+                    yield ruta
+                    emitidos += 1
+                    if max_resultados and emitidos >= max_resultados:
+                        return
+        finally:
+            cancelado.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class IndiceArchivos:
+    """
+    Índice persistente de nombres de archivo, al estilo de locate, de las ubicaciones que
+    conoce JARVIS (escritorio, documentos, descargas y las raíces configuradas).
+    Guarda cada directorio con su mtime, sus archivos y sus subdirectorios. Crear, borrar
+    o renombrar una entrada cambia el mtime de su directorio, así que al refrescar solo se
+    vuelven a leer los directorios cambiados: un refresco sin cambios cuesta un stat por
+    directorio. Las consultas no tocan el disco: se resuelven con str.find sobre un único
+    texto con todos los nombres en minúsculas, y bisect para pasar de posición a archivo.
+    Un hilo en segundo plano carga el índice guardado y lo refresca periódicamente; arranca
+    con la primera consulta, así que los chatbots que nunca buscan no recorren el disco.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, ignorar: Optional[List[str]] = None):
+        """
+        Inicializa el índice (vacío hasta que se carga o se refresca).
+
+        Args:
+            config: Sección "indice_archivos" de la configuración.
+            ignorar: Nombres de directorio que no se indexan (por defecto los de la búsqueda).
+        """
+        config = config or {}
+        self.archivo = os.path.expanduser(config.get("archivo", "~/jarvis_indice_archivos.json.gz"))
+        raices = [ruta_de_ubicacion(alias) for alias in ("escritorio", "documentos", "descargas")]
+        raices += [os.path.expanduser(raiz) for raiz in config.get("raices", [])]
+        # Sin duplicados ni raíces dentro de otras
+        self.raices = []
+        for raiz in sorted({os.path.abspath(raiz) for raiz in raices}):
+            if not any(raiz.startswith(os.path.join(anterior, "")) for anterior in self.raices):
+                self.raices.append(raiz)
+        self.refresco = float(config.get("refresco_segundos", 300))
+        self.ignorados = compilar_ignorados(IGNORADOS_BUSQUEDA if ignorar is None else ignorar)
+        self.directorios = {}
+        # Estructuras de consulta (ver compilar); None hasta que el índice está listo
+        self.consulta = None
+        self.bloqueo = threading.Lock()
+        # Hay cambios que todavía no se han escrito en el archivo del índice
+        self.sin_guardar = False
+        self.detenido = threading.Event()
+        self.hilo = None
+        # Las consultas llegan de varios hilos y solo la primera arranca el hilo del índice
+        self.arranque = threading.Lock()
+        # Chatbots que usan el índice (ver obtener_indice_archivos)
+        self.usuarios = 0
+
+    def cargar(self) -> bool:
+        """
+        Carga el índice guardado.
+
+        Returns:
+            True si se cargó.
+        """
+        try:
+            with gzip.open(self.archivo, "rt", encoding="utf-8") as f:
+                datos = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el índice de archivos {self.archivo}: {e}")
+            return False
+        if datos.get("version") != 1:
+            return False
+        with self.bloqueo:
+            self.directorios = {directorio: (mtime, archivos, subdirectorios)
+                                for directorio, (mtime, archivos, subdirectorios) in datos["directorios"].items()}
+            self.compilar()
+        return True
+
+    def guardar(self) -> None:
+        """Guarda el índice (comprimido) de forma atómica."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.archivo)), exist_ok=True)
+        temporal = f"{self.archivo}.tmp"
+        with gzip.open(temporal, "wt", encoding="utf-8", compresslevel=1) as f:
+            json.dump({"version": 1, "directorios": self.directorios}, f, separators=(",", ":"), sort_keys=True)
+        os.replace(temporal, self.archivo)
+
+    def leer_directorio(self, directorio: str) -> Tuple[List[str], List[str]]:
+        """Lee un directorio: (archivos, subdirectorios a indexar), ambos ordenados."""
+        archivos, subdirectorios = [], []
+        try:
+            with os.scandir(directorio) as entradas:
+                for entrada in entradas:
+                    try:
+                        if entrada.is_dir(follow_symlinks=False):
+                            if self.ignorados is None or not self.ignorados.match(entrada.name):
+                                subdirectorios.append(entrada.name)
+                        else:
+                            archivos.append(entrada.name)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return sorted(archivos), sorted(subdirectorios)
+
+    def refrescar(self, bajo: Optional[str] = None, guardar: bool = True) -> int:
+        """
+        Recorre las raíces (o solo la parte indexada bajo una ruta) y vuelve a leer solo los
+        directorios cuyo mtime ha cambiado (o que son nuevos); los que han desaparecido
+        salen del índice.
+
+        Args:
+            bajo: Si se indica, solo se revisan los directorios dentro de esta ruta.
+            guardar: Si es False los cambios no se escriben en disco todavía (lo hará el
+                siguiente refresco que guarde), para no retrasar una consulta.
+
+        Returns:
+            El número de directorios que se han vuelto a leer.
+        """
+        with self.bloqueo:
+            if bajo is None:
+                raices, nuevos = self.raices, {}
+            else:
+                base = os.path.abspath(bajo)
+                prefijo = os.path.join(base, "")
+                raices = [raiz for raiz in self.raices if raiz == base or raiz.startswith(prefijo)]
+                if not raices and self.cubre(base):
+                    raices = [base]
+                # Lo que queda fuera de la ruta se conserva tal cual
+                nuevos = {directorio: datos for directorio, datos in self.directorios.items()
+                          if directorio != base and not directorio.startswith(prefijo)}
+            releidos = 0
+            pendientes = [raiz for raiz in raices if os.path.isdir(raiz)]
+            while pendientes:
+                directorio = pendientes.pop()
+                try:
+                    mtime = os.stat(directorio).st_mtime_ns
+                except OSError:
+                    continue
+                anterior = self.directorios.get(directorio)
+                if anterior is not None and anterior[0] == mtime:
+                    archivos, subdirectorios = anterior[1], anterior[2]
+                else:
+                    archivos, subdirectorios = self.leer_directorio(directorio)
+                    releidos += 1
+                nuevos[directorio] = (mtime, archivos, subdirectorios)
+                pendientes.extend(os.path.join(directorio, nombre) for nombre in subdirectorios)
+            cambiado = releidos or nuevos.keys() != self.directorios.keys()
+            self.directorios = nuevos
+            if cambiado or self.consulta is None:
+                self.compilar()
+        if cambiado and not guardar:
+            self.sin_guardar = True
+        elif cambiado or self.sin_guardar:
+            try:
+                self.guardar()
+                self.sin_guardar = False
+            except OSError as e:
+                logger.warning(f"No se pudo guardar el índice de archivos: {e}")
+        return releidos
+
+    def compilar(self) -> None:
+        """
+        Construye las estructuras de consulta a partir de los directorios. Las rutas completas
+        no se guardan: se componen solo para los archivos que coinciden.
+        """
+        directorios = list(self.directorios)
+        listas = [self.directorios[directorio][1] for directorio in directorios]
+        originales = list(itertools.chain.from_iterable(listas))
+        texto = "\n".join(originales).lower()
+        nombres = texto.split("\n") if originales else []
+        if len(nombres) != len(originales):
+            # Algún nombre contiene un salto de línea
+            nombres = [nombre.lower().replace("\n", " ") for nombre in originales]
+            texto = "\n".join(nombres)
+        texto += "\n"
+        inicios = list(itertools.accumulate(map(len, nombres), lambda total, longitud: total + longitud + 1,
+                                            initial=0))
+        # Posición del primer archivo de cada directorio (para pasar de archivo a directorio)
+        limites = list(itertools.accumulate(map(len, listas), initial=0))
+        self.consulta = (texto, inicios, nombres, originales, directorios, limites)
+
+    @property
+    def total(self) -> int:
+        return len(self.consulta[2]) if self.consulta else 0
+
+    def cubre(self, ruta: str) -> bool:
+        """Indica si la ruta está dentro de alguna de las raíces indexadas."""
+        ruta = os.path.join(os.path.abspath(ruta), "")
+        return any(ruta.startswith(os.path.join(raiz, "")) for raiz in self.raices)
+
+    def consultar(self, patron: str, ruta_base: Optional[str] = None, max_resultados: Optional[int] = 1000,
+                  difusa: bool = False) -> Optional[List[str]]:
+        """
+        Busca en el índice los archivos cuyo nombre coincide con el patrón, con la misma
+        semántica que MotorBusqueda (subcadena sin distinguir mayúsculas, comodines o difusa).
+
+        Args:
+            patron: Patrón de búsqueda.
+            ruta_base: Si se indica, solo se devuelven archivos dentro de esta ruta.
+            max_resultados: Número máximo de resultados (0 o None, sin límite).
+            difusa: Coincidencia difusa.
+
+        Returns:
+            Las rutas encontradas, o None si el índice todavía no está listo.
+        """
+        if self.consulta is None:
+            self.iniciar()
+            return None
+        # Antes de responder se revisa el mtime de los directorios consultados, para que
+        # los archivos creados desde el último refresco (o desde el índice guardado) aparezcan
+        self.refrescar(ruta_base, guardar=False)
+        consulta = self.consulta
+        texto, inicios, nombres, originales, directorios, limites = consulta
+        base = os.path.abspath(ruta_base) if ruta_base else None
+        prefijo = os.path.join(base, "") if base else ""
+        patron = patron.strip().lower()
+        comodines = any(comodin in patron for comodin in "*?[")
+        # Fragmento literal más largo del patrón, para localizar candidatos con str.find
+        literal = "" if difusa else max(re.split(r"[*?]", re.sub(r"\[[^\]]*\]", "*", patron)), key=len)
+        comparador = crear_comparador(patron, difusa) if (comodines or difusa or not literal) else None
+
+        def candidatos() -> Iterator[int]:
+            if literal and "\n" not in literal:
+                posicion = texto.find(literal)
+                while posicion != -1:
+                    i = bisect.bisect_right(inicios, posicion) - 1
+                    yield i
+                    posicion = texto.find(literal, inicios[i + 1])
+            else:
+                yield from range(len(nombres))
+
+        resultados = []
+        for i in candidatos():
+            if comparador is not None and not comparador(nombres[i]):
+                continue
+            directorio = directorios[bisect.bisect_right(limites, i) - 1]
+            if base and directorio != base and not directorio.startswith(prefijo):
+                continue
+            resultados.append(os.path.join(directorio, originales[i]))
+            if max_resultados and len(resultados) >= max_resultados:
+                break
+        return resultados
+
+    def buscar_nombre(self, nombre: str) -> Optional[str]:
+        """
+        Busca un archivo por su nombre exacto (sin distinguir mayúsculas).
+
+        Args:
+            nombre: Nombre del archivo, p. ej. "informe.docx".
+
+        Returns:
+            La ruta del archivo existente modificado más recientemente, o None.
+        """
+        candidatos = [ruta for ruta in self.consultar(nombre, max_resultados=0) or []
+                      if os.path.basename(ruta).lower() == nombre.lower() and os.path.exists(ruta)]
+        return max(candidatos, key=os.path.getmtime) if candidatos else None
+
+    def iniciar(self) -> None:
+        """Arranca el hilo que carga el índice y lo mantiene actualizado (si no está ya en marcha)."""
+        with self.arranque:
+            if self.hilo is None and not self.detenido.is_set():
+                self.hilo = threading.Thread(target=self.mantener, name="jarvis-indice", daemon=True)
+                self.hilo.start()
+
+    def mantener(self) -> None:
+        if self.cargar():
+            logger.info(f"Índice de archivos cargado: {self.total} archivos")
+        while not self.detenido.is_set():
+            try:
+                inicio = time.perf_counter()
+                releidos = self.refrescar()
+                logger.debug(f"Índice de archivos refrescado: {releidos} directorios releídos, "
+                             f"{self.total} archivos, {(time.perf_counter() - inicio) * 1000:.0f} ms")
+            except Exception as e:
+                logger.error(f"Error al refrescar el índice de archivos: {e}")
+            if self.detenido.wait(self.refresco if self.refresco > 0 else None):
+                break
+
+    def detener(self) -> None:
+        """Detiene el hilo de actualización."""
+        self.detenido.set()
+
+
+# Índices de archivos compartidos por los chatbots del proceso, por archivo de índice
+_indices_archivos = {}
+_bloqueo_indices = threading.Lock()
+
+
+def obtener_indice_archivos(config: Optional[Dict[str, Any]] = None,
+                            ignorar: Optional[List[str]] = None) -> IndiceArchivos:
+    """
+    Devuelve el índice de archivos compartido para esta configuración, creándolo si no
+    existe. Así los chatbots de benchmark, batch o sesiones no recorren cada uno el disco
+    ni escriben a la vez el mismo archivo de índice.
+
+    Args:
+        config: Sección "indice_archivos" de la configuración.
+        ignorar: Nombres de directorio que no se indexan.
+
+    Returns:
+        El índice compartido (sin arrancar: arranca con la primera consulta).
+    """
+    archivo = os.path.expanduser((config or {}).get("archivo", "~/jarvis_indice_archivos.json.gz"))
+    with _bloqueo_indices:
+        indice = _indices_archivos.get(archivo)
+        if indice is None:
+            indice = _indices_archivos[archivo] = IndiceArchivos(config, ignorar)
+        indice.usuarios += 1
+        return indice
+
+
+def liberar_indice_archivos(indice: IndiceArchivos) -> None:
+    """
+    Deja de usar un índice obtenido con obtener_indice_archivos; el último en liberarlo lo detiene.
+
+    Args:
+        indice: Índice compartido.
+    """
+    with _bloqueo_indices:
+        indice.usuarios -= 1
+        if indice.usuarios > 0:
+            return
+        if _indices_archivos.get(indice.archivo) is indice:
+            del _indices_archivos[indice.archivo]
+    indice.detener()
+
+
+# Bytes del principio de un archivo en los que se buscan bytes nulos para decidir si es binario
+MUESTRA_BINARIO = 8192
+
+# Caracteres como máximo de cada línea que se devuelve en una coincidencia
+MAX_CARACTERES_LINEA = 200
+
+
+def expresion_contenido(texto: str, distinguir_mayusculas: bool = False) -> "re.Pattern":
+    """
+    Compila el texto a buscar en una expresión sobre los bytes (UTF-8) de los archivos.
+    IGNORECASE sobre bytes solo cubre ASCII, así que las letras no ASCII ("ñ", "á") se
+    convierten en una alternativa entre su minúscula y su mayúscula.
+
+    Args:
+        texto: Texto literal a buscar.
+        distinguir_mayusculas: Si es False, no se distinguen mayúsculas de minúsculas.
+
+    Returns:
+        La expresión compilada (de bytes).
+    """
+    if distinguir_mayusculas:
+        return re.compile(re.escape(texto.encode("utf-8")))
+    partes = []
+    for caracter in texto:
+        if not caracter.isascii() and caracter.lower() != caracter.upper():
+            partes.append(b"(?:" + re.escape(caracter.lower().encode("utf-8")) + b"|"
+                          + re.escape(caracter.upper().encode("utf-8")) + b")")
+        else:
+            partes.append(re.escape(caracter.encode("utf-8")))
+    return re.compile(b"".join(partes), re.IGNORECASE)
+
+
+def buscar_en_archivo(ruta: str, expresion: "re.Pattern", max_coincidencias: int, umbral_mmap: int,
+                      max_tamano: int) -> List[Tuple[int, str]]:
+    """
+    Busca una expresión en un archivo de texto. Los archivos a partir de umbral_mmap bytes
+    se proyectan en memoria con mmap en lugar de leerse enteros; los binarios (con bytes
+    nulos al principio), los vacíos y los mayores de max_tamano se saltan.
+
+    Args:
+        ruta: Archivo en el que buscar.
+        expresion: Expresión de bytes (ver expresion_contenido).
+        max_coincidencias: Número máximo de líneas a devolver (0, sin límite).
+        umbral_mmap: Tamaño a partir del cual se usa mmap.
+        max_tamano: Tamaño máximo de archivo (0, sin límite).
+
+    Returns:
+        Lista de (número de línea, línea) de las líneas que contienen la expresión.
+    """
+    coincidencias = []
+    try:
+        with open(ruta, "rb") as f:
+            tamano = os.fstat(f.fileno()).st_size
+            if not tamano or (max_tamano and tamano > max_tamano) or b"\0" in f.read(MUESTRA_BINARIO):
+                return coincidencias
+            if tamano >= umbral_mmap:
+                datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                f.seek(0)
+                datos = f.read()
+    except (OSError, ValueError):
+        return coincidencias
+
+    try:
+        linea, contado, siguiente = 1, 0, 0
+        for match in expresion.finditer(datos):
+            if match.start() < siguiente:
+                # Otra coincidencia en una línea ya devuelta
+                continue
+            inicio = datos.rfind(b"\n", 0, match.start()) + 1
+            fin = datos.find(b"\n", match.end())
+            fin = len(datos) if fin == -1 else fin
+            linea += datos[contado:inicio].count(b"\n")
+            contado = inicio
+            texto = datos[inicio:min(fin, inicio + MAX_CARACTERES_LINEA * 4)].decode("utf-8", errors="replace")
+            coincidencias.append((linea, texto.strip()[:MAX_CARACTERES_LINEA]))
+            siguiente = fin + 1
+            if max_coincidencias and len(coincidencias) >= max_coincidencias:
+                break
+    finally:
+        if isinstance(datos, mmap.mmap):
+            datos.close()
+    return coincidencias
+
+
+def buscar_en_lote(rutas: List[str], expresion: "re.Pattern", max_coincidencias: int, umbral_mmap: int,
+                   max_tamano: int) -> List[Tuple[str, List[Tuple[int, str]]]]:
+    """
+    Busca en un lote de archivos (la unidad de trabajo de los procesos de BuscadorContenido).
+
+    Returns:
+        Lista de (ruta, coincidencias) de los archivos con alguna coincidencia.
+    """
+    resultados = []
+    restantes = max_coincidencias
+    for ruta in rutas:
+        coincidencias = buscar_en_archivo(ruta, expresion, restantes, umbral_mmap, max_tamano)
+        if coincidencias:
+            resultados.append((ruta, coincidencias))
+            if max_coincidencias:
+                restantes -= len(coincidencias)
+                if restantes <= 0:
+                    break
+    return resultados
+
+
+class BuscadorContenido:
+    """
+    Búsqueda de texto dentro de archivos. Los archivos candidatos (por nombre, con
+    MotorBusqueda o con la lista que se indique) se reparten en lotes entre un pool de
+    procesos, que buscan con expresiones de bytes sobre mmap o sobre el contenido leído
+    según el tamaño. Solo hay unos pocos lotes en vuelo a la vez: al llegar al número
+    máximo de coincidencias se cancelan los pendientes y se deja de listar archivos.
+    El pool se crea en el primer uso y se reutiliza; dentro de un proceso que no puede
+    tener hijos (los del sandbox) se usan hilos.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, motor: Optional[MotorBusqueda] = None):
+        """
+        Inicializa el buscador.
+
+        Args:
+            config: Sección "busqueda_contenido" de la configuración.
+            motor: Motor con el que se listan los archivos candidatos.
+        """
+        config = config or {}
+        self.procesos = max(1, int(config.get("procesos") or min(4, os.cpu_count() or 1)))
+        self.archivos_por_lote = max(1, int(config.get("archivos_por_lote", 32)))
+        self.max_coincidencias = int(config.get("max_coincidencias", 200))
+        self.umbral_mmap = int(config.get("umbral_mmap_kb", 256)) * 1024
+        self.max_tamano = int(config.get("max_tamano_mb", 512)) * 1024 * 1024
+        self.motor = motor or MotorBusqueda()
+        self.pool = None
+        self.bloqueo = threading.Lock()
+
+    def obtener_pool(self) -> Any:
+        """Devuelve el pool de trabajo, creándolo en el primer uso."""
+        with self.bloqueo:
+            if self.pool is None:
+                if self.procesos > 1 and not multiprocessing.current_process().daemon:
+                    self.pool = ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self.pool = ThreadPoolExecutor(self.procesos, thread_name_prefix="jarvis-contenido")
+            return self.pool
+
+    def buscar(self, texto: str, ruta_base: str = ".", patron: str = "", max_coincidencias: Optional[int] = None,
+               distinguir_mayusculas: bool = False, rutas: Optional[List[str]] = None) -> Iterator[Tuple[str, int, str]]:
+        """
+        Busca un texto dentro de los archivos, devolviendo las coincidencias según aparecen.
+
+        Args:
+            texto: Texto literal a buscar.
+            ruta_base: Directorio en el que buscar (también en subcarpetas).
+            patron: Patrón de nombre de los archivos en los que buscar (ver crear_comparador); por defecto todos.
+            max_coincidencias: Número máximo de líneas; por defecto el de la configuración (0, sin límite).
+            distinguir_mayusculas: Si es True, distingue mayúsculas de minúsculas.
+            rutas: Archivos en los que buscar, en lugar de listarlos con el motor de búsqueda.
+
+        Yields:
+            Tuplas (ruta, número de línea, línea).
+        """
+        if not texto:
+            return
+        if max_coincidencias is None:
+            max_coincidencias = self.max_coincidencias
+        expresion = expresion_contenido(texto, distinguir_mayusculas)
+        if rutas is None:
+            rutas = self.motor.buscar(patron.strip() or "*", ruta_base, max_resultados=0)
+        rutas = iter(rutas)
+        pool = self.obtener_pool()
+        en_vuelo = set()
+
+        def lanzar() -> None:
+            lote = list(itertools.islice(rutas, self.archivos_por_lote))
+            if lote:
+                en_vuelo.add(pool.submit(buscar_en_lote, lote, expresion, max_coincidencias,
+                                         self.umbral_mmap, self.max_tamano))
+
+        emitidas = 0
+        try:
+            for _ in range(self.procesos * 2):
+                lanzar()
+            while en_vuelo:
+                terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                en_vuelo.difference_update(terminados)
+                for futuro in terminados:
+                    # Se lanza otro lote antes de entregar resultados, para que el pool siga trabajando
+                    lanzar()
+                    for ruta, coincidencias in futuro.result():
+                        for linea, contenido in coincidencias:
+                            yield ruta, linea, contenido
+                            emitidas += 1
+                            if max_coincidencias and emitidas >= max_coincidencias:
+                                return
+        finally:
+            for futuro in en_vuelo:
+                futuro.cancel()
+
+    def cerrar(self) -> None:
+        """Detiene el pool de trabajo."""
+        with self.bloqueo:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+def detectar_codificacion(muestra: bytes) -> Tuple[str, int]:
+    """
+    Detecta la codificación de un archivo a partir de sus primeros bytes: marca de orden
+    de bytes, UTF-8 válido, charset_normalizer si está instalado o, si no, cp1252/latin-1.
+
+    Args:
+        muestra: Primeros bytes del archivo.
+
+    Returns:
+        Tupla (codificación, longitud de la marca de orden de bytes que hay que saltar).
+
+    Raises:
+        ValueError: Si el archivo parece binario.
+    """
+    for marca, codificacion in MARCAS_CODIFICACION:
+        if muestra.startswith(marca):
+            return codificacion, len(marca)
+    if b"\0" in muestra:
+        raise ValueError("el archivo parece binario")
+    try:
+        # final=False: la muestra puede cortar un carácter por la mitad
+        codecs.getincrementaldecoder("utf-8")().decode(muestra, final=False)
+        return "utf-8", 0
+    except UnicodeDecodeError:
+        pass
+    if CHARSET_NORMALIZER_DISPONIBLE:
+        mejor = detectar_codificacion_bytes(muestra).best()
+        if mejor is not None:
+            return mejor.encoding, 0
+    return ("cp1252" if SISTEMA_OPERATIVO == "Windows" else "latin-1"), 0
+
+
+def posiciones_salto(bloque: bytes, salto: bytes, desplazamiento: int) -> Iterator[int]:
+    """
+    Posiciones de los saltos de línea de un bloque. En UTF-16/32 el salto ocupa varios
+    bytes y solo cuenta si está alineado con el tamaño de carácter.
+
+    Args:
+        bloque: Bytes leídos.
+        salto: El salto de línea en la codificación del archivo.
+        desplazamiento: Posición del bloque en el archivo, descontada la marca de orden de bytes.
+
+    Yields:
+        La posición (dentro del bloque) de cada salto.
+    """
+    unidad = len(salto)
+    posicion = bloque.find(salto)
+    while posicion != -1:
+        if unidad == 1 or (desplazamiento + posicion) % unidad == 0:
+            yield posicion
+            posicion = bloque.find(salto, posicion + unidad)
+        else:
+            posicion = bloque.find(salto, posicion + 1)
+
+
+def formatear_bytes(cantidad: int) -> str:
+    """Formatea un tamaño en bytes con la unidad más adecuada (B, KB, MB, GB)."""
+    for unidad in ("B", "KB", "MB"):
+        if cantidad < 1024:
+            return f"{cantidad:.0f} {unidad}" if unidad == "B" else f"{cantidad:.1f} {unidad}"
+        cantidad /= 1024
+    return f"{cantidad:.1f} GB"
+
+
+class ResultadoLectura:
+    """Fragmento acotado de un archivo de texto, con su posición (en líneas y bytes) dentro del archivo."""
+
+    def __init__(self, ruta: str, tamano: int, codificacion: str, inicio: int, fin: int, texto: str,
+                 lineas: int, primera_linea: Optional[int] = None):
+        self.ruta = ruta
+        self.tamano = tamano
+        self.codificacion = codificacion
+        self.inicio = inicio
+        self.fin = fin
+        self.texto = texto
+        self.lineas = lineas
+        self.primera_linea = primera_linea
+
+    def metadatos(self) -> Dict[str, Any]:
+        """Lo que se guarda en memoria de la lectura: la ruta y las posiciones, no el contenido."""
+        return {"ruta": self.ruta, "tamano": self.tamano, "codificacion": self.codificacion,
+                "inicio": self.inicio, "fin": self.fin, "primera_linea": self.primera_linea,
+                "lineas": self.lineas}
+
+    def vista(self) -> str:
+        """
+        Texto para el usuario: una cabecera con la parte del archivo que se muestra y el fragmento.
+
+        Returns:
+            La vista previa del archivo.
+        """
+        if not self.tamano:
+            parte = "vacío"
+        elif self.primera_linea is not None and self.lineas:
+            parte = f"líneas {self.primera_linea}-{self.primera_linea + self.lineas - 1}"
+        else:
+            parte = f"últimas {self.lineas} líneas" if self.fin >= self.tamano else f"{self.lineas} líneas"
+        cabecera = (f"📄 {self.ruta} ({formatear_bytes(self.tamano)}, {self.codificacion}): {parte}, "
+                    f"bytes {self.inicio}-{self.fin}")
+        partes = [cabecera]
+        if self.inicio > 0:
+            partes.append(f"... ({formatear_bytes(self.inicio)} antes)")
+        partes.append(self.texto.rstrip("\n"))
+        if self.fin < self.tamano:
+            partes.append(f"... ({formatear_bytes(self.tamano - self.fin)} más)")
+        return "\n".join(partes)
+
+
+def leer_fragmento(f: Any, inicio: int, codificacion: str, marca: int, max_lineas: Optional[int],
+                   max_caracteres: int) -> Tuple[str, int, int]:
+    """
+    Lee desde una posición hasta completar max_lineas líneas o unos max_caracteres caracteres,
+    sin pasar de ahí aunque el archivo sea enorme. El corte nunca deja un carácter a medias.
+
+    Returns:
+        Tupla (texto, posición final en bytes, líneas completas leídas).
+    """
+    salto = "\n".encode(codificacion)
+    limite = max(1, max_caracteres) * len(salto)
+    datos = bytearray()
+    lineas = 0
+    f.seek(inicio)
+    while len(datos) < limite and (not max_lineas or lineas < max_lineas):
+        desplazamiento = inicio + len(datos) - marca
+        bloque = f.read(min(TAMANO_BLOQUE_LECTURA, limite - len(datos)))
+        if not bloque:
+            break
+        for posicion in posiciones_salto(bloque, salto, desplazamiento):
+            lineas += 1
+            if max_lineas and lineas >= max_lineas:
+                bloque = bloque[:posicion + len(salto)]
+                break
+        datos += bloque
+    decodificador = codecs.getincrementaldecoder(codificacion)(errors="replace")
+    texto = decodificador.decode(bytes(datos), final=False)
+    # Los bytes de un carácter cortado por el límite se quedan para la siguiente lectura
+    fin = inicio + len(datos) - len(decodificador.getstate()[0])
+    if not texto.endswith("\n") and datos:
+        lineas += 1
+    return texto, fin, lineas
+
+
+def inicio_de_linea(f: Any, numero: int, salto: bytes, marca: int) -> Optional[int]:
+    """
+    Busca en qué byte empieza una línea, recorriendo el archivo por bloques.
+
+    Returns:
+        La posición, o None si el archivo tiene menos líneas.
+    """
+    if numero <= 1:
+        return marca
+    f.seek(marca)
+    vistos = 0
+    posicion = marca
+    while True:
+        bloque = f.read(TAMANO_BLOQUE_LECTURA)
+        if not bloque:
+            return None
+        if len(salto) == 1 and vistos + bloque.count(salto) < numero - 1:
+            vistos += bloque.count(salto)
+        else:
+            for salto_en in posiciones_salto(bloque, salto, posicion - marca):
+                vistos += 1
+                if vistos == numero - 1:
+                    return posicion + salto_en + len(salto)
+        posicion += len(bloque)
+
+
+def inicio_de_final(f: Any, tamano: int, max_lineas: int, salto: bytes, marca: int, limite: int) -> int:
+    """
+    Busca hacia atrás desde el final (con seek, sin leer el archivo entero) dónde empiezan
+    las últimas max_lineas líneas, sin retroceder más de limite bytes.
+
+    Returns:
+        La posición de inicio.
+    """
+    unidad = len(salto)
+    # Un salto al final del archivo cierra la última línea, no empieza otra
+    fin = tamano - unidad if tamano - marca >= unidad else tamano
+    minimo = max(marca, tamano - limite)
+    vistos = 0
+    while fin > minimo:
+        desde = max(minimo, fin - TAMANO_BLOQUE_LECTURA)
+        desde -= (desde - marca) % unidad
+        f.seek(desde)
+        bloque = f.read(fin - desde)
+        for posicion in reversed(list(posiciones_salto(bloque, salto, desde - marca))):
+            vistos += 1
+            if vistos == max_lineas:
+                return desde + posicion + unidad
+        fin = desde
+    return minimo + (-(minimo - marca) % unidad)
+
+
+def leer_archivo_acotado(ruta: str, lineas: Optional[int] = None, desde: Optional[int] = None,
+                         hasta: Optional[int] = None, final: bool = False,
+                         max_caracteres: int = MAX_CARACTERES_LECTURA) -> ResultadoLectura:
+    """
+    Lee una parte acotada de un archivo de texto, por grande que sea: las primeras líneas,
+    las últimas (buscando desde el final con seek) o un rango de líneas. Nunca se cargan
+    en memoria más de un bloque y el fragmento devuelto.
+
+    Args:
+        ruta: Archivo a leer.
+        lineas: Número de líneas (por defecto MAX_LINEAS_LECTURA).
+        desde: Primera línea del rango (empezando en 1).
+        hasta: Última línea del rango (incluida).
+        final: Si es True, se leen las últimas líneas.
+        max_caracteres: Máximo aproximado de caracteres del fragmento.
+
+    Returns:
+        El fragmento con su posición en el archivo.
+
+    Raises:
+        ValueError: Si el archivo parece binario.
+    """
+    ruta = os.path.abspath(os.path.expanduser(ruta))
+    with open(ruta, "rb") as f:
+        tamano = os.fstat(f.fileno()).st_size
+        codificacion, marca = detectar_codificacion(f.read(MUESTRA_BINARIO))
+        salto = "\n".encode(codificacion)
+        primera_linea = 1
+        if desde is not None or hasta is not None:
+            primera_linea = max(1, desde or 1)
+            inicio = inicio_de_linea(f, primera_linea, salto, marca)
+            if inicio is None:
+                raise ValueError(f"el archivo tiene menos de {primera_linea} líneas")
+            lineas = hasta - primera_linea + 1 if hasta else lineas
+        elif final:
+            inicio = inicio_de_final(f, tamano, lineas or MAX_LINEAS_LECTURA, salto, marca,
+                                     max_caracteres * len(salto))
+            primera_linea = None
+        else:
+            inicio = marca
+        if primera_linea is None and codificacion == "utf-8":
+            # Si el límite cortó un carácter por la mitad, se empieza en el siguiente
+            f.seek(inicio)
+            inicio += len(re.match(rb"[\x80-\xbf]{0,3}", f.read(3)).group())
+        texto, fin, leidas = leer_fragmento(f, inicio, codificacion, marca, lineas or MAX_LINEAS_LECTURA,
+                                            max_caracteres)
+    return ResultadoLectura(ruta, tamano, codificacion, inicio, fin, texto, leidas, primera_linea)
+
+
+# Columnas de cada muestra del sistema (los porcentajes, de 0 a 100; la red, en bytes por segundo)
+COLUMNAS_MUESTRA = ("tiempo", "cpu", "memoria", "memoria_usada", "disco", "disco_libre",
+                    "red_enviados", "red_recibidos")
+
+
+def medir_sistema(ruta_disco: str, intervalo_cpu: Optional[float] = 0.1) -> Dict[str, float]:
+    """
+    Toma una muestra del sistema con psutil.
+
+    Args:
+        ruta_disco: Ruta del disco a medir.
+        intervalo_cpu: Segundos que se espera para medir la CPU; None, desde la llamada anterior.
+
+    Returns:
+        Diccionario con las columnas de COLUMNAS_MUESTRA (la red, sin medir: NaN).
+    """
+    memoria = psutil.virtual_memory()
+    disco = psutil.disk_usage(ruta_disco)
+    return {"tiempo": time.time(), "cpu": psutil.cpu_percent(interval=intervalo_cpu),
+            "memoria": memoria.percent, "memoria_usada": memoria.used, "disco": disco.percent,
+            "disco_libre": disco.free, "red_enviados": math.nan, "red_recibidos": math.nan}
+
+
+def procesos_principales(cantidad: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Lista los procesos que más memoria usan. process_iter guarda los objetos Process entre
+    llamadas, así que el porcentaje de CPU de cada proceso es el uso desde la llamada anterior.
+
+    Args:
+        cantidad: Número de procesos a devolver.
+
+    Returns:
+        Tupla (número de procesos en ejecución, los `cantidad` que más memoria usan).
+    """
+    procesos = [proceso.info for proceso in psutil.process_iter(["pid", "name", "cpu_percent", "memory_percent"])]
+    procesos.sort(key=lambda info: info["memory_percent"] or 0, reverse=True)
+    return len(procesos), procesos[:cantidad]
+
+
+class MuestreadorSistema:
+    """
+    Muestreo periódico del sistema en segundo plano. Cada muestra (CPU, memoria, disco y
+    tráfico de red) se escribe en un buffer circular de NumPy de tamaño fijo, así que el
+    historial ocupa siempre lo mismo; cada cierto tiempo se toma además una instantánea
+    de los procesos. Las consultas se responden al momento con la última muestra, sin
+    esperar a psutil, y las de tendencia ("últimos 5 minutos") con el mínimo, el máximo
+    y la media de la ventana.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el muestreador (sin muestras hasta que se inicia).
+
+        Args:
+            config: Sección "muestreo_sistema" de la configuración.
+        """
+        config = config or {}
+        self.intervalo = max(0.1, float(config.get("intervalo_segundos", 2)))
+        self.intervalo_procesos = float(config.get("intervalo_procesos_segundos", 10))
+        self.cantidad_procesos = int(config.get("top_procesos", 5))
+        self.ruta_disco = os.path.abspath(os.sep)
+        capacidad = max(2, int(float(config.get("historial_segundos", 3600)) / self.intervalo))
+        self.muestras = np.full((capacidad, len(COLUMNAS_MUESTRA)), np.nan)
+        self.siguiente = 0
+        self.total = 0
+        self.procesos = None
+        self.red_anterior = None
+        self.bloqueo = threading.Lock()
+        self.detenido = threading.Event()
+        self.hilo = None
+
+    def muestrear(self) -> None:
+        """Toma una muestra y la escribe en el buffer (y la instantánea de procesos si toca)."""
+        muestra = medir_sistema(self.ruta_disco, intervalo_cpu=None)
+        red = psutil.net_io_counters()
+        if self.red_anterior is not None:
+            tiempo, enviados, recibidos = self.red_anterior
+            transcurrido = max(muestra["tiempo"] - tiempo, 1e-6)
+            muestra["red_enviados"] = (red.bytes_sent - enviados) / transcurrido
+            muestra["red_recibidos"] = (red.bytes_recv - recibidos) / transcurrido
+        self.red_anterior = (muestra["tiempo"], red.bytes_sent, red.bytes_recv)
+        with self.bloqueo:
+            self.muestras[self.siguiente] = [muestra[columna] for columna in COLUMNAS_MUESTRA]
+            self.siguiente = (self.siguiente + 1) % len(self.muestras)
+            self.total += 1
+        if self.procesos is None or muestra["tiempo"] - self.procesos[0] >= self.intervalo_procesos:
+            self.procesos = (muestra["tiempo"],) + procesos_principales(self.cantidad_procesos)
+
+    def ultima(self) -> Optional[Dict[str, float]]:
+        """
+        Returns:
+            La última muestra como diccionario, o None si todavía no hay ninguna.
+        """
+        with self.bloqueo:
+            if not self.total:
+                return None
+            fila = self.muestras[self.siguiente - 1].tolist()
+        return dict(zip(COLUMNAS_MUESTRA, fila))
+
+    def ventana(self, segundos: float) -> "np.ndarray":
+        """
+        Returns:
+            Copia de las muestras de los últimos `segundos` segundos (sin ordenar).
+        """
+        with self.bloqueo:
+            datos = self.muestras if self.total >= len(self.muestras) else self.muestras[:self.siguiente]
+            return datos[datos[:, 0] >= time.time() - segundos]
+
+    def estadisticas(self, segundos: float) -> Optional[Dict[str, Any]]:
+        """
+        Mínimo, máximo y media de cada columna en los últimos `segundos` segundos.
+
+        Returns:
+            Diccionario columna -> (mínimo, máximo, media), más "muestras" y "segundos"
+            (el tiempo que cubren de verdad), o None si no hay muestras en la ventana.
+        """
+        datos = self.ventana(segundos)
+        if not len(datos):
+            return None
+        estadisticas = {"muestras": len(datos), "segundos": float(datos[:, 0].max() - datos[:, 0].min())}
+        for indice, columna in enumerate(COLUMNAS_MUESTRA[1:], start=1):
+            valores = datos[:, indice][~np.isnan(datos[:, indice])]
+            if len(valores):
+                estadisticas[columna] = (float(valores.min()), float(valores.max()), float(valores.mean()))
+        return estadisticas
+
+    def iniciar(self) -> None:
+        """Arranca el hilo de muestreo."""
+        if self.hilo is None:
+            self.hilo = threading.Thread(target=self.mantener, name="jarvis-muestreo", daemon=True)
+            self.hilo.start()
+
+    def mantener(self) -> None:
+        # La primera llamada a cpu_percent (del sistema y de cada proceso) solo fija el punto de partida
+        psutil.cpu_percent(interval=None)
+        procesos_principales(0)
+        espera = min(self.intervalo, 0.5)
+        while not self.detenido.wait(espera):
+            try:
+                self.muestrear()
+            except Exception as e:
+                logger.error(f"Error al muestrear el sistema: {e}")
+            espera = self.intervalo
+
+    def detener(self) -> None:
+        """Detiene el hilo de muestreo."""
+        self.detenido.set()
+
+
+def manejar_buscar_archivos(chatbot: "Chatbot", patron: str = "", ubicacion: Optional[str] = None) -> Tuple[str, Any]:
+    """
+    Busca archivos (también en subcarpetas). Dentro de las ubicaciones indexadas responde
+    el índice de archivos; si no, o si el índice aún no está listo, MotorBusqueda. Cada
+    resultado se muestra en cuanto aparece y se añade a la lista de archivos encontrados
+    de la memoria, que así se va llenando durante la búsqueda.
+    """
+    ruta_base = ruta_de_ubicacion(ubicacion) if ubicacion else os.getcwd()
+    encontrados = []
+    chatbot.memory.store_command_result("buscar_archivos", encontrados)
+    motor = chatbot.motor_busqueda
+    indice = chatbot.indice_archivos
+    resultados = None
+    if indice is not None and patron.strip() and indice.cubre(ruta_base):
+        resultados = indice.consultar(patron, ruta_base, motor.max_resultados, motor.difusa)
+        if resultados is not None:
+            # El índice puede ir por detrás del disco hasta el siguiente refresco
+            resultados = [ruta for ruta in resultados if os.path.exists(ruta)]
+    for ruta in motor.buscar(patron, ruta_base) if resultados is None else resultados:
+        encontrados.append(ruta)
+        print(f"{len(encontrados)}. {ruta}")
+    if not encontrados:
+        return f"No se encontraron archivos que coincidan con '{patron}' en {ruta_base}", encontrados
+    limite = chatbot.motor_busqueda.max_resultados
+    aviso = f" (se alcanzó el límite de {limite})" if limite and len(encontrados) >= limite else ""
+    return f"🔍 Se encontraron {len(encontrados)} archivos en {ruta_base}{aviso}", encontrados
+
+
+def manejar_buscar_contenido(chatbot: "Chatbot", texto: str, patron: str = "",
+                             ubicacion: Optional[str] = None) -> Tuple[str, Any]:
+    """
+    Busca un texto dentro de los archivos (también en subcarpetas) con BuscadorContenido.
+    Cada coincidencia se muestra en cuanto aparece y los archivos que la contienen se
+    guardan como archivos encontrados, para poder referirse a ellos ("abre el primero").
+    Dentro de las ubicaciones indexadas, los candidatos salen del índice de archivos.
+    """
+    ruta_base = ruta_de_ubicacion(ubicacion) if ubicacion else os.getcwd()
+    encontrados = []
+    chatbot.memory.store_command_result("buscar_contenido", encontrados)
+    rutas = None
+    indice = chatbot.indice_archivos
+    if indice is not None and indice.cubre(ruta_base):
+        rutas = indice.consultar(patron.strip() or "*", ruta_base, max_resultados=0)
+    lineas = []
+    vistos = set()
+    for ruta, linea, contenido in chatbot.buscador_contenido.buscar(texto, ruta_base, patron, rutas=rutas):
+        if ruta not in vistos:
+            vistos.add(ruta)
+            encontrados.append(ruta)
+            print(f"{len(encontrados)}. {ruta}")
+        print(f"     {linea}: {contenido}")
+        lineas.append(f"{ruta}:{linea}: {contenido}")
+    if not encontrados:
+        return f"No se encontró '{texto}' en los archivos de {ruta_base}", encontrados
+    limite = chatbot.buscador_contenido.max_coincidencias
+    aviso = f" (se alcanzó el límite de {limite})" if limite and len(lineas) >= limite else ""
+    return (f"🔍 '{texto}' aparece en {len(lineas)} líneas de {len(encontrados)} archivos "
+            f"en {ruta_base}{aviso}"), encontrados
+
+
+def manejar_leer_archivo(chatbot: "Chatbot", ruta: str, lineas: Optional[int] = None, desde: Optional[int] = None,
+                         hasta: Optional[int] = None, final: bool = False) -> Tuple[str, Any]:
+    """
+    Muestra una parte acotada de un archivo de texto (ver leer_archivo_acotado). En memoria
+    se guardan la ruta y las posiciones leídas, no el contenido.
+    """
+    lectura = leer_archivo_acotado(ruta, lineas, desde, hasta, final)
+    return lectura.vista(), lectura.metadatos()
+
+
+def manejar_copiar_archivo(chatbot: "Chatbot", origen: str, destino: str) -> Tuple[str, Any]:
+    """Copia un archivo o directorio sin sobrescribir otro existente."""
+    destino = resolver_destino(destino, origen)
+    if os.path.exists(destino):
+        raise FileExistsError(f"Ya existe '{destino}'")
+    if os.path.isdir(origen):
+        shutil.copytree(origen, destino)
+    else:
+        shutil.copy2(origen, destino)
+    return f"✅ '{origen}' copiado a {destino}", destino
+
+
+def manejar_mover_archivo(chatbot: "Chatbot", origen: str, destino: str) -> Tuple[str, Any]:
+    """Mueve un archivo o directorio sin sobrescribir otro existente."""
+    destino = resolver_destino(destino, origen)
+    if os.path.exists(destino):
+        raise FileExistsError(f"Ya existe '{destino}'")
+    shutil.move(origen, destino)
+    return f"✅ '{origen}' movido a {destino}", destino
+
+
+def manejar_renombrar_archivo(chatbot: "Chatbot", origen: str, destino: str) -> Tuple[str, Any]:
+    """Renombra un archivo sin sobrescribir otro existente."""
+    # Un nombre sin directorio se interpreta en la misma carpeta que el original
+    if not os.path.dirname(destino):
+        destino = os.path.join(os.path.dirname(origen), destino)
+    if os.path.exists(destino):
+        raise FileExistsError(f"Ya existe '{destino}'")
+    os.rename(origen, destino)
+    return f"✅ '{origen}' renombrado a {destino}", destino
+
+
+def manejar_crear_directorio(chatbot: "Chatbot", ruta: str) -> Tuple[str, Any]:
+    """Crea un directorio (y los intermedios que falten)."""
+    os.makedirs(ruta, exist_ok=True)
+    return f"✅ Directorio creado: {os.path.abspath(ruta)}", os.path.abspath(ruta)
+
+
+def describir_periodo(segundos: float) -> str:
+    """Describe una duración en palabras ("5 min", "1 h", "30 s")."""
+    if segundos >= 3600:
+        return f"{segundos / 3600:.3g} h"
+    if segundos >= 60:
+        return f"{segundos / 60:.3g} min"
+    return f"{segundos:.0f} s"
+
+
+def manejar_obtener_info_sistema(chatbot: "Chatbot", recurso: Optional[str] = None,
+                                 periodo: Optional[int] = None) -> Tuple[str, Any]:
+    """
+    Resume el uso de un recurso del sistema (CPU, memoria y disco si no se indica o se pide "sistema").
+    Con el muestreador en marcha se responde al momento con su última muestra y, si se pide
+    un periodo ("últimos 5 minutos"), con el mínimo, el máximo y la media del periodo;
+    sin él, se consulta psutil directamente.
+    """
+    if recurso == "sistema":
+        recurso = None
+    muestreador = chatbot.muestreador_sistema
+    muestra = muestreador.ultima() if muestreador is not None else None
+    if muestra is None:
+        muestra = medir_sistema(os.path.abspath(os.sep))
+    estadisticas = muestreador.estadisticas(periodo) if periodo and muestreador is not None else None
+
+    def tendencia(columna: str, formato: Callable[[float], str], etiqueta: str = "Últimos") -> str:
+        if not estadisticas or columna not in estadisticas:
+            return ""
+        minimo, maximo, media = estadisticas[columna]
+        return (f"\n  {etiqueta} {describir_periodo(periodo)}: mínimo {formato(minimo)}, máximo {formato(maximo)}, "
+                f"media {formato(media)} ({estadisticas['muestras']} muestras en {describir_periodo(estadisticas['segundos'])})")
+
+    def porcentaje(valor: float) -> str:
+        return f"{valor:.1f}%"
+
+    def velocidad(valor: float) -> str:
+        return f"{formatear_bytes(valor)}/s"
+
+    lineas = []
+    if recurso in (None, "cpu"):
+        lineas.append(f"CPU: {muestra['cpu']:.1f}% de uso ({psutil.cpu_count()} núcleos)" + tendencia("cpu", porcentaje))
+    if recurso in (None, "memoria"):
+        total = psutil.virtual_memory().total
+        lineas.append(f"Memoria: {muestra['memoria']:.1f}% en uso "
+                      f"({muestra['memoria_usada'] / 1024 ** 3:.1f} de {total / 1024 ** 3:.1f} GB)"
+                      + tendencia("memoria", porcentaje))
+    if recurso in (None, "disco"):
+        lineas.append(f"Disco: {muestra['disco']:.1f}% en uso ({muestra['disco_libre'] / 1024 ** 3:.1f} GB libres)"
+                      + tendencia("disco", porcentaje))
+    if recurso == "procesos":
+        instantanea = muestreador.procesos if muestreador is not None else None
+        if instantanea is None:
+            instantanea = (time.time(),) + procesos_principales(5)
+        tiempo, cantidad, principales = instantanea
+        antiguedad = f" (hace {describir_periodo(time.time() - tiempo)})" if time.time() - tiempo >= 1 else ""
+        lineas.append(f"Procesos en ejecución: {cantidad}{antiguedad}. Los que más memoria usan:")
+        lineas += [f"  {info['pid']} {info['name']} ({info['memory_percent'] or 0:.1f}% memoria, "
+                   f"{info['cpu_percent'] or 0:.1f}% CPU)" for info in principales]
+    if recurso == "bateria":
+        bateria = psutil.sensors_battery() if hasattr(psutil, "sensors_battery") else None
+        lineas.append(f"Batería: {bateria.percent}%{' (cargando)' if bateria.power_plugged else ''}"
+                      if bateria else "No se detecta ninguna batería")
+    if recurso == "red":
+        if math.isnan(muestra["red_enviados"]):
+            red = psutil.net_io_counters()
+            lineas.append(f"Red: {red.bytes_sent / 1024 ** 2:.1f} MB enviados, {red.bytes_recv / 1024 ** 2:.1f} MB recibidos")
+        else:
+            lineas.append(f"Red: {velocidad(muestra['red_enviados'])} enviados, "
+                          f"{velocidad(muestra['red_recibidos'])} recibidos"
+                          + tendencia("red_enviados", velocidad, "Envío, últimos")
+                          + tendencia("red_recibidos", velocidad, "Recepción, últimos"))
+    if periodo and not estadisticas:
+        lineas.append("(No hay historial de ese periodo: el muestreo del sistema no está activo o acaba de empezar)")
+    mensaje = "\n".join(lineas)
+    return mensaje, mensaje
+
+
+async def manejar_ejecutar_comando(chatbot: "Chatbot", comando: str) -> Tuple[str, Any]:
+    """
+    Ejecuta un comando del sistema con el ejecutor asíncrono, mostrando su salida en vivo.
+    Solo llegan aquí órdenes simples que no borran nada (ver comando_ejecutable).
+    """
+    if not comando_ejecutable(comando):
+        raise PermissionError("el comando necesita revisión antes de ejecutarse")
+    resultado = await chatbot.ejecutor_comandos.ejecutar(comando, chatbot.mostrar_linea_comando)
+    return recortar_texto(resultado.texto(), MAX_CARACTERES_LECTURA), comando
+
+
+def manejar_abrir_archivo(chatbot: "Chatbot", ruta: Optional[str] = None,
+                          cantidad: Optional[int] = None) -> Tuple[str, Any]:
+    """
+    Abre un archivo, o los `cantidad` primeros archivos encontrados, con la aplicación
+    predeterminada. Se lanzan todos a la vez y se vuelve sin esperar a que se abran;
+    los fallos posteriores los avisa el lanzador.
+    """
+    if cantidad:
+        rutas = chatbot.memory.found_files[:cantidad]
+        if not rutas:
+            raise ValueError("no hay archivos encontrados a los que referirse")
+    else:
+        rutas = [ruta]
+    resultados = LANZADOR_ARCHIVOS.abrir_varios(rutas, chatbot.avisar_error_apertura)
+    abiertos = [ruta for ruta, error in resultados if error is None]
+    lineas = [f"📂 Abriendo {abiertos[0]}" if len(abiertos) == 1 else f"📂 Abriendo {len(abiertos)} archivos"]
+    lineas += [f"  {ruta}" for ruta in abiertos if len(abiertos) > 1]
+    lineas += [f"❌ {ruta}: {error}" for ruta, error in resultados if error is not None]
+    if not abiertos:
+        raise RuntimeError("\n".join(lineas[1:]))
+    return "\n".join(lineas), abiertos if cantidad else abiertos[0]
+
+
+def manejar_abrir_pagina_web(chatbot: "Chatbot", url: str) -> Tuple[str, Any]:
+    """Abre una URL en el navegador predeterminado."""
+    if not webbrowser.open(url):
+        raise RuntimeError(f"No se pudo abrir el navegador para {url}")
+    return f"🌐 Abriendo {url}", url
+
+
+# Manejadores nativos: resuelven la intención directamente, sin exec ni modelo de lenguaje.
+# Cada uno recibe el chatbot y los parámetros extraídos, y devuelve el mensaje para el
+# usuario y el resultado que se guarda en memoria. Los síncronos se ejecutan en un hilo;
+# los asíncronos (ejecutar_comando), directamente en el bucle de eventos. Solo se usan si
+# parametros_validos acepta los parámetros. Los borrados no tienen manejador (y los comandos
+# de shell que borran van al modelo): por seguridad, igual que en validate_code, no se
+# ejecutan sin revisar el código.
+MANEJADORES_INTENCION = {
+    "buscar_archivos": manejar_buscar_archivos,
+    "buscar_contenido": manejar_buscar_contenido,
+    "leer_archivo": manejar_leer_archivo,
+    "copiar_archivo": manejar_copiar_archivo,
+    "mover_archivo": manejar_mover_archivo,
+    "renombrar_archivo": manejar_renombrar_archivo,
+    "crear_directorio": manejar_crear_directorio,
+    "obtener_info_sistema": manejar_obtener_info_sistema,
+    "ejecutar_comando": manejar_ejecutar_comando,
+    "abrir_pagina_web": manejar_abrir_pagina_web,
+    "abrir_archivo": manejar_abrir_archivo,
+}
+
+
+def tiene_ruta_local(intencion: Optional[str]) -> bool:
+    """
+    Indica si una intención se puede resolver sin el modelo de lenguaje.
+
+    Args:
+        intencion: Intención detectada.
+
+    Returns:
+        True si existe un manejador nativo o una plantilla para la intención.
+    """
+    return intencion in MANEJADORES_INTENCION or intencion in PLANTILLAS
+
+
+# Comandos etiquetados con los parámetros que se esperan extraer
+CASOS_PARAMETROS = [
+    ("buscar archivos con patrón notas", "buscar_archivos", {"patron": "notas"}),
+    ("busca los archivos pdf en descargas", "buscar_archivos", {"patron": ".pdf", "ubicacion": "descargas"}),
+    ("encuentra informe.docx en documentos", "buscar_archivos", {"patron": "informe.docx", "ubicacion": "documentos"}),
+    ("lista los ficheros del escritorio", "buscar_archivos", {"patron": "", "ubicacion": "escritorio"}),
+    ("busca la palabra factura en documentos", "buscar_contenido", {"texto": "factura", "ubicacion": "documentos"}),
+    ("busca 'TODO' dentro de los archivos .py", "buscar_contenido", {"texto": "TODO", "patron": ".py"}),
+    ("encuentra los ficheros que contengan el texto error", "buscar_contenido", {"texto": "error"}),
+    ("lee el archivo notas.txt", "leer_archivo", {"ruta": "notas.txt"}),
+    ("muéstrame el contenido de config.yaml", "leer_archivo", {"ruta": "config.yaml"}),
+    ("leer archivo /tmp/registro.log", "leer_archivo", {"ruta": "/tmp/registro.log"}),
+    ('lee el archivo "/tmp/Mi Carpeta/Notas.txt"', "leer_archivo", {"ruta": "/tmp/Mi Carpeta/Notas.txt"}),
+    ("muéstrame las últimas 50 líneas de /var/log/syslog", "leer_archivo",
+     {"ruta": "/var/log/syslog", "lineas": 50, "final": True}),
+    ("lee las líneas 10 a 20 de notas.txt", "leer_archivo", {"ruta": "notas.txt", "desde": 10, "hasta": 20}),
+    ("crea un archivo llamado notas.txt", "crear_archivo", {"nombre_archivo": "notas.txt", "ubicacion": "escritorio"}),
+    ("crear archivo ideas.md en documentos", "crear_archivo", {"nombre_archivo": "ideas.md", "ubicacion": "documentos"}),
+    ("crea el archivo Lista.txt y ábrelo", "crear_y_abrir_archivo", {"nombre_archivo": "Lista.txt"}),
+    ("crear y abrir archivo tareas.txt", "crear_y_abrir_archivo", {"nombre_archivo": "tareas.txt"}),
+    ("crea una carpeta llamada fotos", "crear_directorio", {"ruta": "fotos"}),
+    ("copia el archivo a.txt a documentos", "copiar_archivo", {"origen": "a.txt", "destino": "documentos"}),
+    ("mueve notas.txt a la carpeta /tmp/proyectos", "mover_archivo", {"origen": "notas.txt", "destino": "/tmp/proyectos"}),
+    ("renombra notas.txt a ideas.txt", "renombrar_archivo", {"origen": "notas.txt", "destino": "ideas.txt"}),
+    ("ejecuta el comando ls -la", "ejecutar_comando", {"comando": "ls -la"}),
+    ("ejecutar comando git status", "ejecutar_comando", {"comando": "git status"}),
+    ("abre la página web google.com", "abrir_pagina_web", {"url": "https://google.com"}),
+    ("abrir página web https://github.com", "abrir_pagina_web", {"url": "https://github.com"}),
+    ("abre wikipedia.org en el navegador", "abrir_pagina_web", {"url": "https://wikipedia.org"}),
+    ("abre el archivo informe.pdf", "abrir_archivo", {"ruta": "informe.pdf"}),
+    ("abre los tres primeros", "abrir_archivo", {"cantidad": 3}),
+    ("dime cuánta memoria RAM estoy usando", "obtener_info_sistema", {"recurso": "memoria"}),
+    ("uso de CPU en los últimos 5 minutos", "obtener_info_sistema", {"recurso": "cpu", "periodo": 300}),
+    ("¿cómo ha ido la memoria en la última hora?", "obtener_info_sistema", {"recurso": "memoria", "periodo": 3600}),
+]
+
+
+def evaluar_cobertura(casos: List[Tuple[str, str, Dict[str, Any]]] = None,
+                      clasificador: Optional["ClasificadorIntenciones"] = None,
+                      umbral: float = 0.8) -> Dict[str, float]:
+    """
+    Informe de cobertura: cuántos comandos tienen sus parámetros bien extraídos
+    y cuántos se pueden atender sin llamar al modelo de lenguaje.
+
+    Args:
+        casos: Tríos (comando, intención, parámetros esperados); por defecto CASOS_PARAMETROS.
+        clasificador: Clasificador de intenciones para los comandos sin palabras clave (opcional).
+        umbral: Confianza mínima para aceptar la predicción del clasificador.
+
+    Returns:
+        Diccionario con el total, los parámetros correctos y los comandos servidos sin GPT.
+    """
+    casos = casos or CASOS_PARAMETROS
+    correctos = 0
+    sin_gpt = 0
+    por_intencion = {}
+    for comando, intencion_esperada, esperados in casos:
+        intencion, _ = detectar_intencion_local(comando, clasificador, umbral)
+        parametros = extraer_parametros_gramatica(comando, intencion) if intencion else {}
+        acierto = intencion == intencion_esperada and all(
+            parametros.get(clave) == valor for clave, valor in esperados.items()
+        )
+        local = bool(intencion) and tiene_ruta_local(intencion) and parametros_completos(intencion, parametros)
+        correctos += acierto
+        sin_gpt += local
+        estado = por_intencion.setdefault(intencion_esperada, [0, 0])
+        estado[0] += local
+        estado[1] += 1
+        if not acierto:
+            print(f"  ✗ '{comando}': {intencion} {parametros}")
+
+    total = len(casos)
+    for intencion, (locales, casos_intencion) in sorted(por_intencion.items()):
+        print(f"  {intencion:<24} {locales}/{casos_intencion} sin GPT")
+    print(f"Parámetros correctos: {correctos}/{total} ({correctos / total:.1%}); "
+          f"servidos sin GPT: {sin_gpt}/{total} ({sin_gpt / total:.1%})")
+    if clasificador is not None:
+        print("Estos casos no se usan para entrenar el clasificador de intenciones.")
+    return {"total": total, "parametros_correctos": correctos, "sin_gpt": sin_gpt}
+
+
+# Firmas en el código ejecutado que delatan la intención final de un comando
+# (sirven para etiquetar conversaciones antiguas resueltas por GPT); gana la primera
+CODIGO_A_INTENCION = [
+    (re.compile(r"\bcrear_y_abrir_archivo\("), "crear_y_abrir_archivo"),
+    (re.compile(r"\bcrear_archivo\("), "crear_archivo"),
+    (re.compile(r"\bbuscar_contenido\("), "buscar_contenido"),
+    (re.compile(r"\bbuscar_archivos\(|\bbuscar_rutas\(|glob\.glob\(|\.rglob\(|os\.walk\("), "buscar_archivos"),
+    (re.compile(r"shutil\.rmtree\(|os\.rmdir\("), "borrar_directorio"),
+    (re.compile(r"os\.remove\(|os\.unlink\(|\.unlink\("), "borrar_archivo"),
+    (re.compile(r"os\.makedirs\(|os\.mkdir\(|\.mkdir\("), "crear_directorio"),
+    (re.compile(r"shutil\.copy"), "copiar_archivo"),
+    (re.compile(r"shutil\.move\("), "mover_archivo"),
+    (re.compile(r"os\.rename\(|\.rename\("), "renombrar_archivo"),
+    (re.compile(r"webbrowser\.open"), "abrir_pagina_web"),
+    (re.compile(r"\babrir_archivo\(|os\.startfile\(|xdg-open"), "abrir_archivo"),
+    (re.compile(r"psutil\."), "obtener_info_sistema"),
+    (re.compile(r"\bejecutar_comando\(|subprocess\."), "ejecutar_comando"),
+    (re.compile(r"\bleer_archivo\(|\.read\(\)|\.read_text\(|\.readlines\("), "leer_archivo"),
+]
+
+# Etiqueta de los comandos que no corresponden a ninguna intención con plantilla
+SIN_INTENCION = ""
+
+# Semilla etiquetada para entrenar el clasificador. Es distinta de CASOS_INTENCION y
+# CASOS_PARAMETROS: esos casos miden la detección y no deben verse durante el entrenamiento
+EJEMPLOS_ENTRENAMIENTO_INTENCION = [
+    ("localiza las fotos jpg de vacaciones", "buscar_archivos"),
+    ("encuentra presupuesto.xlsx en descargas", "buscar_archivos"),
+    ("lista los documentos de la carpeta trabajo", "buscar_archivos"),
+    ("busca el texto contraseña en configuracion.ini", "buscar_contenido"),
+    ("encuentra qué ficheros mencionan la palabra cliente", "buscar_contenido"),
+    ("lee el fichero recetas.txt", "leer_archivo"),
+    ("enséñame lo que pone en pendientes.md", "leer_archivo"),
+    ("muéstrame las primeras 20 líneas de registro.csv", "leer_archivo"),
+    ("crea un fichero vacío llamado borrador.txt", "crear_archivo"),
+    ("hazme un archivo nuevo en el escritorio", "crear_archivo"),
+    ("crea el fichero diario.md y ábrelo", "crear_y_abrir_archivo"),
+    ("genera el archivo resumen.txt y luego ábrelo", "crear_y_abrir_archivo"),
+    ("crea el directorio copias en descargas", "crear_directorio"),
+    ("haz una carpeta nueva llamada facturas", "crear_directorio"),
+    ("elimina el fichero antiguo.csv", "borrar_archivo"),
+    ("borra captura.png del escritorio", "borrar_archivo"),
+    ("suprime la carpeta vieja de descargas", "borrar_directorio"),
+    ("borra el directorio cache", "borrar_directorio"),
+    ("duplica el archivo plantilla.docx en documentos", "copiar_archivo"),
+    ("copia informe.pdf al escritorio", "copiar_archivo"),
+    ("traslada el fichero factura.pdf a descargas", "mover_archivo"),
+    ("mueve la foto playa.jpg a la carpeta imágenes", "mover_archivo"),
+    ("cambia el nombre del archivo borrador.txt a final.txt", "renombrar_archivo"),
+    ("renombra foto1.png a portada.png", "renombrar_archivo"),
+    ("abre el fichero presupuesto.xlsx", "abrir_archivo"),
+    ("abre el segundo resultado", "abrir_archivo"),
+    ("abre la web de la universidad unir.net", "abrir_pagina_web"),
+    ("abre la página youtube.com", "abrir_pagina_web"),
+    ("corre el comando df -h", "ejecutar_comando"),
+    ("lanza la orden uptime", "ejecutar_comando"),
+    ("¿cuánta memoria queda libre?", "obtener_info_sistema"),
+    ("qué procesos consumen más CPU", "obtener_info_sistema"),
+    ("estado del disco duro", "obtener_info_sistema"),
+    ("abre el reproductor de música", SIN_INTENCION),
+    ("¿qué día es hoy?", SIN_INTENCION),
+    ("recomiéndame una película", SIN_INTENCION),
+    ("explícame qué es un archivo comprimido", SIN_INTENCION),
+    ("escribe un poema sobre el mar", SIN_INTENCION),
+    ("¿cuánto es 15 por 8?", SIN_INTENCION),
+    ("gracias jarvis", SIN_INTENCION),
+]
+
+
+def inferir_intencion_de_codigo(codigo: Optional[str]) -> Optional[str]:
+    """
+    Deduce la intención de un comando a partir del código que lo resolvió.
+
+    Args:
+        codigo: Código ejecutado.
+
+    Returns:
+        La intención o None si el código no coincide con ninguna firma.
+    """
+    if not codigo:
+        return None
+    for patron, intencion in CODIGO_A_INTENCION:
+        if patron.search(codigo):
+            return intencion
+    return None
+
+
+def minar_ejemplos_memoria(memory_file: str) -> List[Tuple[str, str]]:
+    """
+    Extrae pares (comando, intención final) de las conversaciones guardadas en memoria.
+    Se usa la intención registrada y, en conversaciones antiguas, la deducida del código.
+    Las conversaciones que terminaron en error se descartan.
+
+    Args:
+        memory_file: Ruta al archivo de memoria (jarvis_memory.json).
+
+    Returns:
+        Lista de pares; SIN_INTENCION marca los comandos sin intención conocida.
+    """
+    try:
+        with open(memory_file, "r", encoding="utf-8") as f:
+            conversaciones = json.load(f).get("conversations", [])
+    except (OSError, ValueError) as e:
+        logger.warning(f"No se pudo leer la memoria {memory_file}: {e}")
+        return []
+
+    ejemplos = []
+    for conversacion in conversaciones:
+        comando = (conversacion.get("user_input") or "").strip()
+        resultado = str(conversacion.get("code_result") or "")
+        if not comando or resultado.startswith("Error"):
+            continue
+        intencion = conversacion.get("intencion") or inferir_intencion_de_codigo(conversacion.get("executed_code"))
+        ejemplos.append((comando, intencion or SIN_INTENCION))
+    return ejemplos
+
+
+def ngramas_caracteres(texto: str, minimo: int = 2, maximo: int = 4) -> Dict[str, int]:
+    """
+    Cuenta los n-gramas de caracteres de cada palabra del texto normalizado.
+
+    Args:
+        texto: Texto a analizar.
+        minimo: Longitud mínima de los n-gramas.
+        maximo: Longitud máxima de los n-gramas.
+
+    Returns:
+        Diccionario n-grama -> número de apariciones.
+    """
+    cuentas = {}
+    for palabra in normalizar_texto(texto).split():
+        palabra = f" {palabra} "
+        for n in range(minimo, maximo + 1):
+            for i in range(len(palabra) - n + 1):
+                ngrama = palabra[i:i + n]
+                cuentas[ngrama] = cuentas.get(ngrama, 0) + 1
+    return cuentas
+
+
+class ClasificadorIntenciones:
+    """
+    Clasificador ligero de intenciones: TF-IDF de n-gramas de caracteres y regresión
+    logística multinomial en NumPy, con la confianza calibrada por escalado de temperatura.
+    Se usa cuando las palabras clave no reconocen el comando.
+    """
+
+    def __init__(self, vocabulario: List[str], idf: "np.ndarray", pesos: "np.ndarray",
+                 sesgo: "np.ndarray", clases: List[str], temperatura: float = 1.0):
+        self.vocabulario = {ngrama: i for i, ngrama in enumerate(vocabulario)}
+        self.idf = idf
+        self.pesos = pesos
+        self.sesgo = sesgo
+        self.clases = list(clases)
+        self.temperatura = temperatura
+
+    def vectorizar(self, comandos: List[str]) -> "np.ndarray":
+        """
+        Convierte comandos en vectores TF-IDF normalizados (L2).
+
+        Args:
+            comandos: Comandos a vectorizar.
+
+        Returns:
+            Matriz de tamaño (comandos, vocabulario).
+        """
+        matriz = np.zeros((len(comandos), len(self.vocabulario)), dtype=np.float32)
+        for fila, comando in enumerate(comandos):
+            for ngrama, cuenta in ngramas_caracteres(comando).items():
+                columna = self.vocabulario.get(ngrama)
+                if columna is not None:
+                    matriz[fila, columna] = 1.0 + math.log(cuenta)
+        matriz *= self.idf
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        return matriz / np.maximum(normas, 1e-12)
+
+    def logits(self, matriz: "np.ndarray") -> "np.ndarray":
+        return matriz @ self.pesos + self.sesgo
+
+    @staticmethod
+    def softmax(logits: "np.ndarray") -> "np.ndarray":
+        logits = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predecir(self, comando: str) -> Tuple[Optional[str], float]:
+        """
+        Predice la intención de un comando.
+
+        Args:
+            comando: Comando del usuario.
+
+        Returns:
+            Tupla (intención o None si no hay ninguna, confianza calibrada entre 0 y 1).
+        """
+        probabilidades = self.softmax(self.logits(self.vectorizar([comando])) / self.temperatura)[0]
+        mejor = int(probabilidades.argmax())
+        return self.clases[mejor] or None, float(probabilidades[mejor])
+
+    @classmethod
+    def entrenar(cls, ejemplos: List[Tuple[str, str]], max_ngramas: int = 4000,
+                 iteraciones: int = 300, tasa: float = 2.0, regularizacion: float = 1e-4,
+                 validacion: Optional[List[Tuple[str, str]]] = None) -> "ClasificadorIntenciones":
+        """
+        Entrena el clasificador por descenso de gradiente y, si hay ejemplos de validación,
+        ajusta la temperatura que minimiza su log-verosimilitud negativa.
+
+        Args:
+            ejemplos: Pares (comando, intención) de entrenamiento.
+            max_ngramas: Tamaño máximo del vocabulario (los n-gramas más frecuentes).
+            iteraciones: Pasos de descenso de gradiente.
+            tasa: Tasa de aprendizaje.
+            regularizacion: Peso de la regularización L2.
+            validacion: Pares (comando, intención) para calibrar la confianza.
+
+        Returns:
+            El clasificador entrenado.
+        """
+        comandos = [comando for comando, _ in ejemplos]
+        clases = sorted({intencion for _, intencion in ejemplos})
+        indice_clase = {clase: i for i, clase in enumerate(clases)}
+
+        # Vocabulario e IDF suavizado a partir de la frecuencia documental
+        frecuencia = {}
+        for comando in comandos:
+            for ngrama in ngramas_caracteres(comando):
+                frecuencia[ngrama] = frecuencia.get(ngrama, 0) + 1
+        vocabulario = sorted(frecuencia, key=lambda ngrama: (-frecuencia[ngrama], ngrama))[:max_ngramas]
+        df = np.array([frecuencia[ngrama] for ngrama in vocabulario], dtype=np.float32)
+        idf = (np.log((1 + len(comandos)) / (1 + df)) + 1).astype(np.float32)
+
+        modelo = cls(vocabulario, idf, np.zeros((len(vocabulario), len(clases)), dtype=np.float32),
+                     np.zeros(len(clases), dtype=np.float32), clases)
+        matriz = modelo.vectorizar(comandos)
+        objetivo = np.zeros((len(comandos), len(clases)), dtype=np.float32)
+        objetivo[np.arange(len(comandos)), [indice_clase[intencion] for _, intencion in ejemplos]] = 1.0
+
+        for _ in range(iteraciones):
+            error = (modelo.softmax(modelo.logits(matriz)) - objetivo) / len(comandos)
+            modelo.pesos -= tasa * (matriz.T @ error + regularizacion * modelo.pesos)
+            modelo.sesgo -= tasa * error.sum(axis=0)
+
+        if validacion:
+            validacion = [(comando, intencion) for comando, intencion in validacion if intencion in indice_clase]
+        if validacion:
+            logits = modelo.logits(modelo.vectorizar([comando for comando, _ in validacion]))
+            etiquetas = np.array([indice_clase[intencion] for _, intencion in validacion])
+
+            def nll(temperatura: float) -> float:
+                probabilidades = modelo.softmax(logits / temperatura)
+                return float(-np.log(probabilidades[np.arange(len(etiquetas)), etiquetas] + 1e-12).mean())
+
+            modelo.temperatura = min((0.05 * 1.15 ** k for k in range(40)), key=nll)
+        return modelo
+
+    def guardar(self, ruta: str) -> None:
+        """
+        Guarda el modelo como artefacto comprimido de NumPy.
+
+        Args:
+            ruta: Ruta del archivo .npz.
+        """
+        vocabulario = sorted(self.vocabulario, key=self.vocabulario.get)
+        with open(ruta, "wb") as f:
+            np.savez_compressed(f, vocabulario=np.array(vocabulario), idf=self.idf, pesos=self.pesos,
+                                sesgo=self.sesgo, clases=np.array(self.clases),
+                                temperatura=np.array(self.temperatura))
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "ClasificadorIntenciones":
+        """
+        Carga un modelo guardado con guardar().
+
+        Args:
+            ruta: Ruta del archivo .npz.
+
+        Returns:
+            El clasificador cargado.
+        """
+        with np.load(ruta, allow_pickle=False) as datos:
+            return cls(datos["vocabulario"].tolist(), datos["idf"], datos["pesos"], datos["sesgo"],
+                       datos["clases"].tolist(), float(datos["temperatura"]))
+
+
+# Clasificadores ya cargados, por ruta (la carga se hace la primera vez que se necesitan)
+_clasificadores_cargados = {}
+
+
+def ruta_modelo_intenciones(config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Devuelve la ruta del modelo de intenciones según la configuración.
+
+    Args:
+        config: Configuración de JARVIS.
+
+    Returns:
+        La ruta del artefacto; por defecto ~/jarvis_intenciones.npz.
+    """
+    ruta = ((config or {}).get("clasificador_intenciones") or {}).get("modelo")
+    return os.path.expanduser(ruta) if ruta else os.path.join(os.path.expanduser("~"), "jarvis_intenciones.npz")
+
+
+def obtener_clasificador(ruta: str) -> Optional[ClasificadorIntenciones]:
+    """
+    Carga el clasificador de forma perezosa y lo reutiliza en las siguientes llamadas.
+
+    Args:
+        ruta: Ruta del artefacto.
+
+    Returns:
+        El clasificador o None si NumPy no está disponible o no hay modelo entrenado.
+    """
+    if ruta not in _clasificadores_cargados:
+        clasificador = None
+        if NUMPY_DISPONIBLE and os.path.exists(ruta):
+            try:
+                clasificador = ClasificadorIntenciones.cargar(ruta)
+                logger.info(f"Clasificador de intenciones cargado desde {ruta}")
+            except Exception as e:
+                logger.error(f"Error al cargar el clasificador de intenciones: {e}")
+        _clasificadores_cargados[ruta] = clasificador
+    return _clasificadores_cargados[ruta]
+
+
+def detectar_intencion_local(comando: str, clasificador: Optional[ClasificadorIntenciones] = None,
+                             umbral: float = 0.8) -> Tuple[Optional[str], float]:
+    """
+    Detecta la intención sin llamar al modelo de lenguaje: primero por palabras clave
+    y, si no hay coincidencia, con el clasificador entrenado. Las preguntas que piden
+    una explicación no tienen intención.
+
+    Args:
+        comando: Comando del usuario.
+        clasificador: Clasificador entrenado (opcional).
+        umbral: Confianza mínima para aceptar la predicción del clasificador.
+
+    Returns:
+        Tupla (intención o None, confianza).
+    """
+    if PATRON_PREGUNTA_GENERAL.search(normalizar_texto(comando)):
+        return None, 0.0
+    intencion = detectar_intencion_por_palabras(comando)
+    if intencion or clasificador is None:
+        return intencion, 1.0 if intencion else 0.0
+    intencion, confianza = clasificador.predecir(comando)
+    return (intencion, confianza) if intencion and confianza >= umbral else (None, confianza)
+
+
+def entrenar_clasificador_intenciones(memory_file: str, ruta_modelo: str, umbral: float = 0.8,
+                                      semilla: int = 0) -> Optional[ClasificadorIntenciones]:
+    """
+    Entrena el clasificador con los ejemplos de la memoria y la semilla etiquetada,
+    informa de su calidad sobre un 20% reservado y guarda el artefacto. Los casos de
+    evaluación (CASOS_INTENCION y CASOS_PARAMETROS) se dejan fuera del entrenamiento.
+
+    Args:
+        memory_file: Archivo de memoria del que se extraen los ejemplos.
+        ruta_modelo: Ruta donde guardar el modelo.
+        umbral: Umbral de confianza con el que se evalúa.
+        semilla: Semilla del reparto entre entrenamiento y validación.
+
+    Returns:
+        El clasificador entrenado o None si no se pudo entrenar.
+    """
+    if not NUMPY_DISPONIBLE:
+        print("NumPy no está disponible. Instálalo para entrenar el clasificador.")
+        return None
+
+    evaluacion = {normalizar_texto(comando) for comando, _ in CASOS_INTENCION}
+    evaluacion |= {normalizar_texto(comando) for comando, _, _ in CASOS_PARAMETROS}
+    ejemplos = minar_ejemplos_memoria(memory_file) + EJEMPLOS_ENTRENAMIENTO_INTENCION
+    ejemplos = [(comando, intencion) for comando, intencion in dict.fromkeys(ejemplos)
+                if normalizar_texto(comando) not in evaluacion]
+    if len({intencion for _, intencion in ejemplos}) < 2:
+        print("No hay ejemplos suficientes para entrenar el clasificador.")
+        return None
+
+    random.Random(semilla).shuffle(ejemplos)
+    corte = max(1, len(ejemplos) // 5)
+    validacion, entrenamiento = ejemplos[:corte], ejemplos[corte:]
+    modelo = ClasificadorIntenciones.entrenar(entrenamiento, validacion=validacion)
+
+    # Calidad sobre los ejemplos reservados: cuántos se resuelven sin GPT y cuántos bien
+    por_palabras = locales = correctos = 0
+    for comando, esperada in validacion:
+        por_palabras += detectar_intencion_por_palabras(comando) is not None
+        intencion, _ = detectar_intencion_local(comando, modelo, umbral)
+        if intencion:
+            locales += 1
+            correctos += intencion == esperada
+    total = len(validacion)
+    print(f"Ejemplos: {len(ejemplos)} ({len(entrenamiento)} de entrenamiento, {total} de validación); "
+          f"temperatura {modelo.temperatura:.2f}")
+    print(f"Sin GPT en validación: {por_palabras}/{total} solo con palabras clave, "
+          f"{locales}/{total} con el clasificador (umbral {umbral}); "
+          f"aciertos entre los resueltos localmente: {correctos}/{locales}")
+
+    # El modelo definitivo se entrena con todos los ejemplos, conservando la calibración
+    definitivo = ClasificadorIntenciones.entrenar(ejemplos)
+    definitivo.temperatura = modelo.temperatura
+    definitivo.guardar(ruta_modelo)
+    _clasificadores_cargados.pop(ruta_modelo, None)
+    print(f"Modelo guardado en {ruta_modelo} ({os.path.getsize(ruta_modelo) / 1024:.1f} KB)")
+    return definitivo
+
+
+class Timer:
+    """Context manager para medir el tiempo de ejecución."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end_time = time.time()
+        execution_time = end_time - self.start_time
+        print(f"Tiempo de {self.name}: {execution_time:.4f} segundos")
+
+
+class TiemposEtapas:
+    """
+    Registra cuándo empieza y termina cada etapa del pipeline de process_command,
+    para comparar la suma de las etapas con la ruta crítica real.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+
+    @contextmanager
+    def medir(self, nombre: str):
+        """
+        Context manager que mide una etapa.
+
+        Args:
+            nombre: Nombre de la etapa.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = (inicio - self.inicio, time.perf_counter() - self.inicio)
+
+    def resumen(self) -> Dict[str, float]:
+        """
+        Calcula la duración de cada etapa, su suma y la ruta crítica, en milisegundos.
+
+        Returns:
+            Diccionario con la duración de cada etapa, "suma" y "ruta_critica".
+        """
+        resumen = {nombre: (fin - inicio) * 1000 for nombre, (inicio, fin) in self.etapas.items()}
+        if self.etapas:
+            resumen["suma"] = sum(resumen.values())
+            resumen["ruta_critica"] = (max(fin for _, fin in self.etapas.values())
+                                       - min(inicio for inicio, _ in self.etapas.values())) * 1000
+        return resumen
+
+    def registrar(self) -> None:
+        """Escribe el resumen de tiempos en el log."""
+        resumen = self.resumen()
+        if not resumen:
+            return
+        etapas = ", ".join(f"{nombre} {ms:.1f} ms" for nombre, ms in resumen.items()
+                           if nombre not in ("suma", "ruta_critica"))
+        logger.info(f"Etapas: {etapas} | suma {resumen['suma']:.1f} ms, "
+                    f"ruta crítica {resumen['ruta_critica']:.1f} ms")
+
+
+# Eventos de auditoría (sys.addaudithook) que tocan archivos -> cuántos de sus primeros
+# argumentos son rutas
+EVENTOS_ARCHIVOS = {
+    "open": 1,
+    "os.remove": 1,
+    "os.mkdir": 1,
+    "os.rmdir": 1,
+    "os.truncate": 1,
+    "shutil.rmtree": 1,
+    "os.rename": 2,
+    "os.link": 2,
+    "os.symlink": 2,
+    "shutil.copyfile": 2,
+    "shutil.copytree": 2,
+}
+
+# Los archivos de la propia instalación de Python (importaciones) no cuentan
+PREFIJOS_PYTHON = tuple({sys.prefix, sys.base_prefix, sys.exec_prefix})
+
+# Mediciones en curso: identificador del hilo -> rutas tocadas por ese hilo
+_archivos_por_hilo = {}
+_auditoria_instalada = False
+
+
+def _auditar_archivos(evento, argumentos):
+    if not _archivos_por_hilo:
+        return
+    rutas = EVENTOS_ARCHIVOS.get(evento)
+    if rutas is None:
+        return
+    archivos = _archivos_por_hilo.get(threading.get_ident())
+    if archivos is None:
+        return
+    try:
+        for ruta in argumentos[:rutas]:
+            if isinstance(ruta, (str, bytes, os.PathLike)):
+                ruta = os.path.abspath(os.fsdecode(ruta))
+                if ruta != os.devnull and not ruta.startswith(PREFIJOS_PYTHON):
+                    archivos.add(ruta)
+    except Exception:
+        # Un fallo aquí haría fallar la operación auditada
+        pass
+
+
+def leer_uso_recursos(por_hilo: bool = False) -> Tuple[float, float, int]:
+    """
+    Lee el consumo acumulado hasta ahora del proceso (o solo del hilo actual, donde el
+    sistema lo permite). La CPU incluye la de los procesos hijos ya terminados; el pico
+    de memoria es solo el del proceso (el de los hijos es un máximo entre todos ellos,
+    no se puede atribuir a una ejecución).
+
+    Args:
+        por_hilo: Si es True se mide solo la CPU del hilo actual.
+
+    Returns:
+        Tupla (CPU de usuario en s, CPU de sistema en s, pico de memoria residente en KB).
+    """
+    if RESOURCE_DISPONIBLE:
+        quien = (resource.RUSAGE_THREAD if por_hilo and hasattr(resource, "RUSAGE_THREAD")
+                 else resource.RUSAGE_SELF)
+        propio = resource.getrusage(quien)
+        hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        escala = 1024 if SISTEMA_OPERATIVO == "Darwin" else 1
+        return (propio.ru_utime + hijos.ru_utime, propio.ru_stime + hijos.ru_stime,
+                propio.ru_maxrss // escala)
+    proceso = psutil.Process()
+    tiempos = proceso.cpu_times()
+    memoria = proceso.memory_info()
+    return (tiempos.user + getattr(tiempos, "children_user", 0),
+            tiempos.system + getattr(tiempos, "children_system", 0),
+            getattr(memoria, "peak_wset", memoria.rss) // 1024)
+
+
+class MedidorRecursos:
+    """
+    Context manager que mide lo que consume un bloque: tiempo real, CPU de usuario y de
+    sistema (incluidos los procesos hijos que terminan dentro), crecimiento del pico de
+    memoria residente del proceso y archivos tocados (por auditoría de sys.addaudithook).
+    A diferencia de Timer no imprime nada: el consumo queda en self.consumo para guardarlo
+    con la conversación.
+
+    La CPU (con por_hilo) y los archivos se atribuyen al hilo que ejecuta el bloque, así que
+    el bloque no debe ceder el hilo a otras tareas: sirve para código síncrono (en un proceso
+    del sandbox o con asyncio.to_thread), no para envolver un await en el bucle de eventos.
+    """
+
+    def __init__(self, por_hilo: bool = False):
+        self.por_hilo = por_hilo
+        self.consumo = {}
+
+    def __enter__(self):
+        global _auditoria_instalada
+        if not _auditoria_instalada:
+            sys.addaudithook(_auditar_archivos)
+            _auditoria_instalada = True
+        self.hilo = threading.get_ident()
+        self.archivos = set()
+        self.anteriores = _archivos_por_hilo.get(self.hilo)
+        _archivos_por_hilo[self.hilo] = self.archivos
+        self.uso_inicial = leer_uso_recursos(self.por_hilo)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duracion = time.perf_counter() - self.inicio
+        usuario, sistema, pico = leer_uso_recursos(self.por_hilo)
+        if self.anteriores is None:
+            _archivos_por_hilo.pop(self.hilo, None)
+        else:
+            _archivos_por_hilo[self.hilo] = self.anteriores
+            self.anteriores.update(self.archivos)
+        self.consumo = {
+            "tiempo_ms": round(duracion * 1000, 2),
+            "cpu_usuario_ms": round((usuario - self.uso_inicial[0]) * 1000, 2),
+            "cpu_sistema_ms": round((sistema - self.uso_inicial[1]) * 1000, 2),
+            "rss_pico_kb": max(0, pico - self.uso_inicial[2]),
+            "archivos": len(self.archivos),
+        }
+
+    def medir(self, funcion: Callable[..., Any], *args, **kwargs) -> Any:
+        """Llama a la función dentro de la medición (útil con asyncio.to_thread)."""
+        with self:
+            return funcion(*args, **kwargs)
+
+
+def describir_recursos(recursos: Dict[str, Any]) -> str:
+    """
+    Resume en una línea un registro de consumo de MedidorRecursos.
+
+    Args:
+        recursos: Consumo medido.
+
+    Returns:
+        El texto del resumen.
+    """
+    return (f"{recursos.get('tiempo_ms', 0):.1f} ms, CPU {recursos.get('cpu_usuario_ms', 0):.1f} ms usuario"
+            f" + {recursos.get('cpu_sistema_ms', 0):.1f} ms sistema, pico RSS +{recursos.get('rss_pico_kb', 0)} KB,"
+            f" {recursos.get('bytes_salida', 0)} bytes de salida, {recursos.get('archivos', 0)} archivos")
+
+
+def informe_recursos(memory_file: str, mas_costosas: int = 5) -> List[Dict[str, Any]]:
+    """
+    Muestra el consumo medio por intención guardado en la memoria y las ejecuciones más
+    costosas, para ver qué código conviene evitar en el prompt o cubrir con plantillas.
+
+    Args:
+        memory_file: Archivo de memoria.
+        mas_costosas: Número de ejecuciones individuales a mostrar.
+
+    Returns:
+        El resumen por intención (JarvisMemory.resumen_recursos).
+    """
+    memoria = JarvisMemory(memory_file, usar_chromadb=False)
+    filas = memoria.resumen_recursos()
+    if not filas:
+        print(f"No hay ejecuciones con recursos medidos en {memory_file}.")
+        return filas
+
+    print(f"{'Intención':<24}{'N':>5}{'t medio':>11}{'t máx':>11}{'CPU media':>11}"
+          f"{'RSS pico':>11}{'salida':>10}{'archivos':>10}")
+    for fila in filas:
+        print(f"{fila['intencion']:<24}{fila['ejecuciones']:>5}{fila['tiempo_medio_ms']:>8.1f} ms"
+              f"{fila['tiempo_max_ms']:>8.1f} ms{fila['cpu_media_ms']:>8.1f} ms{fila['rss_pico_kb']:>8} KB"
+              f"{fila['bytes_salida_medios']:>10.0f}{fila['archivos_medios']:>10.1f}")
+
+    conversaciones = [conv for conv in memoria.memory_data["conversations"] if conv.get("recursos")]
+    conversaciones.sort(key=lambda conv: conv["recursos"].get("tiempo_ms", 0), reverse=True)
+    if conversaciones:
+        print("\nEjecuciones más costosas:")
+    for conv in conversaciones[:mas_costosas]:
+        codigo = (conv.get("executed_code") or "").strip().splitlines()
+        print(f"- {conv['user_input']!r} ({conv.get('intencion') or 'sin_intencion'}): "
+              f"{describir_recursos(conv['recursos'])}")
+        if codigo:
+            print(f"    {codigo[0][:100]}{' ...' if len(codigo) > 1 else ''}")
+    return filas
+
+
+def percentil(valores, p: float) -> float:
+    """
+    Calcula un percentil por el método del rango más cercano.
+
+    Args:
+        valores: Muestras numéricas (no vacías).
+        p: Percentil entre 0 y 100.
+
+    Returns:
+        El valor del percentil.
+    """
+    muestras = sorted(valores)
+    indice = max(0, math.ceil(p / 100 * len(muestras)) - 1)
+    return muestras[indice]
+
+
+# Códigos HTTP que se consideran transitorios y justifican un reintento
+CODIGOS_HTTP_TRANSITORIOS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TransporteLLM:
+    """
+    Capa de transporte para las peticiones al modelo de lenguaje.
+
+    Mantiene un pool de conexiones keep-alive, reintenta los errores transitorios
+    con backoff exponencial con jitter, aplica un plazo máximo a cada intento y,
+    si el hedging está activado, lanza una segunda petición cuando la primera no
+    ha producido ningún token tras el percentil 95 de la latencia observada.
+    """
+
+    # Número mínimo de muestras antes de fiarse del percentil 95
+    MIN_MUESTRAS_P95 = 20
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el transporte.
+
+        Args:
+            config: Sección "transporte_llm" de la configuración.
+        """
+        import httpx
+        import openai
+
+        config = config or {}
+        self.reintentos = int(config.get("reintentos", 3))
+        self.backoff_base = float(config.get("backoff_base", 0.5))
+        self.backoff_max = float(config.get("backoff_max", 8.0))
+        self.timeout_intento = float(config.get("timeout_intento", 60.0))
+        self.hedging = bool(config.get("hedging", False))
+        self.hedging_retardo_inicial = float(config.get("hedging_retardo_inicial", 2.0))
+
+        # Latencias hasta el primer token de los intentos que terminaron bien
+        self.latencias_primer_token = deque(maxlen=200)
+
+        self._errores_conexion = (openai.APIConnectionError,)
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(config.get("conexiones_max", 10)),
+                max_keepalive_connections=int(config.get("conexiones_keepalive", 5)),
+            ),
+            timeout=httpx.Timeout(self.timeout_intento, connect=10.0),
+        )
+        # Los reintentos los gestiona esta clase, no el cliente de OpenAI
+        self.client = openai.AsyncOpenAI(
+            base_url=config.get("base_url") or None,
+            max_retries=0,
+            http_client=self.http_client,
+        )
+
+    def es_error_transitorio(self, error: BaseException) -> bool:
+        """
+        Indica si un error justifica reintentar la petición.
+
+        Args:
+            error: Excepción producida por un intento.
+
+        Returns:
+            True si el error es transitorio (red, plazo agotado, 429 o 5xx).
+        """
+        if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+            return True
+        if isinstance(error, self._errores_conexion):
+            return True
+        return getattr(error, "status_code", None) in CODIGOS_HTTP_TRANSITORIOS
+
+    def calcular_espera(self, intento: int, error: Optional[BaseException] = None) -> float:
+        """
+        Calcula la espera antes del siguiente intento (backoff exponencial con jitter completo).
+
+        Args:
+            intento: Número de intento fallido, empezando en 0.
+            error: Error producido, para respetar la cabecera Retry-After si existe.
+
+        Returns:
+            Segundos a esperar.
+        """
+        tope = min(self.backoff_max, self.backoff_base * (2 ** intento))
+        espera = random.uniform(0, tope)
+
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                espera = max(espera, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return espera
+
+    def retardo_hedging(self) -> float:
+        """
+        Calcula cuánto esperar al primer token antes de lanzar la petición de respaldo.
+
+        Returns:
+            El percentil 95 de la latencia hasta el primer token, o el retardo
+            inicial configurado si todavía no hay muestras suficientes.
+        """
+        if len(self.latencias_primer_token) < self.MIN_MUESTRAS_P95:
+            return self.hedging_retardo_inicial
+        return percentil(self.latencias_primer_token, 95)
+
+    async def _intento(self, peticion: Dict[str, Any], indice: int,
+                       primer_token: asyncio.Event, carrera: Dict[str, Any]) -> str:
+        """
+        Realiza un intento de petición en streaming.
+
+        Args:
+            peticion: Argumentos para chat.completions.create.
+            indice: Número del intento dentro de la carrera de hedging.
+            primer_token: Evento que se activa al recibir el primer token.
+            carrera: Estado compartido por los intentos: el ganador (el primero que
+                produce un token), la función que recibe los fragmentos y si ya se emitió alguno.
+
+        Returns:
+            El texto completo de la respuesta.
+        """
+        inicio = time.perf_counter()
+        partes = []
+        stream = await self.client.chat.completions.create(**peticion, stream=True)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not primer_token.is_set():
+                    self.latencias_primer_token.append(time.perf_counter() - inicio)
+                    if carrera["ganador"] is None:
+                        carrera["ganador"] = indice
+                    primer_token.set()
+                partes.append(delta)
+                # Solo el intento ganador reenvía sus fragmentos
+                if carrera["al_fragmento"] is not None and carrera["ganador"] == indice:
+                    carrera["emitido"] = True
+                    await carrera["al_fragmento"](delta)
+        finally:
+            await stream.close()
+        return "".join(partes)
+
+    async def _ejecutar(self, peticion: Dict[str, Any], carrera: Dict[str, Any]) -> str:
+        """
+        Ejecuta una petición, con una segunda petición de respaldo si el hedging está activado.
+
+        Args:
+            peticion: Argumentos para chat.completions.create.
+            carrera: Estado compartido por los intentos (ver _intento).
+
+        Returns:
+            El texto de la primera petición que empiece a producir tokens.
+        """
+        tareas = []
+        eventos = []
+
+        def lanzar():
+            evento = asyncio.Event()
+            tarea = asyncio.create_task(asyncio.wait_for(
+                self._intento(peticion, len(tareas), evento, carrera), self.timeout_intento
+            ))
+            eventos.append(evento)
+            tareas.append(tarea)
+
+        lanzar()
+        try:
+            if not self.hedging:
+                return await tareas[0]
+
+            # Esperar al primer token (o al final) del primer intento
+            espera_evento = asyncio.create_task(eventos[0].wait())
+            hechos, _ = await asyncio.wait(
+                {espera_evento, tareas[0]},
+                timeout=self.retardo_hedging(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            espera_evento.cancel()
+            if not hechos:
+                logger.info("Sin primer token dentro del p95, lanzando petición de respaldo")
+                lanzar()
+
+            return await self._esperar_ganador(tareas, eventos, carrera)
+        finally:
+            pendientes = [tarea for tarea in tareas if not tarea.done()]
+            for tarea in pendientes:
+                tarea.cancel()
+            if pendientes:
+                await asyncio.gather(*pendientes, return_exceptions=True)
+
+    async def _esperar_ganador(self, tareas: List[asyncio.Task], eventos: List[asyncio.Event],
+                               carrera: Dict[str, Any]) -> str:
+        """
+        Espera al intento que produzca antes su primer token y descarta el resto.
+
+        Args:
+            tareas: Intentos en curso.
+            eventos: Eventos de primer token de cada intento.
+            carrera: Estado compartido por los intentos (ver _intento).
+
+        Returns:
+            El texto del intento ganador.
+        """
+        activos = list(range(len(tareas)))
+        ultimo_error = None
+        while activos:
+            esperas = [asyncio.create_task(eventos[i].wait()) for i in activos]
+            hechos, _ = await asyncio.wait(
+                set(esperas) | {tareas[i] for i in activos},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for espera in esperas:
+                espera.cancel()
+
+            if carrera["ganador"] is not None:
+                return await tareas[carrera["ganador"]]
+            for i in list(activos):
+                if tareas[i] in hechos:
+                    if tareas[i].exception() is None:
+                        return tareas[i].result()
+                    ultimo_error = tareas[i].exception()
+                    activos.remove(i)
+        raise ultimo_error
+
+    async def completar(self, al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+                        **peticion: Any) -> str:
+        """
+        Obtiene una respuesta completa del modelo, reintentando los errores transitorios.
+
+        Args:
+            al_fragmento: Función asíncrona que recibe cada fragmento de texto según llega.
+            **peticion: Argumentos para chat.completions.create (model, messages, ...).
+
+        Returns:
+            El texto de la respuesta.
+        """
+        for intento in range(self.reintentos + 1):
+            carrera = {"ganador": None, "al_fragmento": al_fragmento, "emitido": False}
+            try:
+                return await self._ejecutar(peticion, carrera)
+            except Exception as e:
+                # Si ya se enviaron fragmentos al usuario, reintentar duplicaría la salida
+                if intento >= self.reintentos or carrera["emitido"] or not self.es_error_transitorio(e):
+                    raise
+                espera = self.calcular_espera(intento, e)
+                logger.warning(
+                    f"Error transitorio en la petición al modelo ({type(e).__name__}: {e}). "
+                    f"Reintento {intento + 1}/{self.reintentos} en {espera:.2f} segundos"
+                )
+                await asyncio.sleep(espera)
+
+    async def cerrar(self) -> None:
+        """Cierra las conexiones del pool."""
+        await self.client.close()
+
+
+class ProveedorLLM:
+    """
+    Interfaz común de los proveedores de modelos de lenguaje.
+    get_gpt_response solo depende de esta interfaz, por lo que el backend
+    real puede sustituirse por uno local para pruebas o benchmarks.
+    """
+
+    async def completar(self, al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+                        **peticion: Any) -> str:
+        """
+        Obtiene la respuesta completa del modelo.
+
+        Args:
+            al_fragmento: Función asíncrona que recibe cada fragmento de texto según llega.
+            **peticion: Argumentos de la petición (model, messages, max_tokens, temperature).
+
+        Returns:
+            El texto de la respuesta.
+        """
+        raise NotImplementedError
+
+    async def cerrar(self) -> None:
+        """Libera los recursos del proveedor."""
+
+
+class ProveedorOpenAI(ProveedorLLM):
+    """
+    Proveedor que usa la API de OpenAI a través de TransporteLLM.
+    Opcionalmente graba cada intercambio para reproducirlo después con ProveedorMock.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Inicializa el proveedor.
+
+        Args:
+            config: Configuración completa del chatbot.
+        """
+        self.transporte = TransporteLLM(config.get("transporte_llm"))
+        self.archivo_grabacion = (config.get("mock_llm") or {}).get("grabar_en")
+
+    async def completar(self, al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+                        **peticion: Any) -> str:
+        respuesta = await self.transporte.completar(al_fragmento, **peticion)
+        if self.archivo_grabacion:
+            self.grabar(peticion.get("messages", []), respuesta)
+        return respuesta
+
+    def grabar(self, messages: List[Dict[str, str]], respuesta: str) -> None:
+        """
+        Añade un intercambio al archivo de grabaciones (JSONL).
+
+        Args:
+            messages: Mensajes enviados al modelo.
+            respuesta: Respuesta obtenida.
+        """
+        try:
+            with open(self.archivo_grabacion, "a", encoding="utf-8") as f:
+                registro = {"comando": ultimo_mensaje_usuario(messages), "respuesta": respuesta}
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Error al grabar la respuesta del modelo: {e}")
+
+    async def cerrar(self) -> None:
+        await self.transporte.cerrar()
+
+
+class ProveedorMock(ProveedorLLM):
+    """
+    Proveedor local y determinista que reproduce respuestas grabadas.
+    Simula la latencia hasta el primer token y el streaming por fragmentos,
+    así que permite medir el pipeline completo sin red.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el proveedor.
+
+        Args:
+            config: Sección "mock_llm" de la configuración.
+        """
+        config = config or {}
+        self.latencia_primer_token = float(config.get("latencia_primer_token", 0.2))
+        self.latencia_por_fragmento = float(config.get("latencia_por_fragmento", 0.01))
+        self.caracteres_por_fragmento = max(1, int(config.get("caracteres_por_fragmento", 16)))
+        self.respuestas_exactas = {}
+        self.respuestas_parciales = []
+        if config.get("grabaciones"):
+            self.cargar_grabaciones(config["grabaciones"])
+
+    def cargar_grabaciones(self, ruta: str) -> int:
+        """
+        Carga respuestas grabadas desde un archivo JSONL.
+        Cada línea tiene "respuesta" y, o bien "comando" (coincidencia exacta),
+        o bien "contiene" (coincidencia por subcadena).
+
+        Args:
+            ruta: Ruta al archivo de grabaciones.
+
+        Returns:
+            Número de grabaciones cargadas.
+        """
+        cargadas = 0
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                for linea in f:
+                    if not linea.strip():
+                        continue
+                    registro = json.loads(linea)
+                    if "comando" in registro:
+                        self.respuestas_exactas[registro["comando"].strip().lower()] = registro["respuesta"]
+                    elif "contiene" in registro:
+                        self.respuestas_parciales.append((registro["contiene"].lower(), registro["respuesta"]))
+                    cargadas += 1
+            logger.info(f"Cargadas {cargadas} respuestas grabadas desde {ruta}")
+        except Exception as e:
+            logger.error(f"Error al cargar las grabaciones del proveedor simulado: {e}")
+        return cargadas
+
+    def elegir_respuesta(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Elige la respuesta grabada para el último mensaje del usuario.
+
+        Args:
+            messages: Mensajes de la petición.
+
+        Returns:
+            La respuesta grabada o una respuesta genérica determinista.
+        """
+        comando = ultimo_mensaje_usuario(messages).strip().lower()
+        if comando in self.respuestas_exactas:
+            return self.respuestas_exactas[comando]
+        for fragmento, respuesta in self.respuestas_parciales:
+            if fragmento in comando:
+                return respuesta
+        return f"Entendido. Esta es una respuesta simulada para: {comando}"
+
+    async def stream(self, **peticion: Any):
+        """
+        Produce la respuesta por fragmentos con la latencia configurada.
+
+        Args:
+            **peticion: Argumentos de la petición.
+
+        Yields:
+            Fragmentos de texto de la respuesta.
+        """
+        respuesta = self.elegir_respuesta(peticion.get("messages", []))
+        await asyncio.sleep(self.latencia_primer_token)
+        for inicio in range(0, len(respuesta), self.caracteres_por_fragmento):
+            if inicio:
+                await asyncio.sleep(self.latencia_por_fragmento)
+            yield respuesta[inicio:inicio + self.caracteres_por_fragmento]
+
+    async def completar(self, al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+                        **peticion: Any) -> str:
+        partes = []
+        async for fragmento in self.stream(**peticion):
+            partes.append(fragmento)
+            if al_fragmento is not None:
+                await al_fragmento(fragmento)
+        return "".join(partes)
+
+
+def ultimo_mensaje_usuario(messages: List[Dict[str, str]]) -> str:
+    """
+    Devuelve el contenido del último mensaje del usuario.
+
+    Args:
+        messages: Lista de mensajes de la conversación.
+
+    Returns:
+        El contenido del último mensaje con rol "user", o una cadena vacía.
+    """
+    for mensaje in reversed(messages):
+        if mensaje.get("role") == "user":
+            return mensaje.get("content", "")
+    return ""
+
+
+def crear_proveedor_llm(config: Dict[str, Any]) -> Optional[ProveedorLLM]:
+    """
+    Crea el proveedor de modelo de lenguaje indicado en la configuración.
+
+    Args:
+        config: Configuración completa del chatbot.
+
+    Returns:
+        El proveedor, o None si el proveedor elegido no está disponible.
+    """
+    proveedor = config.get("proveedor_llm", "openai")
+    if proveedor == "mock":
+        return ProveedorMock(config.get("mock_llm"))
+    if proveedor == "openai" and OPENAI_DISPONIBLE:
+        return ProveedorOpenAI(config)
+    return None
+
+
+class ManejadorMockLLM(BaseHTTPRequestHandler):
+    """
+    Manejador HTTP que imita el endpoint /v1/chat/completions de OpenAI,
+    con y sin streaming, usando el ProveedorMock del servidor.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        logger.debug("Servidor LLM simulado: " + formato % args)
+
+    def enviar_json(self, estado: int, datos: Dict[str, Any]) -> None:
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def enviar_trozo(self, datos: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(datos), datos))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.enviar_json(404, {"error": {"message": "Ruta no encontrada"}})
+            return
+
+        mock = self.server.proveedor
+        longitud = int(self.headers.get("Content-Length", 0))
+        peticion = json.loads(self.rfile.read(longitud) or b"{}")
+        respuesta = mock.elegir_respuesta(peticion.get("messages", []))
+        modelo = peticion.get("model", "mock")
+        time.sleep(mock.latencia_primer_token)
+
+        if not peticion.get("stream"):
+            self.enviar_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": modelo,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": respuesta},
+                    "finish_reason": "stop",
+                }],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        paso = mock.caracteres_por_fragmento
+        for inicio in range(0, len(respuesta), paso):
+            if inicio:
+                time.sleep(mock.latencia_por_fragmento)
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": modelo,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": respuesta[inicio:inicio + paso]},
+                    "finish_reason": None,
+                }],
+            }
+            self.enviar_trozo(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.enviar_trozo(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ServidorMockLLM:
+    """
+    Servidor HTTP local que habla la misma API que OpenAI.
+    Sirve para probar TransporteLLM de punta a punta sin red.
+    """
+
+    def __init__(self, proveedor: ProveedorMock, host: str = "127.0.0.1", puerto: int = 8765):
+        """
+        Inicializa el servidor.
+
+        Args:
+            proveedor: Proveedor simulado del que se toman las respuestas y latencias.
+            host: Dirección en la que escuchar.
+            puerto: Puerto en el que escuchar (0 para uno libre).
+        """
+        self.httpd = ThreadingHTTPServer((host, puerto), ManejadorMockLLM)
+        self.httpd.daemon_threads = True
+        self.httpd.proveedor = proveedor
+
+    @property
+    def url(self) -> str:
+        """URL base compatible con el cliente de OpenAI."""
+        host, puerto = self.httpd.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def iniciar(self) -> None:
+        """Arranca el servidor en un hilo en segundo plano."""
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logger.info(f"Servidor LLM simulado escuchando en {self.url}")
+
+    def detener(self) -> None:
+        """Detiene el servidor."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Estima el número de tokens de un texto (aproximadamente 4 caracteres por token).
+
+    Args:
+        texto: Texto a medir.
+
+    Returns:
+        Número estimado de tokens.
+    """
+    return (len(texto) + 3) // 4
+
+
+def recortar_a_tokens(texto: str, max_tokens: int) -> str:
+    """
+    Recorta un texto para que no supere un presupuesto de tokens,
+    conservando la parte final (la más reciente).
+
+    Args:
+        texto: Texto a recortar.
+        max_tokens: Presupuesto máximo de tokens.
+
+    Returns:
+        El texto recortado por un límite de palabra.
+    """
+    max_caracteres = max_tokens * 4
+    if len(texto) <= max_caracteres:
+        return texto
+    recortado = texto[-max_caracteres:]
+    espacio = recortado.find(" ")
+    if 0 <= espacio < 40:
+        recortado = recortado[espacio + 1:]
+    return "..." + recortado
+
+
+class ResumidorConversacion:
+    """
+    Mantiene un resumen acumulado de los turnos que salen del historial de conversación.
+    Los turnos expulsados se pliegan en segundo plano sobre el resumen existente
+    (sin rehacerlo desde cero), y el resumen nunca supera un presupuesto fijo de tokens,
+    así que el tamaño del prompt se mantiene constante en sesiones largas.
+    """
+
+    PROMPT_RESUMEN = (
+        "Eres el módulo de memoria de JARVIS. Actualiza el resumen de la conversación "
+        "incorporando los nuevos turnos. Conserva nombres de archivos, rutas, preferencias "
+        "del usuario y tareas pendientes; omite saludos y detalles irrelevantes. "
+        "Responde solo con el resumen actualizado, en un máximo de {max_palabras} palabras."
+    )
+
+    def __init__(self, proveedor_llm: Optional[ProveedorLLM], config: Dict[str, Any]):
+        """
+        Inicializa el resumidor.
+
+        Args:
+            proveedor_llm: Proveedor usado para resumir; si es None se usa un resumen extractivo.
+            config: Configuración completa del chatbot.
+        """
+        config_resumen = config.get("resumen_historial") or {}
+        self.proveedor_llm = proveedor_llm
+        self.habilitado = config_resumen.get("habilitado", True)
+        self.max_tokens = int(config_resumen.get("max_tokens", 300))
+        self.modelo = config_resumen.get("modelo") or config.get("modelo_gpt")
+        self.resumen = ""
+        self.pendientes = []
+        self.tarea = None
+
+    def agregar_turnos(self, turnos: List[Dict[str, str]]) -> None:
+        """
+        Añade turnos expulsados del historial y programa su plegado en segundo plano.
+
+        Args:
+            turnos: Mensajes expulsados (con "role" y "content").
+        """
+        if not self.habilitado or not turnos:
+            return
+        self.pendientes.extend(turnos)
+        if self.tarea is not None and not self.tarea.done():
+            # La tarea en curso recogerá los nuevos turnos al terminar el lote actual
+            return
+        try:
+            self.tarea = asyncio.get_running_loop().create_task(self.actualizar())
+        except RuntimeError:
+            # Sin bucle de eventos: plegado extractivo inmediato
+            self.resumen = self.plegar_extractivo(self.resumen, self.pendientes)
+            self.pendientes = []
+
+    async def actualizar(self) -> None:
+        """Pliega los turnos pendientes sobre el resumen hasta vaciar la cola."""
+        while self.pendientes:
+            lote, self.pendientes = self.pendientes, []
+            self.resumen = await self.plegar(self.resumen, lote)
+            logger.debug(f"Resumen de conversación actualizado ({estimar_tokens(self.resumen)} tokens)")
+
+    async def plegar(self, resumen: str, turnos: List[Dict[str, str]]) -> str:
+        """
+        Incorpora nuevos turnos al resumen existente.
+
+        Args:
+            resumen: Resumen actual.
+            turnos: Turnos a incorporar.
+
+        Returns:
+            El nuevo resumen, dentro del presupuesto de tokens.
+        """
+        if self.proveedor_llm is not None:
+            texto_turnos = "\n".join(f"{t['role']}: {t['content']}" for t in turnos)
+            messages = [
+                {"role": "system", "content": self.PROMPT_RESUMEN.format(max_palabras=int(self.max_tokens * 0.7))},
+                {"role": "user", "content": f"RESUMEN ACTUAL:\n{resumen or '(vacío)'}\n\nNUEVOS TURNOS:\n{texto_turnos}"},
+            ]
+            try:
+                nuevo = await self.proveedor_llm.completar(
+                    model=self.modelo,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    temperature=0.2,
+                )
+                return recortar_a_tokens(nuevo.strip(), self.max_tokens)
+            except Exception as e:
+                logger.error(f"Error al resumir la conversación, usando resumen extractivo: {e}")
+        return self.plegar_extractivo(resumen, turnos)
+
+    def plegar_extractivo(self, resumen: str, turnos: List[Dict[str, str]]) -> str:
+        """
+        Resumen de respaldo sin modelo: añade una línea breve por turno y recorta al presupuesto.
+
+        Args:
+            resumen: Resumen actual.
+            turnos: Turnos a incorporar.
+
+        Returns:
+            El nuevo resumen.
+        """
+        lineas = [resumen] if resumen else []
+        for turno in turnos:
+            quien = "Usuario" if turno["role"] == "user" else "JARVIS"
+            contenido = " ".join(str(turno["content"]).split())
+            if len(contenido) > 120:
+                contenido = contenido[:120] + "..."
+            lineas.append(f"- {quien}: {contenido}")
+        return recortar_a_tokens("\n".join(lineas), self.max_tokens)
+
+    def mensaje_resumen(self) -> Optional[Dict[str, str]]:
+        """
+        Devuelve el resumen como mensaje de sistema para el prompt.
+
+        Returns:
+            El mensaje, o None si todavía no hay resumen.
+        """
+        if not self.resumen:
+            return None
+        return {"role": "system", "content": f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{self.resumen}"}
+
+    async def esperar(self) -> None:
+        """Espera a que termine el plegado en curso, si lo hay."""
+        if self.tarea is not None:
+            await asyncio.gather(self.tarea, return_exceptions=True)
+
+
+# Módulos de red que el código generado no puede usar
+MODULOS_RED = {"socket", "urllib", "urllib3", "requests", "http", "httpx", "aiohttp", "ftplib", "smtplib",
+               "telnetlib", "paramiko"}
+
+# Funciones de borrado que el código generado no puede llamar (por nombre completo)
+FUNCIONES_BORRADO = {"os.remove", "os.unlink", "os.rmdir", "os.removedirs", "shutil.rmtree"}
+
+# Métodos que borran archivos sea cual sea el objeto (Path(x).unlink(), ruta.rmdir())
+METODOS_BORRADO = {"unlink", "rmdir"}
+
+# Módulos a los que solo se puede acceder por nombres literales: getattr con un nombre
+# calculado, vars(), __dict__ o import * esquivarían la comprobación por nombre
+MODULOS_ACCESO_LITERAL = {"os", "shutil", "pathlib"}
+
+# Funciones que pasan su primer argumento a la shell (además de las de subprocess)
+FUNCIONES_SHELL = {"os.system", "os.popen", "ejecutar_comando"}
+
+# Comandos de borrado peligrosos dentro de cadenas (para subprocess o ejecutar_comando)
+PATRONES_BORRADO_SHELL = [
+    re.compile(r'rm\s+-rf'),  # rm -rf en comandos shell
+    re.compile(r'del\s+/[QSF]'),  # del /Q o similares en Windows
+    re.compile(r'rmdir\s+/[QS]'),  # rmdir /Q o similares en Windows
+    re.compile(r'\s-delete\b'),  # find ... -delete
+    re.compile(r'xargs\s+(?:-\S+\s+)*rm\b'),  # ... | xargs rm
+]
+
+# Separadores entre las órdenes de una línea de shell: ; && || | & $( ` ( ) y saltos de línea
+PATRON_SEPARADORES_SHELL = re.compile(r"&&|\|\||\$\(|[;|&`()\n]")
+
+# Programas que ejecutan la orden que reciben como argumentos (xargs rm, sudo rm...)
+PROGRAMAS_ENVOLTORIO = {"sudo", "doas", "xargs", "env", "nohup", "nice", "time", "timeout", "command",
+                        "exec", "busybox", "stdbuf"}
+
+# Opciones de find que ejecutan la orden que las sigue
+OPCIONES_EJECUTAR_FIND = {"-exec", "-execdir", "-ok", "-okdir"}
+
+
+
+def es_comando_borrado(texto: str) -> bool:
+    """
+    Indica si un texto contiene un comando de shell que borra archivos.
+
+    Args:
+        texto: Comando o cadena a revisar.
+
+    Returns:
+        True si coincide con alguno de PATRONES_BORRADO_SHELL.
+    """
+    return any(patron.search(texto) for patron in PATRONES_BORRADO_SHELL)
+
+
+# Programas que borran archivos (primera palabra de un comando)
+COMANDOS_BORRADO = {"rm", "rmdir", "del", "erase", "rd", "shred", "unlink"}
+
+
+def programa_de_orden(palabras: List[str], inicio: int = 0) -> Optional[str]:
+    """
+    Devuelve el programa que ejecuta una orden de shell, saltando las asignaciones de
+    variables, los envoltorios (sudo, xargs...) y sus opciones.
+
+    Args:
+        palabras: Palabras de la orden.
+        inicio: Posición desde la que empieza la orden.
+
+    Returns:
+        El nombre del programa en minúsculas y sin ruta ni extensión, o None.
+    """
+    for palabra in palabras[inicio:]:
+        if palabra.startswith("-") or palabra.isdigit() or re.match(r"^\w+=", palabra):
+            continue
+        nombre = os.path.splitext(os.path.basename(palabra))[0].lower()
+        if nombre not in PROGRAMAS_ENVOLTORIO:
+            return nombre
+    return None
+
+
+def orden_borra_archivos(comando: str) -> bool:
+    """
+    Indica si una línea de shell borra archivos. Se separa en órdenes (por ; && || | &, $(
+    y comillas invertidas) y se mira el programa de cada una, el de las órdenes de
+    find -exec y si se usa find -delete.
+
+    Args:
+        comando: Línea de shell.
+
+    Returns:
+        True si alguna de sus órdenes borra archivos.
+    """
+    if es_comando_borrado(comando):
+        return True
+    for segmento in PATRON_SEPARADORES_SHELL.split(comando):
+        try:
+            palabras = shlex.split(segmento)
+        except ValueError:
+            palabras = segmento.split()
+        inicios = [0] + [i + 1 for i, palabra in enumerate(palabras) if palabra in OPCIONES_EJECUTAR_FIND]
+        if "-delete" in palabras or any(programa_de_orden(palabras, inicio) in COMANDOS_BORRADO
+                                         for inicio in inicios):
+            return True
+    return False
+
+MENSAJE_RED = "El código contiene operaciones de red, que no están permitidas."
+MENSAJE_BORRADO = "El código contiene operaciones de eliminación de archivos, que no están permitidas por seguridad."
+MENSAJE_ACCESO_DINAMICO = ("El código accede de forma dinámica a os, shutil o pathlib (getattr con un nombre "
+                           "calculado, vars, __dict__ o import *), que no está permitido.")
+# La capa base del entorno (los builtins de exec) se comparte entre ejecuciones
+MENSAJE_BUILTINS = "El código accede a __builtins__, que no está permitido."
+
+
+class PoliticaCodigo(ast.NodeVisitor):
+    """
+    Valida el árbol sintáctico del código generado en una sola pasada: importaciones,
+    atributos, llamadas y cadenas. Sigue los alias (import os as o, from os import remove,
+    m = __import__("os")), los módulos obtenidos con __import__, importlib.import_module o
+    sys.modules y los accesos indirectos (getattr(os, "remove")). Los comandos que se pasan
+    a la shell (os.system, subprocess, ejecutar_comando) se revisan orden por orden, y
+    también los pasados como lista (subprocess.run(["rm", ruta])).
+    """
+
+    def __init__(self):
+        self.alias = {}
+        self.error = None
+
+    def infringir(self, mensaje: str) -> None:
+        if self.error is None:
+            self.error = mensaje
+
+    def nombre_completo(self, nodo: ast.AST) -> Optional[str]:
+        """
+        Nombre con puntos de un nodo Name/Attribute, resolviendo los alias de importación
+        y los módulos importados con __import__("os"), importlib.import_module("os") o
+        sys.modules["os"].
+        """
+        if isinstance(nodo, ast.Name):
+            return self.alias.get(nodo.id, nodo.id)
+        if isinstance(nodo, ast.Attribute):
+            base = self.nombre_completo(nodo.value)
+            return f"{base}.{nodo.attr}" if base else None
+        if (isinstance(nodo, ast.Call) and nodo.args and self.cadena(nodo.args[0])
+                and self.nombre_completo(nodo.func) in ("__import__", "importlib.import_module")):
+            return nodo.args[0].value
+        if (isinstance(nodo, ast.Subscript) and self.cadena(nodo.slice)
+                and self.nombre_completo(nodo.value) == "sys.modules"):
+            return nodo.slice.value
+        return None
+
+    @staticmethod
+    def cadena(nodo: ast.AST) -> bool:
+        return isinstance(nodo, ast.Constant) and isinstance(nodo.value, str)
+
+    def texto_literal(self, nodo: ast.AST) -> str:
+        """Texto de una cadena, f-string o concatenación; las partes no literales se sustituyen por " X "."""
+        if self.cadena(nodo):
+            return nodo.value
+        if isinstance(nodo, ast.JoinedStr):
+            return "".join(self.texto_literal(parte) for parte in nodo.values)
+        if isinstance(nodo, ast.BinOp) and isinstance(nodo.op, ast.Add):
+            return self.texto_literal(nodo.left) + self.texto_literal(nodo.right)
+        return " X "
+
+    def comprobar_nombre(self, nombre: Optional[str]) -> None:
+        if not nombre:
+            return
+        partes = nombre.split(".")
+        if partes[0] in MODULOS_RED:
+            self.infringir(MENSAJE_RED)
+        elif nombre in FUNCIONES_BORRADO:
+            self.infringir(MENSAJE_BORRADO)
+        elif partes[-1] == "__dict__" and partes[0] in MODULOS_ACCESO_LITERAL:
+            self.infringir(MENSAJE_ACCESO_DINAMICO)
+
+    def visit_Import(self, nodo: ast.Import) -> None:
+        for alias in nodo.names:
+            self.comprobar_nombre(alias.name)
+            if alias.asname:
+                self.alias[alias.asname] = alias.name
+        self.generic_visit(nodo)
+
+    def visit_ImportFrom(self, nodo: ast.ImportFrom) -> None:
+        for alias in nodo.names:
+            if alias.name == "*" and nodo.module in MODULOS_ACCESO_LITERAL:
+                self.infringir(MENSAJE_ACCESO_DINAMICO)
+            nombre = f"{nodo.module}.{alias.name}" if nodo.module else alias.name
+            self.comprobar_nombre(nombre)
+            self.alias[alias.asname or alias.name] = nombre
+        self.generic_visit(nodo)
+
+    def visit_Assign(self, nodo: ast.Assign) -> None:
+        # m = __import__("os") o borrar = os.remove: el nombre pasa a ser un alias
+        nombre = self.nombre_completo(nodo.value)
+        if nombre:
+            for destino in nodo.targets:
+                if isinstance(destino, ast.Name):
+                    self.alias[destino.id] = nombre
+        self.generic_visit(nodo)
+
+    def visit_Name(self, nodo: ast.Name) -> None:
+        if nodo.id == "__builtins__":
+            self.infringir(MENSAJE_BUILTINS)
+
+    def visit_Attribute(self, nodo: ast.Attribute) -> None:
+        if nodo.attr == "__builtins__":
+            self.infringir(MENSAJE_BUILTINS)
+        self.comprobar_nombre(self.nombre_completo(nodo))
+        self.generic_visit(nodo)
+
+    def visit_Call(self, nodo: ast.Call) -> None:
+        funcion = self.nombre_completo(nodo.func)
+        cadenas = [arg.value if isinstance(arg, ast.Constant) and isinstance(arg.value, str) else None
+                   for arg in nodo.args[:2]]
+        if funcion == "input":
+            self.infringir("El código contiene llamadas a la función 'input', que no está permitida.")
+        elif funcion in ("__import__", "importlib.import_module") and cadenas and cadenas[0]:
+            self.comprobar_nombre(cadenas[0])
+        elif funcion == "getattr" and len(cadenas) > 1 and cadenas[1] == "__builtins__":
+            self.infringir(MENSAJE_BUILTINS)
+        elif funcion == "getattr" and len(cadenas) > 1 and cadenas[1]:
+            base = self.nombre_completo(nodo.args[0])
+            if base:
+                self.comprobar_nombre(f"{base}.{cadenas[1]}")
+        elif funcion in ("getattr", "vars") and nodo.args and len(nodo.args) > (funcion == "getattr"):
+            base = self.nombre_completo(nodo.args[0])
+            if base and base.split(".")[0] in MODULOS_ACCESO_LITERAL:
+                self.infringir(MENSAJE_ACCESO_DINAMICO)
+        if funcion in FUNCIONES_SHELL or (funcion or "").startswith("subprocess."):
+            comandos = nodo.args[:1] + [clave.value for clave in nodo.keywords if clave.arg == "args"]
+            if any(orden_borra_archivos(self.texto_literal(comando)) for comando in comandos
+                   if not isinstance(comando, (ast.List, ast.Tuple))):
+                self.infringir(MENSAJE_BORRADO)
+        if isinstance(nodo.func, ast.Attribute) and nodo.func.attr in METODOS_BORRADO:
+            self.infringir(MENSAJE_BORRADO)
+        argumentos = list(nodo.args) + [clave.value for clave in nodo.keywords if clave.arg == "args"]
+        if any(self.es_argv_borrado(arg) for arg in argumentos):
+            self.infringir(MENSAJE_BORRADO)
+        self.generic_visit(nodo)
+
+    @staticmethod
+    def es_argv_borrado(nodo: ast.AST) -> bool:
+        """Indica si un nodo es una lista o tupla literal cuyo primer elemento es un programa de COMANDOS_BORRADO."""
+        if not isinstance(nodo, (ast.List, ast.Tuple)) or not nodo.elts:
+            return False
+        programa = nodo.elts[0]
+        return (isinstance(programa, ast.Constant) and isinstance(programa.value, str)
+                and os.path.basename(programa.value.strip()).lower() in COMANDOS_BORRADO)
+
+    def visit_Constant(self, nodo: ast.Constant) -> None:
+        if isinstance(nodo.value, str) and es_comando_borrado(nodo.value):
+            self.infringir("El código contiene comandos de eliminación de archivos, que no están permitidos por seguridad.")
+
+
+class CacheCodigo:
+    """
+    Caché LRU de código validado y compilado, indexada por el hash del texto.
+    Cada texto se analiza (ast.parse), valida y compila una sola vez; las siguientes
+    veces se reutiliza el resultado.
+    """
+
+    def __init__(self, max_elementos: int = 256):
+        self.max_elementos = max_elementos
+        self.elementos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, codigo: str) -> Tuple[bool, str, Optional[CodeType]]:
+        """
+        Valida y compila el código, o devuelve el resultado guardado.
+
+        Args:
+            codigo: Texto del código.
+
+        Returns:
+            Tupla (válido, mensaje de error, código compilado o None si no es válido).
+        """
+        clave = hashlib.blake2b(codigo.encode("utf-8"), digest_size=16).digest()
+        elemento = self.elementos.get(clave)
+        if elemento is not None:
+            self.elementos.move_to_end(clave)
+            self.aciertos += 1
+            return elemento
+        self.fallos += 1
+
+        try:
+            arbol = ast.parse(codigo, "<codigo generado>")
+        except SyntaxError as e:
+            elemento = (False, f"Error de sintaxis en la línea {e.lineno}: {e.msg}", None)
+        else:
+            politica = PoliticaCodigo()
+            politica.visit(arbol)
+            if politica.error:
+                elemento = (False, politica.error, None)
+            else:
+                elemento = (True, "", compile(arbol, "<codigo generado>", "exec"))
+
+        self.elementos[clave] = elemento
+        if len(self.elementos) > self.max_elementos:
+            self.elementos.popitem(last=False)
+        return elemento
+
+
+# Caché compartida por todos los chatbots del proceso (sesiones, modo batch...)
+CACHE_CODIGO = CacheCodigo(MAX_CACHE_CODIGO)
+
+
+# Resultado de execute_code cuando el código no define __result
+SIN_RESULTADO = "Código ejecutado sin errores, pero no se encontró un resultado explícito."
+
+# Tipos de las variables que se devuelven como salidas con nombre de una ejecución
+TIPOS_SALIDA = (str, int, float, bool, list, tuple, dict, type(None))
+
+
+class ResultadoEjecucion:
+    """
+    Resultado estructurado de execute_code: el valor de __result, el resumen de la salida
+    capturada (con la ruta del volcado completo si era demasiado larga), las variables
+    finales del código (salidas con nombre, p. ej. archivos_encontrados), para consultarlas
+    sin volver a ejecutar nada, y los recursos consumidos (MedidorRecursos).
+    """
+
+    def __init__(self, valor: Any = SIN_RESULTADO, salida: str = "",
+                 salidas: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+                 archivo_salida: Optional[str] = None, caracteres_salida: int = 0,
+                 recursos: Optional[Dict[str, Any]] = None):
+        self.valor = valor
+        self.salida = salida
+        self.salidas = salidas or {}
+        self.error = error
+        self.archivo_salida = archivo_salida
+        self.caracteres_salida = caracteres_salida
+        self.recursos = recursos
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def texto_resultado(self, max_caracteres: int = 2000) -> str:
+        """
+        Texto acotado con el resultado y la salida, para la memoria.
+
+        Args:
+            max_caracteres: Longitud máxima de cada parte.
+
+        Returns:
+            El resumen del resultado.
+        """
+        partes = []
+        if self.valor != SIN_RESULTADO:
+            partes.append(resumir_valor(self.valor, max_caracteres))
+        if self.salida.strip():
+            partes.append(recortar_texto(self.salida.strip(), max_caracteres))
+        return "\n".join(partes) or SIN_RESULTADO
+
+
+def recortar_texto(texto: str, max_caracteres: int) -> str:
+    """
+    Recorta un texto largo conservando el principio y el final.
+
+    Args:
+        texto: Texto a recortar.
+        max_caracteres: Longitud máxima.
+
+    Returns:
+        El texto, recortado si hace falta.
+    """
+    if len(texto) <= max_caracteres:
+        return texto
+    mitad = max_caracteres // 2
+    return f"{texto[:mitad]}\n... [{len(texto) - 2 * mitad} caracteres omitidos] ...\n{texto[-mitad:]}"
+
+
+def resumir_valor(valor: Any, max_caracteres: int = 2000, max_elementos: int = 20) -> str:
+    """
+    Representación acotada de un resultado: las listas largas se abrevian
+    ("... y N más") y los textos largos se recortan.
+
+    Args:
+        valor: Resultado a resumir.
+        max_caracteres: Longitud máxima del texto.
+        max_elementos: Elementos máximos que se muestran de una lista o tupla.
+
+    Returns:
+        El texto resumido.
+    """
+    if isinstance(valor, (list, tuple)) and len(valor) > max_elementos:
+        texto = "\n".join(str(elemento) for elemento in valor[:max_elementos])
+        texto += f"\n... y {len(valor) - max_elementos} más ({len(valor)} en total)"
+    else:
+        texto = str(valor)
+    return recortar_texto(texto, max_caracteres)
+
+
+def extraer_salidas(variables: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Selecciona las variables del espacio de nombres local que se devuelven como salidas:
+    las públicas con tipos de datos simples (no módulos, funciones ni clases). La lista
+    inicial de archivos_encontrados solo se devuelve si el código la llenó o la sustituyó.
+
+    Args:
+        variables: Espacio de nombres local tras la ejecución.
+
+    Returns:
+        Diccionario nombre -> valor.
+    """
+    salidas = {nombre: valor for nombre, valor in variables.items()
+               if not nombre.startswith("_") and isinstance(valor, TIPOS_SALIDA)}
+    encontrados = salidas.get("archivos_encontrados")
+    if encontrados == [] and encontrados is variables.get("__archivos_semilla__"):
+        del salidas["archivos_encontrados"]
+    return salidas
+
+
+# Tamaño de cada lectura de las tuberías de un comando
+TAMANO_BLOQUE_COMANDO = 64 * 1024
+
+# Grupos de procesos de los comandos en curso en este proceso (para matarlos al salir)
+GRUPOS_COMANDOS = set()
+
+# Cupos del límite de comandos simultáneos que tiene reservados este proceso; si el sandbox
+# lo mata con comandos en curso, los devuelve antes de salir para no dejarlos bloqueados
+CUPOS_RESERVADOS = []
+
+# Cada cuánto se vuelve a intentar reservar un cupo cuando están todos ocupados (segundos)
+INTERVALO_CUPOS = 0.02
+
+
+class ResultadoComando:
+    """Resultado de un comando del sistema: código de salida y salida capturada (acotada)."""
+
+    def __init__(self, comando: str, codigo: Optional[int], stdout: str, stderr: str,
+                 tiempo_agotado: bool = False, bytes_descartados: int = 0, duracion: float = 0.0):
+        self.comando = comando
+        self.codigo = codigo
+        self.stdout = stdout
+        self.stderr = stderr
+        self.tiempo_agotado = tiempo_agotado
+        self.bytes_descartados = bytes_descartados
+        self.duracion = duracion
+
+    @property
+    def ok(self) -> bool:
+        return self.codigo == 0 and not self.tiempo_agotado
+
+    def texto(self) -> str:
+        """
+        Texto del resultado, con el mismo formato que devolvía ejecutar_comando.
+
+        Returns:
+            La salida estándar si el comando terminó bien, o "Error: ..." si no.
+        """
+        if self.tiempo_agotado:
+            texto = f"Error: el comando superó el tiempo máximo ({self.duracion:.0f} s) y se detuvo"
+        elif self.codigo != 0:
+            texto = f"Error: {self.stderr.strip() or f'código de salida {self.codigo}'}"
+        else:
+            texto = self.stdout.strip()
+        if self.bytes_descartados:
+            texto += f"\n... (salida truncada, {self.bytes_descartados} bytes descartados)"
+        return texto
+
+
+def terminar_grupo(pid: int, forzar: bool = False) -> None:
+    """
+    Termina un comando junto con todos los procesos que haya lanzado.
+
+    Args:
+        pid: PID del proceso, que es también el identificador de su grupo.
+        forzar: Si es True se mata (SIGKILL); si no, se le pide que termine (SIGTERM).
+    """
+    try:
+        if SISTEMA_OPERATIVO == "Windows":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], capture_output=True)
+        else:
+            os.killpg(pid, signal.SIGKILL if forzar else signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def terminar_grupos_activos() -> None:
+    """Mata los comandos que sigan en curso en este proceso y devuelve sus cupos."""
+    for pid in list(GRUPOS_COMANDOS):
+        terminar_grupo(pid, forzar=True)
+    GRUPOS_COMANDOS.clear()
+    while CUPOS_RESERVADOS:
+        CUPOS_RESERVADOS.pop().release()
+
+
+class LanzadorArchivos:
+    """
+    Abre archivos con la aplicación predeterminada sin esperar a que se cierren. El lanzador
+    (xdg-open, open) se arranca en su propia sesión, desligado de JARVIS, y un hilo lo recoge
+    cuando termina (para que no queden procesos zombi) e informa de los que fallan con la
+    función al_error de cada llamada (así cada chatbot recibe sus propios avisos);
+    os.startfile, en Windows, ya vuelve al momento.
+    """
+
+    def __init__(self, al_error: Optional[Callable[[str, str], None]] = None, intervalo: float = 0.2):
+        """
+        Inicializa el lanzador.
+
+        Args:
+            al_error: Función que recibe (ruta, mensaje) cuando un lanzador termina con error y la
+                llamada no indicó otra; los errores siempre se registran además en el log.
+            intervalo: Cada cuántos segundos se comprueba si han terminado los lanzadores.
+        """
+        self.al_error = al_error
+        self.intervalo = intervalo
+        self.pendientes = []
+        self.bloqueo = threading.Lock()
+        self.hilo = None
+
+    @staticmethod
+    def comando(ruta: str) -> List[str]:
+        """Comando que abre un archivo con la aplicación predeterminada en este sistema."""
+        return ["open", ruta] if SISTEMA_OPERATIVO == "Darwin" else ["xdg-open", ruta]
+
+    def abrir(self, ruta: str, al_error: Optional[Callable[[str, str], None]] = None) -> None:
+        """
+        Lanza la apertura de un archivo y vuelve sin esperar.
+
+        Args:
+            ruta: Archivo a abrir.
+            al_error: Función que recibe (ruta, mensaje) si el lanzador termina con error.
+
+        Raises:
+            FileNotFoundError: Si el archivo no existe.
+            OSError: Si no se pudo lanzar la aplicación.
+        """
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(f"No existe '{ruta}'")
+        if SISTEMA_OPERATIVO == "Windows":
+            os.startfile(ruta)
+            return
+        errores = tempfile.TemporaryFile()
+        try:
+            proceso = subprocess.Popen(self.comando(ruta), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=errores, start_new_session=True, close_fds=True)
+        except OSError:
+            errores.close()
+            raise
+        with self.bloqueo:
+            self.pendientes.append((ruta, proceso, errores, al_error or self.al_error))
+            if self.hilo is None:
+                self.hilo = threading.Thread(target=self.recoger, name="jarvis-lanzador", daemon=True)
+                self.hilo.start()
+
+    def abrir_varios(self, rutas: List[str],
+                     al_error: Optional[Callable[[str, str], None]] = None) -> List[Tuple[str, Optional[str]]]:
+        """
+        Lanza la apertura de varios archivos a la vez.
+
+        Args:
+            rutas: Archivos a abrir.
+            al_error: Función que recibe (ruta, mensaje) si algún lanzador termina con error.
+
+        Returns:
+            Lista de (ruta, error al lanzarla o None).
+        """
+        resultados = []
+        for ruta in rutas:
+            try:
+                self.abrir(ruta, al_error)
+                resultados.append((ruta, None))
+            except OSError as e:
+                resultados.append((ruta, str(e)))
+        return resultados
+
+    def recoger(self) -> None:
+        """Recoge los lanzadores que terminan e informa de los que fallaron; acaba cuando no queda ninguno."""
+        while True:
+            time.sleep(self.intervalo)
+            with self.bloqueo:
+                terminados = [pendiente for pendiente in self.pendientes if pendiente[1].poll() is not None]
+                self.pendientes = [pendiente for pendiente in self.pendientes if pendiente[1].returncode is None]
+                seguir = bool(self.pendientes)
+                if not seguir:
+                    self.hilo = None
+            for ruta, proceso, errores, al_error in terminados:
+                if proceso.returncode != 0:
+                    errores.seek(0)
+                    detalle = errores.read(2000).decode("utf-8", errors="replace").strip()
+                    self.avisar(ruta, detalle or f"código de salida {proceso.returncode}", al_error)
+                errores.close()
+            if not seguir:
+                return
+
+    def avisar(self, ruta: str, mensaje: str, al_error: Optional[Callable[[str, str], None]] = None) -> None:
+        logger.error(f"No se pudo abrir '{ruta}': {mensaje}")
+        if al_error is not None:
+            try:
+                al_error(ruta, mensaje)
+            except Exception as e:
+                logger.error(f"Error al avisar de un fallo al abrir '{ruta}': {e}")
+
+
+# Lanzador (y hilo que recoge los procesos) que comparten en este proceso abrir_archivo y el
+# manejador de abrir_archivo; cada llamada indica a quién avisar de los errores
+LANZADOR_ARCHIVOS = LanzadorArchivos()
+
+
+class EjecutorComandos:
+    """
+    Ejecuta comandos del sistema con asyncio: la salida (stdout y stderr) se entrega línea
+    a línea mientras se produce, cada comando tiene un tiempo máximo tras el que se mata
+    su grupo de procesos entero, lo capturado se limita a max_bytes_salida por flujo y
+    max_concurrentes limita cuántos comandos se ejecutan a la vez. El límite es un semáforo
+    de multiprocessing, así que se puede compartir con los procesos del sandbox y con los
+    hilos que ejecutan comandos desde el código generado.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, cupos: Any = None):
+        """
+        Inicializa el ejecutor.
+
+        Args:
+            config: Sección "comandos" de la configuración.
+            cupos: Semáforo compartido con otros ejecutores; por defecto se crea uno propio.
+        """
+        config = config or {}
+        self.timeout = float(config.get("timeout", 120))
+        self.max_bytes = int(config.get("max_bytes_salida", 1024 * 1024))
+        self.gracia = float(config.get("gracia_segundos", 2))
+        self.cupos = cupos or multiprocessing.get_context("spawn").BoundedSemaphore(
+            max(1, int(config.get("max_concurrentes", 2))))
+
+    async def ejecutar(self, comando: str,
+                       al_linea: Optional[Callable[[str, str], Any]] = None,
+                       timeout: Optional[float] = None,
+                       espera_cupo: Optional[float] = None) -> ResultadoComando:
+        """
+        Ejecuta un comando en la shell del sistema cuando hay un cupo libre.
+
+        Args:
+            comando: Comando a ejecutar.
+            al_linea: Función (normal o asíncrona) que recibe el flujo ("stdout" o "stderr")
+                y cada línea de salida según llega.
+            timeout: Tiempo máximo en segundos; por defecto el de la configuración.
+            espera_cupo: Segundos máximos de espera por un cupo (por defecto sin límite);
+                pasado ese tiempo el comando no se ejecuta y se devuelve un error.
+
+        Returns:
+            El resultado del comando.
+        """
+        if not await self.reservar(espera_cupo):
+            logger.warning(f"Sin cupo libre tras {espera_cupo:g} s; no se ejecuta: {comando}")
+            return ResultadoComando(comando, None, "",
+                                    f"sin cupo libre tras {espera_cupo:g} s (max_concurrentes alcanzado)",
+                                    duracion=espera_cupo)
+        try:
+            return await self.lanzar(comando, al_linea, timeout)
+        finally:
+            CUPOS_RESERVADOS.remove(self.cupos)
+            self.cupos.release()
+
+    async def reservar(self, espera_maxima: Optional[float] = None) -> bool:
+        """
+        Espera a que haya un cupo libre sin bloquear el bucle de eventos (el semáforo es
+        de multiprocessing, así que se consulta periódicamente en lugar de esperarlo).
+
+        Args:
+            espera_maxima: Segundos máximos de espera; None para esperar lo que haga falta.
+
+        Returns:
+            True si se reservó el cupo.
+        """
+        limite = None if espera_maxima is None else time.monotonic() + espera_maxima
+        while not self.cupos.acquire(False):
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            await asyncio.sleep(INTERVALO_CUPOS)
+        CUPOS_RESERVADOS.append(self.cupos)
+        return True
+
+    async def lanzar(self, comando: str, al_linea: Optional[Callable[[str, str], Any]],
+                     timeout: Optional[float]) -> ResultadoComando:
+        """Lanza el comando en su propio grupo de procesos y espera a que termine o se agote el tiempo."""
+        timeout = self.timeout if timeout is None else timeout
+        if SISTEMA_OPERATIVO == "Windows":
+            opciones = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            opciones = {"start_new_session": True}
+        inicio = time.monotonic()
+        proceso = await asyncio.create_subprocess_shell(
+            comando,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.getcwd(),
+            env=os.environ,
+            **opciones,
+        )
+        GRUPOS_COMANDOS.add(proceso.pid)
+        capturado = {"stdout": bytearray(), "stderr": bytearray()}
+        descartados = {"stdout": 0, "stderr": 0}
+        tiempo_agotado = False
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                self.leer(proceso.stdout, "stdout", capturado, descartados, al_linea),
+                self.leer(proceso.stderr, "stderr", capturado, descartados, al_linea),
+                proceso.wait(),
+            ), timeout)
+        except asyncio.TimeoutError:
+            tiempo_agotado = True
+            logger.warning(f"El comando superó el tiempo máximo ({timeout:g} s): {comando}")
+            await self.detener(proceso)
+        except asyncio.CancelledError:
+            await self.detener(proceso)
+            raise
+        finally:
+            GRUPOS_COMANDOS.discard(proceso.pid)
+
+        return ResultadoComando(
+            comando, proceso.returncode,
+            capturado["stdout"].decode("utf-8", errors="replace"),
+            capturado["stderr"].decode("utf-8", errors="replace"),
+            tiempo_agotado, sum(descartados.values()), time.monotonic() - inicio,
+        )
+
+    async def leer(self, flujo: asyncio.StreamReader, nombre: str, capturado: Dict[str, bytearray],
+                   descartados: Dict[str, int], al_linea: Optional[Callable[[str, str], Any]]) -> None:
+        """
+        Lee un flujo del comando hasta el final. Lo que pasa de max_bytes se descarta (pero se
+        sigue leyendo, para que el comando no se bloquee con la tubería llena).
+        """
+        destino = capturado[nombre]
+        pendiente = b""
+        while True:
+            bloque = await flujo.read(TAMANO_BLOQUE_COMANDO)
+            if not bloque:
+                break
+            visible = bloque[:max(0, self.max_bytes - len(destino))]
+            destino += visible
+            descartados[nombre] += len(bloque) - len(visible)
+            if al_linea is None or not visible:
+                continue
+            *lineas, pendiente = (pendiente + visible).split(b"\n")
+            if len(pendiente) >= TAMANO_BLOQUE_COMANDO:
+                lineas.append(pendiente)
+                pendiente = b""
+            for linea in lineas:
+                await self.avisar(al_linea, nombre, linea)
+        if pendiente and al_linea is not None:
+            await self.avisar(al_linea, nombre, pendiente)
+
+    @staticmethod
+    async def avisar(al_linea: Callable[[str, str], Any], nombre: str, linea: bytes) -> None:
+        respuesta = al_linea(nombre, linea.decode("utf-8", errors="replace").rstrip("\r"))
+        if asyncio.iscoroutine(respuesta):
+            await respuesta
+
+    async def detener(self, proceso: "asyncio.subprocess.Process") -> None:
+        """Pide al grupo del comando que termine y lo mata si no lo hace en el periodo de gracia."""
+        terminar_grupo(proceso.pid)
+        try:
+            await asyncio.wait_for(proceso.wait(), self.gracia)
+        except asyncio.TimeoutError:
+            terminar_grupo(proceso.pid, forzar=True)
+            await proceso.wait()
+
+    def ejecutar_texto(self, comando: str) -> str:
+        """
+        Versión síncrona para el código generado: muestra la salida en vivo por la salida
+        estándar (capturada y acotada por CapturaSalida) y devuelve el resultado como texto.
+
+        Args:
+            comando: Comando a ejecutar.
+
+        Returns:
+            La salida del comando, o un mensaje "Error: ..." si falla.
+        """
+        def mostrar(flujo: str, linea: str) -> None:
+            print(linea, file=sys.stderr if flujo == "stderr" else sys.stdout)
+
+        try:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(self.ejecutar(comando, mostrar)).texto()
+            # Llamada desde el bucle de eventos (ejecución sin sandbox): se usa otro hilo. El
+            # bucle queda bloqueado mientras tanto y no puede devolver los cupos de sus propios
+            # comandos, así que la espera por un cupo se limita al tiempo máximo de un comando
+            # y, si no se libera ninguno, el comando falla en vez de saltarse el límite
+            resultado = []
+            hilo = threading.Thread(
+                target=lambda: resultado.append(asyncio.run(self.ejecutar(comando, mostrar,
+                                                                          espera_cupo=self.timeout))))
+            hilo.start()
+            hilo.join()
+            if not resultado:
+                return "Error inesperado: el comando no devolvió ningún resultado"
+            return resultado[0].texto()
+        except Exception as e:
+            logger.error(f"Error inesperado al ejecutar el comando: {e}")
+            return f"Error inesperado: {str(e)}"
+
+
+# Secciones de la configuración que usan las funciones auxiliares del entorno de ejecución
+SECCIONES_ENTORNO = ("comandos", "busqueda", "busqueda_contenido")
+
+
+def crear_entorno_seguro(config: Optional[Dict[str, Any]] = None, cupos_comandos: Any = None) -> Dict[str, Any]:
+    """
+    Crea la capa base del espacio de nombres con el que se ejecuta el código generado:
+    los builtins permitidos, los módulos y las funciones auxiliares en un solo diccionario.
+    Se crea una vez (por chatbot y por proceso del sandbox) y se comparte entre ejecuciones,
+    que no la modifican: cada una escribe en su propia capa (crear_espacio_ejecucion) y
+    PoliticaCodigo rechaza el acceso a __builtins__. Tiene que ser un dict y no una vista
+    de solo lectura porque exec resuelve __import__ en ella con la API de diccionarios.
+    Solo contiene funciones sin estado, para poder recrearla en los procesos del sandbox.
+
+    Args:
+        config: Configuración (se usan las secciones de SECCIONES_ENTORNO).
+        cupos_comandos: Semáforo que limita los comandos simultáneos (el del ejecutor del chatbot).
+
+    Returns:
+        Diccionario nombre -> objeto.
+    """
+    config = config or {}
+    return {
+        "print": print,
+        "len": len,
+        "range": range,
+        "enumerate": enumerate,
+        "zip": zip,
+        "map": map,
+        "filter": filter,
+        "sorted": sorted,
+        "sum": sum,
+        "min": min,
+        "max": max,
+        "abs": abs,
+        "round": round,
+        "any": any,
+        "all": all,
+        "dir": dir,
+        "getattr": getattr,
+        "hasattr": hasattr,
+        "isinstance": isinstance,
+        "issubclass": issubclass,
+        "type": type,
+        "id": id,
+        "help": help,
+        "str": str,
+        "int": int,
+        "float": float,
+        "bool": bool,
+        "list": list,
+        "dict": dict,
+        "set": set,
+        "tuple": tuple,
+        "open": open,
+        "__import__": __import__,
+        "os": os,
+        "subprocess": subprocess,
+        "glob": __import__("glob"),
+        "re": re,
+        "time": time,
+        "shutil": __import__("shutil"),
+        "psutil": psutil,
+        "platform": platform,
+        "Path": Path,
+        "abrir_archivo": Chatbot.abrir_archivo,
+        "obtener_archivo": Chatbot.obtener_archivo,
+        "obtener_escritorio": Chatbot.obtener_escritorio,
+        "obtener_documentos": Chatbot.obtener_documentos,
+        "obtener_descargas": Chatbot.obtener_descargas,
+        "ejecutar_comando": EjecutorComandos(config.get("comandos"), cupos_comandos).ejecutar_texto,
+        "buscar_rutas": MotorBusqueda(config.get("busqueda")).buscar,
+        "buscar_contenido": BuscadorContenido(config.get("busqueda_contenido"),
+                                              MotorBusqueda(config.get("busqueda"))).buscar,
+        "leer_archivo": Chatbot.leer_archivo,
+    }
+
+
+def crear_espacio_ejecucion(base: Dict[str, Any], variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Crea el espacio de nombres de una ejecución: un diccionario casi vacío cuyos builtins
+    son la capa base. Las búsquedas que no están en la capa propia caen en la base, y todo
+    lo que el código asigna (incluso si sombrea un módulo) queda en la capa propia, que se
+    descarta al terminar; así nada pasa de un comando al siguiente. El coste no depende
+    del tamaño de la base.
+
+    Args:
+        base: Capa base creada con crear_entorno_seguro.
+        variables: Variables iniciales (p. ej. los parámetros de una plantilla).
+
+    Returns:
+        Diccionario que se usa como globales y locales de exec.
+    """
+    # Lista en la que el código puede ir añadiendo los archivos que encuentra; se guarda
+    # también aparte para que extraer_salidas sepa si el código llegó a usarla
+    semilla = []
+    espacio = {"__builtins__": base, "__name__": "__jarvis__", "archivos_encontrados": semilla,
+               "__archivos_semilla__": semilla}
+    if variables:
+        espacio.update(variables)
+    return espacio
+
+
+class CapturaSalida(io.TextIOBase):
+    """
+    Captura acotada de la salida del código ejecutado.
+    Lo escrito se reenvía en bloques a medida que se produce (a la consola o por la tubería
+    del sandbox) hasta max_consola caracteres: en cuanto el bloque llega a 4 KB o, si no,
+    a los INTERVALO_ENVIO segundos, de lo que se encarga un hilo aunque el código no vuelva
+    a escribir. En memoria solo se guarda un resumen con el principio y el final; si la
+    salida supera max_resumen, el texto completo se vuelca a un archivo temporal, del que
+    se conservan los MAX_VOLCADOS más recientes.
+    """
+
+    INTERVALO_ENVIO = 0.05
+    MAX_VOLCADOS = 20
+
+    def __init__(self, al_escribir: Optional[Callable[[str], None]] = None, max_consola: int = 20000,
+                 max_resumen: int = 4000, directorio: Optional[str] = None):
+        """
+        Inicializa la captura.
+
+        Args:
+            al_escribir: Función que recibe cada bloque de salida para mostrarlo.
+            max_consola: Caracteres máximos que se reenvían a al_escribir.
+            max_resumen: Caracteres máximos que se guardan en memoria (mitad principio, mitad final).
+            directorio: Directorio de los archivos de volcado; por defecto uno en el temporal del sistema.
+        """
+        self.al_escribir = al_escribir
+        self.max_consola = max_consola
+        self.max_resumen = max_resumen
+        self.directorio = directorio or os.path.join(tempfile.gettempdir(), "jarvis_salidas")
+        self.total = 0
+        self.pendiente = []
+        self.cabeza = ""
+        self.cola = deque()
+        self.longitud_cola = 0
+        self.archivo = None
+        self.ruta_volcado = None
+        self.bloque = []
+        self.longitud_bloque = 0
+        # El hilo de envío y el código ejecutado comparten el bloque pendiente
+        self.bloqueo = threading.Lock()
+        self.terminada = threading.Event()
+        self.hilo = None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, texto: str) -> int:
+        if not texto:
+            return 0
+        # Reenvío en bloques (no una vez por print) mientras no se supere el límite de consola
+        if self.total < self.max_consola and self.al_escribir is not None:
+            visible = texto[:self.max_consola - self.total]
+            with self.bloqueo:
+                self.bloque.append(visible)
+                self.longitud_bloque += len(visible)
+                if self.total + len(texto) >= self.max_consola:
+                    self.bloque.append(f"\n... (salida truncada a {self.max_consola} caracteres)\n")
+                    self.enviar()
+                elif self.longitud_bloque >= 4096:
+                    self.enviar()
+                elif self.hilo is None:
+                    self.hilo = threading.Thread(target=self.enviar_periodicamente, name="jarvis-salida",
+                                                 daemon=True)
+                    self.hilo.start()
+        self.total += len(texto)
+
+        if self.archivo is None:
+            self.pendiente.append(texto)
+            if self.total > self.max_resumen:
+                self.volcar()
+        else:
+            self.archivo.write(texto)
+            self.cola.append(texto)
+            self.longitud_cola += len(texto)
+            while self.cola and self.longitud_cola - len(self.cola[0]) >= self.max_resumen // 2:
+                self.longitud_cola -= len(self.cola.popleft())
+        return len(texto)
+
+    def volcar(self) -> None:
+        """Pasa a modo volcado: el texto completo va al archivo y en memoria solo quedan los extremos."""
+        texto = "".join(self.pendiente)
+        self.pendiente = []
+        os.makedirs(self.directorio, exist_ok=True)
+        self.limpiar_volcados(self.directorio, self.MAX_VOLCADOS - 1)
+        descriptor, self.ruta_volcado = tempfile.mkstemp(prefix="salida_", suffix=".log", dir=self.directorio)
+        self.archivo = os.fdopen(descriptor, "w", encoding="utf-8", errors="replace")
+        self.archivo.write(texto)
+        self.cabeza = texto[:self.max_resumen // 2]
+        self.cola.append(texto[-(self.max_resumen // 2):])
+        self.longitud_cola = len(self.cola[0])
+
+    @staticmethod
+    def limpiar_volcados(directorio: str, conservar: int) -> None:
+        """
+        Borra los volcados más antiguos del directorio.
+
+        Args:
+            directorio: Directorio de los volcados.
+            conservar: Número de volcados (los más recientes) que se conservan.
+        """
+        try:
+            with os.scandir(directorio) as entradas:
+                volcados = sorted((entrada.stat().st_mtime, entrada.path) for entrada in entradas
+                                  if entrada.name.startswith("salida_") and entrada.name.endswith(".log"))
+        except OSError:
+            return
+        for _, ruta in volcados[:max(0, len(volcados) - conservar)]:
+            try:
+                os.remove(ruta)
+            except OSError:
+                # Otro proceso del sandbox puede haberlo borrado ya
+                pass
+
+    def enviar(self) -> None:
+        """Reenvía el bloque pendiente; se llama con el bloqueo adquirido."""
+        if self.bloque and self.al_escribir is not None and not self.terminada.is_set():
+            self.al_escribir("".join(self.bloque))
+        self.bloque = []
+        self.longitud_bloque = 0
+
+    def enviar_periodicamente(self) -> None:
+        """Reenvía lo pendiente cada INTERVALO_ENVIO segundos, aunque el código no vuelva a escribir."""
+        while not self.terminada.wait(self.INTERVALO_ENVIO):
+            with self.bloqueo:
+                self.enviar()
+
+    def flush(self) -> None:
+        with self.bloqueo:
+            self.enviar()
+
+    def resumen(self) -> str:
+        """
+        Devuelve la salida si cabe en max_resumen o, si no, su principio y su final.
+
+        Returns:
+            El texto capturado (o su resumen).
+        """
+        if self.archivo is None:
+            return "".join(self.pendiente)
+        cola = "".join(self.cola)[-(self.max_resumen // 2):]
+        omitidos = self.total - len(self.cabeza) - len(cola)
+        return (f"{self.cabeza}\n... [{omitidos} caracteres omitidos; salida completa en "
+                f"{self.ruta_volcado}] ...\n{cola}")
+
+    def close(self) -> None:
+        # Después de cerrar no se envía nada más (en el sandbox, el resultado va detrás por la misma tubería)
+        with self.bloqueo:
+            self.enviar()
+            self.terminada.set()
+        if self.archivo is not None:
+            self.archivo.close()
+        super().close()
+
+
+class ErrorSandbox(Exception):
+    """Error al ejecutar código en el sandbox (del propio código, de un límite o del proceso)."""
+
+    def __init__(self, mensaje: str, traza: str = "", salida: str = "", archivo_salida: Optional[str] = None,
+                 recursos: Optional[Dict[str, Any]] = None):
+        super().__init__(mensaje)
+        self.traza = traza
+        self.salida = salida
+        self.archivo_salida = archivo_salida
+        self.recursos = recursos
+
+
+class LimiteCPUExcedido(Exception):
+    """Se lanza en el proceso de ejecución al agotar el tiempo de CPU asignado."""
+
+
+def _al_exceder_cpu(signum, frame):
+    raise LimiteCPUExcedido("Se superó el límite de tiempo de CPU")
+
+
+def _al_terminar_trabajador(signum, frame):
+    # El sandbox termina el proceso (tiempo agotado o cancelación): sus comandos también
+    terminar_grupos_activos()
+    os._exit(128 + signum)
+
+
+def trabajador_sandbox(conexion, memoria_mb: int, config_entorno: Optional[Dict[str, Any]] = None,
+                       cupos_comandos: Any = None) -> None:
+    """
+    Bucle de un proceso del sandbox: recibe código compilado (serializado con marshal),
+    lo ejecuta y devuelve el resultado por la tubería. La salida (stdout y stderr) se
+    captura con CapturaSalida y se envía en bloques mientras se produce.
+    El límite de memoria se aplica una vez al arrancar y el de CPU antes de cada tarea.
+
+    Args:
+        conexion: Extremo de la tubería del proceso.
+        memoria_mb: Límite de espacio de direcciones (RLIMIT_AS) en MB; 0 para no limitar.
+        config_entorno: Secciones de la configuración para las funciones auxiliares (SECCIONES_ENTORNO).
+        cupos_comandos: Semáforo compartido que limita los comandos simultáneos.
+    """
+    if RESOURCE_DISPONIBLE:
+        if memoria_mb:
+            resource.setrlimit(resource.RLIMIT_AS, (memoria_mb * 1024 * 1024, resource.RLIM_INFINITY))
+        signal.signal(signal.SIGXCPU, _al_exceder_cpu)
+    if SISTEMA_OPERATIVO != "Windows":
+        signal.signal(signal.SIGTERM, _al_terminar_trabajador)
+    entorno_base = crear_entorno_seguro(config_entorno, cupos_comandos)
+
+    while True:
+        try:
+            tarea = conexion.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if tarea is None:
+            break
+
+        codigo_serializado, variables, cpu_segundos, limites_salida = tarea
+        salida = CapturaSalida(lambda texto: conexion.send(("salida", texto)), **limites_salida)
+        medidor = MedidorRecursos()
+        try:
+            if RESOURCE_DISPONIBLE and cpu_segundos:
+                uso = resource.getrusage(resource.RUSAGE_SELF)
+                consumido = uso.ru_utime + uso.ru_stime
+                resource.setrlimit(resource.RLIMIT_CPU,
+                                   (int(math.ceil(consumido + cpu_segundos)), resource.RLIM_INFINITY))
+            espacio = crear_espacio_ejecucion(entorno_base, variables)
+            with medidor, redirect_stdout(salida), redirect_stderr(salida):
+                exec(marshal.loads(codigo_serializado), espacio)
+            salida.close()
+            respuesta = ("ok", espacio.get("__result", SIN_RESULTADO), extraer_salidas(espacio),
+                         salida.resumen(), salida.ruta_volcado, salida.total,
+                         dict(medidor.consumo, bytes_salida=salida.total))
+        except BaseException as e:
+            salida.close()
+            respuesta = ("error", f"{type(e).__name__}: {e}", traceback.format_exc(),
+                         salida.resumen(), salida.ruta_volcado, salida.total,
+                         dict(medidor.consumo, bytes_salida=salida.total))
+        finally:
+            if RESOURCE_DISPONIBLE and cpu_segundos:
+                resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+
+        try:
+            conexion.send(respuesta)
+        except Exception:
+            # El resultado no se puede serializar: se devuelve su representación
+            conexion.send(("ok", repr(respuesta[1]), {}) + respuesta[3:])
+
+
+class SandboxProcesos:
+    """
+    Pool de procesos precalentados que ejecutan el código generado fuera del proceso
+    principal, con límites de tiempo real, de CPU y de memoria.
+    Un proceso que supera el tiempo real o se cancela se mata y se sustituye al momento,
+    así que el pool sigue caliente y ningún comando paga el arranque de un proceso.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 config_entorno: Optional[Dict[str, Any]] = None, cupos_comandos: Any = None):
+        """
+        Inicializa el sandbox y arranca sus procesos.
+
+        Args:
+            config: Sección "sandbox" de la configuración.
+            config_entorno: Secciones de la configuración para las funciones auxiliares (SECCIONES_ENTORNO).
+            cupos_comandos: Semáforo de multiprocessing que limita los comandos simultáneos;
+                se comparte con los procesos para que el límite sea global.
+        """
+        config = config or {}
+        self.config_entorno = config_entorno
+        self.cupos_comandos = cupos_comandos
+        self.procesos = max(1, int(config.get("procesos", 2)))
+        self.timeout = float(config.get("timeout", 30))
+        self.cpu_segundos = int(config.get("cpu_segundos", 20))
+        self.memoria_mb = int(config.get("memoria_mb", 2048))
+        self.limites_salida = {
+            "max_consola": int(config.get("max_salida_consola", 20000)),
+            "max_resumen": int(config.get("max_salida_resumen", 4000)),
+        }
+        self.contexto = multiprocessing.get_context("spawn")
+        self.libres = asyncio.Queue()
+        self.trabajadores = []
+        for _ in range(self.procesos):
+            self.libres.put_nowait(self.lanzar())
+
+    def lanzar(self) -> Tuple[Any, Any]:
+        """
+        Arranca un proceso del sandbox.
+
+        Returns:
+            Tupla (proceso, extremo de la tubería del proceso principal).
+        """
+        conexion, conexion_hijo = self.contexto.Pipe()
+        proceso = self.contexto.Process(target=trabajador_sandbox,
+                                        args=(conexion_hijo, self.memoria_mb, self.config_entorno,
+                                              self.cupos_comandos),
+                                        name="jarvis-sandbox", daemon=True)
+        proceso.start()
+        conexion_hijo.close()
+        trabajador = (proceso, conexion)
+        self.trabajadores.append(trabajador)
+        return trabajador
+
+    def reemplazar(self, trabajador: Tuple[Any, Any]) -> None:
+        """
+        Mata un proceso (colgado, cancelado o caído) y deja otro en su lugar.
+
+        Args:
+            trabajador: Tupla (proceso, conexión) a sustituir.
+        """
+        proceso, conexion = trabajador
+        if proceso.is_alive():
+            # SIGTERM primero, para que el proceso mate los comandos que haya lanzado
+            proceso.terminate()
+            proceso.join(timeout=0.5)
+        if proceso.is_alive():
+            proceso.kill()
+        proceso.join(timeout=1)
+        conexion.close()
+        if trabajador in self.trabajadores:
+            self.trabajadores.remove(trabajador)
+        self.libres.put_nowait(self.lanzar())
+
+    async def ejecutar(self, codigo: CodeType, variables: Optional[Dict[str, Any]] = None,
+                       timeout: Optional[float] = None,
+                       al_salida: Optional[Callable[[str], None]] = None) -> ResultadoEjecucion:
+        """
+        Ejecuta código compilado en un proceso libre del pool.
+
+        Args:
+            codigo: Código compilado.
+            variables: Variables iniciales del espacio de nombres local.
+            timeout: Tiempo real máximo en segundos; por defecto el de la configuración.
+            al_salida: Función que recibe la salida en bloques a medida que se produce.
+
+        Returns:
+            El resultado de la ejecución (valor de __result, salida capturada y salidas con nombre).
+
+        Raises:
+            ErrorSandbox: Si el código falla, supera un límite o el proceso muere.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        trabajador = await self.libres.get()
+        proceso, conexion = trabajador
+        try:
+            conexion.send((marshal.dumps(codigo), variables, self.cpu_segundos, self.limites_salida))
+            limite = time.monotonic() + timeout
+            while True:
+                restante = limite - time.monotonic()
+                if restante <= 0 or not await asyncio.to_thread(conexion.poll, restante):
+                    self.reemplazar(trabajador)
+                    raise ErrorSandbox(f"Se superó el tiempo máximo de ejecución ({timeout:g} s)")
+                respuesta = conexion.recv()
+                if respuesta[0] != "salida":
+                    break
+                if al_salida is not None:
+                    al_salida(respuesta[1])
+        except asyncio.CancelledError:
+            self.reemplazar(trabajador)
+            raise
+        except (EOFError, OSError):
+            self.reemplazar(trabajador)
+            raise ErrorSandbox("El proceso de ejecución terminó inesperadamente "
+                               f"(código de salida {proceso.exitcode})")
+        self.libres.put_nowait(trabajador)
+
+        if respuesta[0] == "error":
+            _, mensaje, traza, salida, archivo_salida, _, recursos = respuesta
+            raise ErrorSandbox(mensaje, traza, salida, archivo_salida, recursos)
+        _, valor, salidas, salida, archivo_salida, caracteres, recursos = respuesta
+        return ResultadoEjecucion(valor, salida, salidas, archivo_salida=archivo_salida,
+                                  caracteres_salida=caracteres, recursos=recursos)
+
+    async def preparar(self) -> None:
+        """Espera a que todos los procesos hayan arrancado (útil antes de medir latencias)."""
+        vacio = compile("pass", "<preparar>", "exec")
+        await asyncio.gather(*(self.ejecutar(vacio) for _ in range(self.procesos)))
+
+    def cerrar(self) -> None:
+        """Detiene todos los procesos del sandbox."""
+        for proceso, conexion in self.trabajadores:
+            try:
+                conexion.send(None)
+            except OSError:
+                pass
+        for proceso, conexion in self.trabajadores:
+            proceso.join(timeout=1)
+            if proceso.is_alive():
+                proceso.kill()
+            conexion.close()
+        self.trabajadores = []
+
+
+# Fin de frase: signo de puntuación seguido de espacio, o uno o más saltos de línea
+PATRON_FIN_FRASE = re.compile(r"(?<=[.!?…;:])\s+|\n+")
+
+
+def dividir_frases(texto: str, max_caracteres: int = 200) -> List[str]:
+    """
+    Divide un texto en frases para sintetizarlas por separado. Las frases más largas que
+    max_caracteres se cortan por una coma o, si no hay, por un espacio, para que ningún
+    fragmento (y en particular el primero) tarde demasiado en sintetizarse.
+
+    Args:
+        texto: Texto a dividir.
+        max_caracteres: Longitud máxima de cada fragmento.
+
+    Returns:
+        Lista de frases, sin las que no contienen nada pronunciable.
+    """
+    frases = []
+    for frase in PATRON_FIN_FRASE.split(texto):
+        frase = frase.strip()
+        while len(frase) > max_caracteres:
+            corte = frase.rfind(", ", 0, max_caracteres)
+            if corte < max_caracteres // 3:
+                corte = frase.rfind(" ", 0, max_caracteres)
+            if corte <= 0:
+                corte = max_caracteres - 1
+            frases.append(frase[:corte + 1].strip())
+            frase = frase[corte + 1:].strip()
+        frases.append(frase)
+    return [frase for frase in frases if any(caracter.isalnum() for caracter in frase)]
+
+
+class MotorVoz:
+    """
+    Interfaz común de los motores de síntesis de voz.
+    Cada frase se convierte en audio PCM de 16 bits mono a la frecuencia del motor,
+    por lo que CanalVoz puede usar cualquiera de ellos.
+    """
+
+    frecuencia = 22050
+
+    async def sintetizar(self, frase: str) -> bytes:
+        """
+        Sintetiza una frase.
+
+        Args:
+            frase: Texto a sintetizar.
+
+        Returns:
+            Audio PCM de 16 bits mono.
+        """
+        raise NotImplementedError
+
+    async def cerrar(self) -> None:
+        """Libera los recursos del motor."""
+
+
+class MotorVozElevenLabs(MotorVoz):
+    """
+    Motor que usa la API de texto a voz de ElevenLabs, pidiendo directamente PCM
+    para no tener que decodificar MP3 antes de reproducir.
+    """
+
+    URL_API = "https://api.elevenlabs.io/v1/text-to-speech/{voz}"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el motor.
+
+        Args:
+            config: Sección "voz" de la configuración.
+        """
+        import httpx
+
+        config = config or {}
+        self.clave = os.getenv("ELEVENLABS_API_KEY")
+        self.url = self.URL_API.format(voz=config.get("voz_id", "21m00Tcm4TlvDq8ikWAM"))
+        self.modelo = config.get("modelo", "eleven_multilingual_v2")
+        self.frecuencia = int(config.get("frecuencia", 22050))
+        self.cliente = httpx.AsyncClient(timeout=httpx.Timeout(float(config.get("timeout", 30.0)), connect=10.0))
+
+    async def sintetizar(self, frase: str) -> bytes:
+        respuesta = await self.cliente.post(
+            self.url,
+            params={"output_format": f"pcm_{self.frecuencia}"},
+            headers={"xi-api-key": self.clave},
+            json={"text": frase, "model_id": self.modelo},
+        )
+        respuesta.raise_for_status()
+        return respuesta.content
+
+    async def cerrar(self) -> None:
+        await self.cliente.aclose()
+
+
+class MotorVozLocal(MotorVoz):
+    """
+    Motor sin red para pruebas y benchmarks: tras una latencia de síntesis simulada
+    (fija más una parte por carácter, como un motor real) genera un tono suave cuya
+    duración es proporcional a la longitud de la frase.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el motor.
+
+        Args:
+            config: Sección "voz" de la configuración (usa su subsección "local").
+        """
+        config = config or {}
+        opciones = config.get("local") or {}
+        self.frecuencia = int(config.get("frecuencia", 22050))
+        self.latencia_base = float(opciones.get("latencia_base", 0.15))
+        self.latencia_por_caracter = float(opciones.get("latencia_por_caracter", 0.002))
+        self.segundos_por_caracter = float(opciones.get("segundos_por_caracter", 0.06))
+        self.sintetizadas = 0
+
+    async def sintetizar(self, frase: str) -> bytes:
+        await asyncio.sleep(self.latencia_base + self.latencia_por_caracter * len(frase))
+        self.sintetizadas += 1
+        muestras = int(self.frecuencia * self.segundos_por_caracter * len(frase))
+        if not NUMPY_DISPONIBLE:
+            return bytes(2 * muestras)
+        tiempo = np.arange(muestras) / self.frecuencia
+        return (3000 * np.sin(2 * np.pi * 220 * tiempo)).astype("<i2").tobytes()
+
+
+class ReproductorAudio:
+    """
+    Reproduce audio PCM de 16 bits mono en bloques cortos, de modo que la reproducción
+    puede cortarse a mitad de frase. Sin PyAudio (o en modo simulado) solo espera lo
+    que duraría el audio, lo que sirve para pruebas y benchmarks.
+    """
+
+    SEGUNDOS_BLOQUE = 0.05
+
+    def __init__(self, frecuencia: int = 22050, simulado: bool = False):
+        """
+        Inicializa el reproductor.
+
+        Args:
+            frecuencia: Frecuencia de muestreo del audio.
+            simulado: Si es True no se abre ningún dispositivo de audio.
+        """
+        self.frecuencia = frecuencia
+        self.pyaudio = None
+        self.stream = None
+        if not simulado and PYAUDIO_DISPONIBLE:
+            try:
+                self.pyaudio = pyaudio.PyAudio()
+                self.stream = self.pyaudio.open(format=pyaudio.paInt16, channels=1,
+                                                rate=frecuencia, output=True)
+            except Exception as e:
+                logger.warning(f"No se pudo abrir la salida de audio: {e}")
+                self.cerrar()
+
+    @property
+    def simulado(self) -> bool:
+        """True si no hay un dispositivo de audio abierto."""
+        return self.stream is None
+
+    def reproducir(self, audio: bytes, detener: threading.Event) -> bool:
+        """
+        Reproduce el audio bloqueando hasta que termina o se activa detener.
+
+        Args:
+            audio: Audio PCM de 16 bits mono.
+            detener: Evento que corta la reproducción al final del bloque en curso.
+
+        Returns:
+            True si se reprodujo completo, False si se interrumpió.
+        """
+        tamano_bloque = 2 * int(self.frecuencia * self.SEGUNDOS_BLOQUE)
+        for inicio in range(0, len(audio), tamano_bloque):
+            bloque = audio[inicio:inicio + tamano_bloque]
+            if self.stream is not None:
+                if detener.is_set():
+                    return False
+                self.stream.write(bloque)
+            elif detener.wait(len(bloque) / (2 * self.frecuencia)):
+                return False
+        return not detener.is_set()
+
+    def cerrar(self) -> None:
+        """Cierra el dispositivo de audio."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.pyaudio is not None:
+            self.pyaudio.terminate()
+            self.pyaudio = None
+
+
+class CanalVoz:
+    """
+    Canalización de texto a voz: divide la respuesta en frases y sintetiza la siguiente
+    mientras se reproduce la actual. Como mucho se sintetizan frases_adelantadas frases
+    por delante de la que suena, así que interrumpir no deja trabajo perdido y el tiempo
+    hasta el primer audio solo depende de la primera frase, no de la longitud de la respuesta.
+    """
+
+    def __init__(self, motor: MotorVoz, reproductor: ReproductorAudio,
+                 config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa la canalización.
 
-def buscar_archivos(patron, ubicacion=None):
-    try:
-        # Determinar la ubicación de búsqueda
-        if ubicacion is None or ubicacion.lower() == "actual":
-            ruta_base = os.getcwd()
-        elif ubicacion.lower() == "escritorio":
-            ruta_base = obtener_escritorio()
-        elif ubicacion.lower() == "documentos":
-            ruta_base = obtener_documentos()
-        elif ubicacion.lower() == "descargas":
-            ruta_base = obtener_descargas()
-        else:
-            ruta_base = ubicacion
-        
-        # Construir el patrón de búsqueda
-        patron_busqueda = os.path.join(ruta_base, f"*{patron}*")
-        
-        # Buscar archivos
-        archivos_encontrados = glob.glob(patron_busqueda)
-        
-        # Mostrar resultados
-        if archivos_encontrados:
-            print(f"🔍 Se encontraron {len(archivos_encontrados)} archivos:")
-            for i, archivo in enumerate(archivos_encontrados, 1):
-                print(f"{i}. {archivo}")
-        else:
-            print(f"❌ No se encontraron archivos que coincidan con '{patron}' en {ruta_base}")
-        
-        return archivos_encontrados
-    except Exception as e:
-        print(f"❌ Error al buscar archivos: {e}")
-        return []
+        Args:
+            motor: Motor de síntesis.
+            reproductor: Reproductor del audio sintetizado.
+            config: Sección "voz" de la configuración.
+        """
+        config = config or {}
+        self.motor = motor
+        self.reproductor = reproductor
+        self.frases_adelantadas = max(1, int(config.get("frases_adelantadas", 1)))
+        self.max_caracteres_frase = int(config.get("max_caracteres_frase", 200))
+        self.detener = threading.Event()
+        self.tarea_sintesis = None
+        self.tecla = None
+        self.ultima_medicion = None
+        # Tiempos hasta el primer audio de las últimas respuestas, en ms
+        self.latencias_primer_audio = deque(maxlen=200)
 
-# Ejecutar la búsqueda
-archivos_encontrados = buscar_archivos("{patron}")
-"""
-}
+    def escuchar_tecla(self, tecla: Optional[str]) -> None:
+        """
+        Registra una tecla global que interrumpe la voz. Debe llamarse desde el bucle de eventos.
 
+        Args:
+            tecla: Tecla o combinación en el formato del módulo keyboard (por ejemplo "esc").
+        """
+        if not tecla or not KEYBOARD_DISPONIBLE:
+            return
+        bucle = asyncio.get_running_loop()
 
-class Timer:
-    """Context manager para medir el tiempo de ejecución."""
+        def al_pulsar():
+            # La reproducción se corta desde aquí; la cancelación de la síntesis, en el bucle
+            self.detener.set()
+            bucle.call_soon_threadsafe(self.interrumpir)
 
-    def __init__(self, name: str):
-        self.name = name
-        self.start_time = None
+        try:
+            keyboard.add_hotkey(tecla, al_pulsar)
+            self.tecla = tecla
+        except Exception as e:
+            # En Linux el módulo keyboard necesita permisos de root
+            logger.warning(f"No se pudo registrar la tecla '{tecla}' para interrumpir la voz: {e}")
 
-    def __enter__(self):
-        self.start_time = time.time()
-        return self
+    def interrumpir(self) -> None:
+        """Corta la frase que se está reproduciendo y cancela la síntesis pendiente."""
+        self.detener.set()
+        if self.tarea_sintesis is not None and not self.tarea_sintesis.done():
+            self.tarea_sintesis.cancel()
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        end_time = time.time()
-        execution_time = end_time - self.start_time
-        print(f"Tiempo de {self.name}: {execution_time:.4f} segundos")
+    async def decir(self, texto: str) -> Dict[str, Any]:
+        """
+        Sintetiza y reproduce un texto frase a frase.
+
+        Args:
+            texto: Texto a decir.
+
+        Returns:
+            Medición con el número de frases, las reproducidas, el tiempo hasta el primer
+            audio y el total en ms, y si se interrumpió.
+        """
+        frases = dividir_frases(texto, self.max_caracteres_frase)
+        medicion = {"frases": len(frases), "reproducidas": 0, "primer_audio_ms": None,
+                    "total_ms": 0.0, "interrumpida": False}
+        if not frases:
+            return medicion
+        self.detener.clear()
+        cola = asyncio.Queue()
+        huecos = asyncio.Semaphore(self.frases_adelantadas)
+
+        async def sintetizar_frases():
+            try:
+                for frase in frases:
+                    await huecos.acquire()
+                    cola.put_nowait(await self.motor.sintetizar(frase))
+                cola.put_nowait(None)
+            except asyncio.CancelledError:
+                cola.put_nowait(None)
+                raise
+            except Exception as e:
+                cola.put_nowait(e)
+
+        inicio = time.perf_counter()
+        self.tarea_sintesis = asyncio.create_task(sintetizar_frases())
+        try:
+            while True:
+                audio = await cola.get()
+                if isinstance(audio, Exception):
+                    raise audio
+                if audio is None or self.detener.is_set():
+                    break
+                # La siguiente frase se sintetiza mientras suena esta
+                huecos.release()
+                if medicion["primer_audio_ms"] is None:
+                    medicion["primer_audio_ms"] = (time.perf_counter() - inicio) * 1000
+                    self.latencias_primer_audio.append(medicion["primer_audio_ms"])
+                if not await asyncio.to_thread(self.reproductor.reproducir, audio, self.detener):
+                    break
+                medicion["reproducidas"] += 1
+        finally:
+            if not self.tarea_sintesis.done():
+                self.tarea_sintesis.cancel()
+            try:
+                await self.tarea_sintesis
+            except asyncio.CancelledError:
+                pass
+            self.tarea_sintesis = None
+            medicion["interrumpida"] = self.detener.is_set()
+            medicion["total_ms"] = (time.perf_counter() - inicio) * 1000
+            self.ultima_medicion = medicion
+
+        if medicion["primer_audio_ms"] is not None:
+            logger.info(f"Voz: primer audio en {medicion['primer_audio_ms']:.0f} ms, "
+                        f"{medicion['reproducidas']}/{medicion['frases']} frases"
+                        f"{' (interrumpida)' if medicion['interrumpida'] else ''}")
+        return medicion
+
+    async def cerrar(self) -> None:
+        """Detiene la voz y libera el motor, el reproductor y la tecla registrada."""
+        self.interrumpir()
+        if self.tecla is not None:
+            try:
+                keyboard.remove_hotkey(self.tecla)
+            except (KeyError, ValueError):
+                pass
+            self.tecla = None
+        self.reproductor.cerrar()
+        await self.motor.cerrar()
+
+
+def crear_canal_voz(config: Dict[str, Any]) -> Optional[CanalVoz]:
+    """
+    Crea la canalización de voz con el motor indicado en la configuración.
+
+    Args:
+        config: Configuración completa del chatbot.
+
+    Returns:
+        La canalización, o None si el motor o la salida de audio no están disponibles.
+    """
+    opciones = config.get("voz") or {}
+    motor = opciones.get("motor", "elevenlabs")
+    if motor == "elevenlabs" and not os.getenv("ELEVENLABS_API_KEY"):
+        logger.warning("ELEVENLABS_API_KEY no encontrada. Se usará el modo texto.")
+        return None
+    if motor not in ("elevenlabs", "local"):
+        logger.warning(f"Motor de voz desconocido: {motor}. Se usará el modo texto.")
+        return None
+    reproductor = ReproductorAudio(int(opciones.get("frecuencia", 22050)))
+    if reproductor.simulado and motor != "local":
+        logger.warning("No hay salida de audio disponible (¿falta PyAudio?). Se usará el modo texto.")
+        return None
+    if motor == "local":
+        return CanalVoz(MotorVozLocal(opciones), reproductor, opciones)
+    return CanalVoz(MotorVozElevenLabs(opciones), reproductor, opciones)
 
 
 class ConfigMenu:
@@ -231,7 +5455,103 @@ class ConfigMenu:
             "permitir_delimitadores": False,
             "modo_interaccion": "texto",
             "vector_db": {"type": "chroma"},
-            "mostrar_menu_inicio": True
+            "mostrar_menu_inicio": True,
+            "transporte_llm": {
+                "base_url": None,
+                "reintentos": 3,
+                "backoff_base": 0.5,
+                "backoff_max": 8.0,
+                "timeout_intento": 60.0,
+                "hedging": False,
+                "hedging_retardo_inicial": 2.0,
+                "conexiones_max": 10,
+                "conexiones_keepalive": 5,
+            },
+            "proveedor_llm": "openai",
+            "resumen_historial": {
+                "habilitado": True,
+                "max_tokens": 300,
+                "modelo": None,
+            },
+            "servidor": {
+                "host": "127.0.0.1",
+                "puerto": 8080,
+                "max_concurrencia": 8,
+                "max_sesiones": 100,
+                "inactividad_sesion": 900,
+                "token": None,
+                "permitir_remoto": False,
+            },
+            "mock_llm": {
+                "grabaciones": None,
+                "grabar_en": None,
+                "latencia_primer_token": 0.2,
+                "latencia_por_fragmento": 0.01,
+                "caracteres_por_fragmento": 16,
+            },
+            "manejadores_nativos": True,
+            "sandbox": {
+                "habilitado": True,
+                "procesos": 2,
+                "timeout": 30,
+                "cpu_segundos": 20,
+                "memoria_mb": 2048,
+                "max_salida_consola": 20000,
+                "max_salida_resumen": 4000,
+            },
+            "comandos": {
+                "timeout": 120,
+                "max_concurrentes": 2,
+                "max_bytes_salida": 1048576,
+                "gracia_segundos": 2,
+            },
+            "busqueda": {
+                "hilos": 8,
+                "profundidad_max": None,
+                "max_resultados": 1000,
+                "difusa": False,
+                "ignorar": list(IGNORADOS_BUSQUEDA),
+            },
+            "busqueda_contenido": {
+                "procesos": None,
+                "archivos_por_lote": 32,
+                "max_coincidencias": 200,
+                "umbral_mmap_kb": 256,
+                "max_tamano_mb": 512,
+            },
+            "muestreo_sistema": {
+                "habilitado": True,
+                "intervalo_segundos": 2,
+                "historial_segundos": 3600,
+                "intervalo_procesos_segundos": 10,
+                "top_procesos": 5,
+            },
+            "voz": {
+                "motor": "elevenlabs",
+                "voz_id": "21m00Tcm4TlvDq8ikWAM",
+                "modelo": "eleven_multilingual_v2",
+                "frecuencia": 22050,
+                "timeout": 30.0,
+                "frases_adelantadas": 1,
+                "max_caracteres_frase": 200,
+                "tecla_interrumpir": "esc",
+                "local": {
+                    "latencia_base": 0.15,
+                    "latencia_por_caracter": 0.002,
+                    "segundos_por_caracter": 0.06,
+                },
+            },
+            "indice_archivos": {
+                "habilitado": True,
+                "archivo": "~/jarvis_indice_archivos.json.gz",
+                "raices": [],
+                "refresco_segundos": 300,
+            },
+            "clasificador_intenciones": {
+                "habilitado": True,
+                "modelo": None,
+                "umbral": 0.8,
+            },
         }
         
         try:
@@ -358,7 +5678,8 @@ class ConfigMenu:
                             self.config["modo_interaccion"] = modes[mode_index]
                             print(f"{self.colores['exito']}Modo actualizado a {modes[mode_index]}{self.colores['reset']}")
                             if modes[mode_index] == "audio":
-                                print(f"{self.colores['error']}Nota: El modo de audio aún no está completamente implementado{self.colores['reset']}")
+                                print(f"{self.colores['error']}Nota: El modo de audio necesita ELEVENLABS_API_KEY y PyAudio "
+                                      f"(o voz.motor: local); si no están disponibles se usará el modo texto{self.colores['reset']}")
                         else:
                             print(f"{self.colores['error']}Opción inválida{self.colores['reset']}")
                     except ValueError:
@@ -394,22 +5715,34 @@ class ConfigMenu:
                 return self.config
 
 
+# Nombre de archivo con extensión, sin directorio (p. ej. "informe.docx")
+PATRON_NOMBRE_ARCHIVO = r"[\w][\w ()-]*?\.[A-Za-z0-9]{1,5}"
+
+
 class JarvisMemory:
     """
     Clase para gestionar la memoria mejorada de JARVIS.
     Permite recordar resultados de comandos y hacer referencias a ellos.
     """
 
-    def __init__(self, memory_file: str = None, max_memory_items: int = 100):
+    def __init__(self, memory_file: str = None, max_memory_items: int = 100,
+                 usar_chromadb: bool = True, persistente: bool = True,
+                 collection: Any = None, sesion_id: Optional[str] = None):
         """
         Inicializa el sistema de memoria para JARVIS
         
         Args:
             memory_file: Ruta al archivo de almacenamiento de memoria
             max_memory_items: Número máximo de elementos de memoria a almacenar
+            usar_chromadb: Si es False no se usa la búsqueda semántica (útil en benchmarks)
+            persistente: Si es False la memoria vive solo en RAM (no se lee ni se escribe el archivo)
+            collection: Colección de ChromaDB ya inicializada que se comparte con otras memorias
+            sesion_id: Identificador de sesión con el que se etiquetan y filtran los documentos de la colección
         """
         self.memory_file = memory_file or os.path.join(os.path.expanduser("~"), "jarvis_memory.json")
         self.max_memory_items = max_memory_items
+        self.persistente = persistente
+        self.sesion_id = sesion_id
         self.memory_data = {
             "conversations": [],
             "file_interactions": {},
@@ -433,12 +5766,15 @@ class JarvisMemory:
         
         # Historial de resultados para incluir en el contexto
         self.results_history = []
+
+        # Índice de archivos para resolver referencias por nombre (lo asigna el chatbot)
+        self.indice_archivos = None
         
         self.load_memory()
         
         # Inicializar ChromaDB si está disponible
-        self.collection = None
-        if CHROMADB_DISPONIBLE:
+        self.collection = collection
+        if collection is None and CHROMADB_DISPONIBLE and usar_chromadb:
             try:
                 self.init_chromadb()
             except Exception as e:
@@ -464,6 +5800,8 @@ class JarvisMemory:
     
     def load_memory(self) -> bool:
         """Carga la memoria desde el archivo de almacenamiento"""
+        if not self.persistente:
+            return False
         try:
             if os.path.exists(self.memory_file):
                 with open(self.memory_file, 'r', encoding='utf-8') as f:
@@ -479,6 +5817,8 @@ class JarvisMemory:
     
     def save_memory(self) -> bool:
         """Guarda la memoria en el archivo de almacenamiento"""
+        if not self.persistente:
+            return True
         try:
             # Asegurar que el directorio existe
             os.makedirs(os.path.dirname(os.path.abspath(self.memory_file)), exist_ok=True)
@@ -496,9 +5836,13 @@ class JarvisMemory:
     
     def add_conversation(self, user_input: str, assistant_response: str, 
                          executed_code: Optional[str] = None, 
-                         code_result: Optional[str] = None) -> str:
+                         code_result: Optional[str] = None,
+                         intencion: Optional[str] = None,
+                         recursos: Optional[Dict[str, Any]] = None) -> str:
         """
-        Añade un intercambio de conversación a la memoria
+        Añade un intercambio de conversación a la memoria.
+        La intención final se guarda para entrenar el clasificador de intenciones, y los
+        recursos consumidos por la ejecución se acumulan por intención.
         
         Returns:
             conversation_id: ID único para esta conversación
@@ -512,10 +5856,15 @@ class JarvisMemory:
             "assistant_response": assistant_response,
             "executed_code": executed_code,
             "code_result": code_result,
+            "intencion": intencion,
+            "recursos": recursos,
             "related_files": [],
             "related_conversations": []
         }
         
+        if recursos:
+            self.acumular_recursos(intencion, recursos)
+
         # Añadir a la memoria y mantener el límite de tamaño
         self.memory_data["conversations"].insert(0, conversation)
         if len(self.memory_data["conversations"]) > self.max_memory_items:
@@ -531,7 +5880,7 @@ class JarvisMemory:
                 self.collection.add(
                     documents=[text],
                     ids=[conversation_id],
-                    metadatas=[{"conversation_id": conversation_id}]
+                    metadatas=[{"conversation_id": conversation_id, "sesion": self.sesion_id or ""}]
                 )
             except Exception as e:
                 logger.error(f"Error al guardar en ChromaDB: {e}")
@@ -595,6 +5944,50 @@ class JarvisMemory:
         self.save_memory()
         logger.debug(f"Añadido comando al historial: {command}")
     
+    def acumular_recursos(self, intencion: Optional[str], recursos: Dict[str, Any]) -> None:
+        """
+        Suma el consumo de una ejecución al acumulado de su intención.
+
+        Args:
+            intencion: Intención de la conversación (None para el código sin intención reconocida).
+            recursos: Consumo medido con MedidorRecursos.
+        """
+        acumulados = self.memory_data.setdefault("recursos_por_intencion", {})
+        acumulado = acumulados.setdefault(intencion or "sin_intencion", {
+            "ejecuciones": 0, "tiempo_ms": 0.0, "tiempo_max_ms": 0.0, "cpu_ms": 0.0,
+            "rss_pico_kb": 0, "bytes_salida": 0, "archivos": 0,
+        })
+        acumulado["ejecuciones"] += 1
+        acumulado["tiempo_ms"] += recursos.get("tiempo_ms", 0)
+        acumulado["tiempo_max_ms"] = max(acumulado["tiempo_max_ms"], recursos.get("tiempo_ms", 0))
+        acumulado["cpu_ms"] += recursos.get("cpu_usuario_ms", 0) + recursos.get("cpu_sistema_ms", 0)
+        acumulado["rss_pico_kb"] = max(acumulado["rss_pico_kb"], recursos.get("rss_pico_kb", 0))
+        acumulado["bytes_salida"] += recursos.get("bytes_salida", 0)
+        acumulado["archivos"] += recursos.get("archivos", 0)
+
+    def resumen_recursos(self) -> List[Dict[str, Any]]:
+        """
+        Calcula el consumo medio por intención, de la más costosa a la menos.
+
+        Returns:
+            Lista de diccionarios con la intención, el número de ejecuciones, las medias
+            de tiempo, CPU, salida y archivos, el tiempo máximo y el mayor pico de memoria.
+        """
+        filas = []
+        for intencion, acumulado in self.memory_data.get("recursos_por_intencion", {}).items():
+            ejecuciones = max(1, acumulado["ejecuciones"])
+            filas.append({
+                "intencion": intencion,
+                "ejecuciones": acumulado["ejecuciones"],
+                "tiempo_medio_ms": acumulado["tiempo_ms"] / ejecuciones,
+                "tiempo_max_ms": acumulado["tiempo_max_ms"],
+                "cpu_media_ms": acumulado["cpu_ms"] / ejecuciones,
+                "rss_pico_kb": acumulado["rss_pico_kb"],
+                "bytes_salida_medios": acumulado["bytes_salida"] / ejecuciones,
+                "archivos_medios": acumulado["archivos"] / ejecuciones,
+            })
+        return sorted(filas, key=lambda fila: fila["tiempo_medio_ms"] + fila["cpu_media_ms"], reverse=True)
+
     def link_conversations(self, source_id: str, target_id: str, 
                            relation_type: str = "follow-up") -> bool:
         """Crea un enlace entre dos conversaciones"""
@@ -642,7 +6035,8 @@ class JarvisMemory:
         # Si ChromaDB está disponible, usar búsqueda semántica
         if self.collection is not None:
             try:
-                results = self.collection.query(query_texts=[query], n_results=5)
+                filtro = {"sesion": self.sesion_id} if self.sesion_id else None
+                results = self.collection.query(query_texts=[query], n_results=5, where=filtro)
                 conversation_ids = [meta["conversation_id"] for meta in results["metadatas"][0]] if results["metadatas"] else []
                 
                 if conversation_ids:
@@ -719,8 +6113,10 @@ class JarvisMemory:
         }
         self.results_history = []
         
-        # Limpiar ChromaDB si está disponible
-        if self.collection is not None:
+        # Limpiar ChromaDB si está disponible (en una sesión, solo sus documentos)
+        if self.sesion_id:
+            self.olvidar_sesion()
+        elif self.collection is not None:
             try:
                 self.collection.delete(where={})
             except Exception as e:
@@ -729,6 +6125,18 @@ class JarvisMemory:
         logger.info("Memoria limpiada")
         return self.save_memory()
     
+    def olvidar_sesion(self) -> None:
+        """
+        Borra de la colección compartida de ChromaDB los documentos de esta sesión,
+        para que no sobrevivan a la sesión ni ocupen el índice de las demás.
+        """
+        if self.collection is None or not self.sesion_id:
+            return
+        try:
+            self.collection.delete(where={"sesion": self.sesion_id})
+        except Exception as e:
+            logger.error(f"Error al borrar de ChromaDB la sesión {self.sesion_id}: {e}")
+
     def extract_file_references(self, code: str) -> List[Tuple[str, str]]:
         """
         Extrae referencias a archivos del código con sus probables acciones
@@ -841,7 +6249,7 @@ class JarvisMemory:
         }
         
         # Si es una búsqueda de archivos, almacenar los archivos encontrados
-        if command_type == "buscar_archivos" and isinstance(result, list):
+        if command_type in ("buscar_archivos", "buscar_contenido") and isinstance(result, list):
             self.found_files = result
             logger.debug(f"Almacenados {len(result)} archivos encontrados en memoria")
         
@@ -870,14 +6278,21 @@ class JarvisMemory:
     
     def get_file_by_reference(self, reference: str) -> Optional[str]:
         """
-        Obtiene la ruta de un archivo basado en una referencia como "el primero", "el segundo", etc.
+        Obtiene la ruta de un archivo basado en una referencia como "el primero", "el segundo", etc.,
+        o en su nombre ("informe.docx"), que se busca entre los archivos encontrados y en el índice.
         
         Args:
-            reference: Referencia al archivo ("el primero", "el segundo", "el último", etc.)
+            reference: Referencia al archivo ("el primero", "el segundo", "el último", un nombre, etc.)
             
         Returns:
             Ruta del archivo o None si no se encuentra
         """
+        if re.fullmatch(PATRON_NOMBRE_ARCHIVO, reference):
+            for ruta in self.found_files:
+                if os.path.basename(ruta).lower() == reference.lower():
+                    return ruta
+            return self.indice_archivos.buscar_nombre(reference) if self.indice_archivos is not None else None
+
         if not self.found_files:
             return None
         
@@ -916,6 +6331,10 @@ class JarvisMemory:
         Returns:
             Referencia extraída o None si no se encuentra
         """
+        # "los tres primeros" se refiere a varios archivos: lo resuelve la intención abrir_archivo
+        if re.search(r'(?:los|las) (?:\d+|' + "|".join(NUMEROS_PALABRA) + r') primer[oa]s', query.lower()):
+            return None
+
         # Patrones para detectar referencias a archivos
         patterns = [
             r'(?:el|la|los|las) (primer[oa]?|segund[oa]?|tercer[oa]?|cuart[oa]?|quint[oa]?|últim[oa]?)',
@@ -929,6 +6348,11 @@ class JarvisMemory:
             match = re.search(pattern, query.lower())
             if match:
                 return match.group(1)
+
+        # Nombre de un archivo que no está en el directorio actual (se busca en el índice)
+        match = re.search(r'(?:archivo|documento|fichero) (' + PATRON_NOMBRE_ARCHIVO + r')(?=\s|$|[,.;:?!])', query)
+        if match and os.sep not in match.group(1) and not os.path.exists(match.group(1)):
+            return match.group(1)
         
         return None
 
@@ -938,14 +6362,35 @@ class Chatbot:
     Clase principal para el chatbot.
     """
 
-    def __init__(self, config_path: str = DEFAULT_CONFIG_PATH):
+    def __init__(self, config_path: str = DEFAULT_CONFIG_PATH,
+                 config: Optional[Dict[str, Any]] = None,
+                 proveedor_llm: Optional[ProveedorLLM] = None,
+                 memory: Optional[JarvisMemory] = None,
+                 sandbox: Optional[SandboxProcesos] = None,
+                 ejecutor_comandos: Optional[EjecutorComandos] = None,
+                 indice_archivos: Optional[IndiceArchivos] = None,
+                 buscador_contenido: Optional[BuscadorContenido] = None,
+                 muestreador_sistema: Optional[MuestreadorSistema] = None):
         """
         Inicializa el chatbot.
 
         Args:
             config_path: Ruta al archivo de configuración.
+            config: Configuración ya cargada; si se indica no se lee el archivo ni se muestra el menú.
+            proveedor_llm: Proveedor de modelo de lenguaje; por defecto se crea según la configuración.
+            memory: Memoria a usar; por defecto se crea una JarvisMemory persistente.
+            sandbox: Pool de procesos para ejecutar código; por defecto se crea uno propio según la configuración.
+            ejecutor_comandos: Ejecutor de comandos del sistema; por defecto se crea uno propio.
+            indice_archivos: Índice de nombres de archivo; por defecto se usa el compartido del proceso
+                (obtener_indice_archivos) si está habilitado en la configuración.
+            buscador_contenido: Buscador de texto dentro de archivos; por defecto se crea uno propio.
+            muestreador_sistema: Muestreador del sistema en segundo plano; por defecto se crea (y arranca)
+                uno propio si está habilitado en la configuración y NumPy está instalado.
         """
-        self.load_config(config_path)
+        if config is not None:
+            self.config = config
+        else:
+            self.load_config(config_path)
         self.colores = {
             "principal": Fore.GREEN,  # Verde claro
             "secundario": Fore.BLUE,  # Azul claro
@@ -955,68 +6400,47 @@ class Chatbot:
             "reset": Style.RESET_ALL,  # Resetear color
         }
         self.conversation_history = deque(maxlen=MAX_HISTORIAL)
-        self.memory = JarvisMemory()
+        self.memory = memory if memory is not None else JarvisMemory()
         self.current_conversation_id = None
-        self.safe_environment = {
-            "__builtins__": {
-                "print": print,
-                "len": len,
-                "range": range,
-                "enumerate": enumerate,
-                "zip": zip,
-                "map": map,
-                "filter": filter,
-                "sorted": sorted,
-                "sum": sum,
-                "min": min,
-                "max": max,
-                "abs": abs,
-                "round": round,
-                "any": any,
-                "all": all,
-                "dir": dir,
-                "getattr": getattr,
-                "hasattr": hasattr,
-                "isinstance": isinstance,
-                "issubclass": issubclass,
-                "type": type,
-                "id": id,
-                "help": help,
-                "str": str,
-                "int": int,
-                "float": float,
-                "bool": bool,
-                "list": list,
-                "dict": dict,
-                "set": set,
-                "tuple": tuple,
-                "open": open,
-                "__import__": __import__,
-            },
-            "os": os,
-            "subprocess": subprocess,
-            "glob": __import__("glob"),
-            "re": re,
-            "time": time,
-            "shutil": __import__("shutil"),
-            "psutil": psutil,
-            "platform": platform,
-            "Path": Path,
-            "archivos_encontrados": [],
-            "abrir_archivo": self.abrir_archivo,
-            "obtener_archivo": self.obtener_archivo,
-            "obtener_escritorio": self.obtener_escritorio,
-            "obtener_documentos": self.obtener_documentos,
-            "obtener_descargas": self.obtener_descargas,
-            "ejecutar_comando": self.ejecutar_comando,
-        }
-        if OPENAI_DISPONIBLE:
-            from openai import OpenAI
-
-            self.client_openai = OpenAI()
-        else:
-            self.client_openai = None
+        self.ultimos_tiempos = None
+        self.ultima_intencion = None
+        # Si es una lista, speak() añade ahí cada respuesta (modo batch)
+        self.transcripcion = None
+        # Funciones asíncronas que reciben la salida en streaming (modo servidor)
+        self.oyente_salida = None
+        self.oyente_fragmentos = None
+        # Avisos que llegan después de responder (p. ej. un archivo que no se pudo abrir);
+        # el modo servidor los entrega a la sesión con su siguiente comando
+        self.avisos_pendientes = deque(maxlen=20)
+        # Canalización de voz; solo la activa el bucle interactivo en modo audio
+        self.voz = None
+        self.ejecutor_comandos = ejecutor_comandos or EjecutorComandos(self.config.get("comandos"))
+        self.safe_environment = crear_entorno_seguro(self.config, self.ejecutor_comandos.cupos)
+        self.motor_busqueda = MotorBusqueda(self.config.get("busqueda"))
+        self.buscador_contenido_propio = buscador_contenido is None
+        self.buscador_contenido = buscador_contenido or BuscadorContenido(self.config.get("busqueda_contenido"),
+                                                                          self.motor_busqueda)
+        opciones_indice = self.config.get("indice_archivos") or {}
+        self.indice_propio = indice_archivos is None and opciones_indice.get("habilitado", True)
+        if self.indice_propio:
+            indice_archivos = obtener_indice_archivos(opciones_indice, (self.config.get("busqueda") or {}).get("ignorar"))
+        self.indice_archivos = indice_archivos
+        self.memory.indice_archivos = indice_archivos
+        opciones_muestreo = self.config.get("muestreo_sistema") or {}
+        self.muestreador_propio = (muestreador_sistema is None and NUMPY_DISPONIBLE
+                                   and opciones_muestreo.get("habilitado", True))
+        if self.muestreador_propio:
+            muestreador_sistema = MuestreadorSistema(opciones_muestreo)
+            muestreador_sistema.iniciar()
+        self.muestreador_sistema = muestreador_sistema
+        self.sandbox_propio = sandbox is None and (self.config.get("sandbox") or {}).get("habilitado", True)
+        config_entorno = {seccion: self.config.get(seccion) for seccion in SECCIONES_ENTORNO}
+        self.sandbox = (SandboxProcesos(self.config.get("sandbox"), config_entorno, self.ejecutor_comandos.cupos)
+                        if self.sandbox_propio else sandbox)
+        self.proveedor_llm = proveedor_llm or crear_proveedor_llm(self.config)
+        if self.proveedor_llm is None:
             logger.warning("OpenAI API key no encontrada. No se podrán generar respuestas.")
+        self.resumidor = ResumidorConversacion(self.proveedor_llm, self.config)
 
     def load_config(self, config_path: str) -> None:
         """
@@ -1048,12 +6472,56 @@ class Chatbot:
 
     async def speak(self, text: str) -> None:
         """
-        Simula el habla del chatbot imprimiendo el texto.
+        Imprime la respuesta del chatbot y, en modo audio, la dice en voz alta.
+        Si la síntesis falla, se desactiva la voz y se sigue en modo texto.
 
         Args:
-            text: Texto a imprimir.
+            text: Texto a decir.
         """
+        if self.transcripcion is not None:
+            self.transcripcion.append(text)
+        if self.oyente_salida is not None:
+            await self.oyente_salida(text)
         print(f"{self.colores['principal']}JARVIS: {text}{self.colores['reset']}")
+        if self.voz is not None:
+            try:
+                await self.voz.decir(text)
+            except Exception as e:
+                logger.warning(f"Error en la síntesis de voz, se pasa a modo texto: {e}")
+                await self.voz.cerrar()
+                self.voz = None
+
+    async def actualizar_voz(self) -> None:
+        """Activa o desactiva la canalización de voz según el modo de interacción configurado."""
+        if self.config.get("modo_interaccion") == "audio":
+            if self.voz is None:
+                self.voz = crear_canal_voz(self.config)
+                if self.voz is not None:
+                    self.voz.escuchar_tecla((self.config.get("voz") or {}).get("tecla_interrumpir", "esc"))
+        elif self.voz is not None:
+            await self.voz.cerrar()
+            self.voz = None
+
+    def crear_sesion(self, sesion_id: Optional[str] = None) -> "Chatbot":
+        """
+        Crea un chatbot con su propio historial y memoria en RAM,
+        compartiendo la configuración, el proveedor de modelo, el sandbox, el ejecutor de comandos,
+        el índice de archivos, el buscador de contenido, el muestreador del sistema y el índice
+        vectorial de este.
+
+        Args:
+            sesion_id: Identificador de la sesión; por defecto se genera uno.
+
+        Returns:
+            El nuevo chatbot.
+        """
+        memoria = JarvisMemory(usar_chromadb=False, persistente=False,
+                               collection=self.memory.collection,
+                               sesion_id=sesion_id or uuid.uuid4().hex)
+        return Chatbot(config=self.config, proveedor_llm=self.proveedor_llm, memory=memoria,
+                       sandbox=self.sandbox, ejecutor_comandos=self.ejecutor_comandos,
+                       indice_archivos=self.indice_archivos, buscador_contenido=self.buscador_contenido,
+                       muestreador_sistema=self.muestreador_sistema)
 
     def extract_code(self, text: str) -> str:
         """
@@ -1093,7 +6561,8 @@ class Chatbot:
 
     def validate_code(self, code: str) -> Tuple[bool, str]:
         """
-        Valida el código antes de ejecutarlo.
+        Valida el código antes de ejecutarlo con la política de PoliticaCodigo.
+        El resultado (y el código compilado) queda en caché para execute_code.
 
         Args:
             code: Código a validar.
@@ -1105,89 +6574,122 @@ class Chatbot:
         if not code or not code.strip():
             return False, "El código está vacío."
 
-        # Verificar si el código contiene llamadas a funciones no permitidas
-        if "input(" in code:
-            return False, "El código contiene llamadas a la función 'input', que no está permitida."
-
-        # Verificar si el código contiene operaciones de red no permitidas
-        if "socket." in code:
-            return False, "El código contiene operaciones de red, que no están permitidas."
-        if "urllib." in code:
-            return False, "El código contiene operaciones de red, que no están permitidas."
-        if "requests." in code:
-            return False, "El código contiene operaciones de red, que no están permitidas."
-
-        # Verificar si el código contiene operaciones de eliminación de archivos
-        if "os.remove" in code or "os.unlink" in code or "shutil.rmtree" in code:
-            return False, "El código contiene operaciones de eliminación de archivos, que no están permitidas por seguridad."
-    
-        # Verificar si hay patrones peligrosos de eliminación
-        dangerous_patterns = [
-            r'rm\s+-rf',  # rm -rf en comandos shell
-            r'del\s+/[QSF]',  # del /Q o similares en Windows
-            r'rmdir\s+/[QS]',  # rmdir /Q o similares en Windows
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, code):
-                return False, "El código contiene comandos de eliminación de archivos, que no están permitidos por seguridad."
-
-        # Si pasa todas las verificaciones, se considera válido
-        return True, ""
+        # Análisis y validación del árbol sintáctico (o resultado ya guardado en caché)
+        valido, mensaje, _ = CACHE_CODIGO.obtener(code)
+        return valido, mensaje
 
-    def execute_code(self, code: str) -> Any:
+    async def execute_code(self, code: Union[str, CodeType],
+                           variables: Optional[Dict[str, Any]] = None) -> ResultadoEjecucion:
         """
-        Ejecuta el código en un entorno seguro.
+        Ejecuta el código en un entorno seguro: en el sandbox de procesos si está habilitado
+        (con límites de tiempo, CPU y memoria) o, si no, en el propio proceso.
 
         Args:
-            code: Código a ejecutar.
+            code: Código a ejecutar (texto o código ya compilado, como las plantillas).
+            variables: Variables iniciales del espacio de nombres local (parámetros de la plantilla).
 
         Returns:
-            El resultado de la ejecución del código.
+            El resultado estructurado: valor de __result (o el mensaje de error), salida
+            capturada y variables finales del código.
         """
         try:
-            # Crear un entorno seguro para la ejecución del código
-            local_vars = {}
+            if isinstance(code, str):
+                valido, mensaje, compilado = CACHE_CODIGO.obtener(code)
+                if not valido:
+                    return ResultadoEjecucion(f"Error de validación: {mensaje}", error=mensaje)
+                code = compilado
+
+            # La salida se muestra en la consola a medida que se produce (acotada)
+            consola = sys.stdout
 
-            # Ejecutar el código en el entorno seguro
-            exec(code, self.safe_environment, local_vars)
+            def mostrar(texto: str) -> None:
+                consola.write(texto)
+                consola.flush()
 
-            # Buscar la variable __result en el entorno local
-            if "__result" in local_vars:
-                return local_vars["__result"]
+            if self.sandbox is not None:
+                inicio = time.perf_counter()
+                try:
+                    resultado = await self.sandbox.ejecutar(code, variables, al_salida=mostrar)
+                except ErrorSandbox as e:
+                    logger.error(f"Error al ejecutar código: {e}")
+                    print(f"{self.colores['error']}Error al ejecutar código: {str(e)}{self.colores['reset']}")
+                    if e.traza:
+                        logger.debug(f"Traceback: {e.traza}")
+                        print(e.traza)
+                    # Si el proceso murió (tiempo agotado) solo se conoce el tiempo real
+                    recursos = e.recursos or {"tiempo_ms": round((time.perf_counter() - inicio) * 1000, 2)}
+                    return ResultadoEjecucion(f"Error: {str(e)}", e.salida, error=str(e),
+                                              archivo_salida=e.archivo_salida, recursos=recursos)
             else:
-                return "Código ejecutado sin errores, pero no se encontró un resultado explícito."
+                # Capa propia de esta ejecución sobre el entorno seguro compartido
+                espacio = crear_espacio_ejecucion(self.safe_environment, variables)
+                opciones = self.config.get("sandbox") or {}
+                salida = CapturaSalida(mostrar, int(opciones.get("max_salida_consola", 20000)),
+                                       int(opciones.get("max_salida_resumen", 4000)))
+
+                # Ejecutar el código en el entorno seguro
+                medidor = MedidorRecursos(por_hilo=True)
+                try:
+                    with medidor, redirect_stdout(salida), redirect_stderr(salida):
+                        exec(code, espacio)
+                finally:
+                    salida.close()
+
+                # Buscar la variable __result en el espacio de la ejecución
+                resultado = ResultadoEjecucion(espacio.get("__result", SIN_RESULTADO), salida.resumen(),
+                                               extraer_salidas(espacio), archivo_salida=salida.ruta_volcado,
+                                               caracteres_salida=salida.total,
+                                               recursos=dict(medidor.consumo, bytes_salida=salida.total))
+
+            if resultado.archivo_salida:
+                print(f"{self.colores['secundario']}Salida completa ({resultado.caracteres_salida} caracteres) "
+                      f"guardada en {resultado.archivo_salida}{self.colores['reset']}")
+            if resultado.recursos:
+                logger.info(f"Recursos de la ejecución: {describir_recursos(resultado.recursos)}")
+            return resultado
         except Exception as e:
             logger.error(f"Error al ejecutar código: {e}")
             print(f"{self.colores['error']}Error al ejecutar código: {str(e)}{self.colores['reset']}")
             error_traceback = traceback.format_exc()
             logger.debug(f"Traceback: {error_traceback}")
             print(error_traceback)
-            return f"Error: {str(e)}"
+            return ResultadoEjecucion(f"Error: {str(e)}", error=str(e))
+
+    def avisar_error_apertura(self, ruta: str, mensaje: str) -> None:
+        """
+        Muestra un fallo al abrir un archivo, que llega después de haber respondido al usuario,
+        y lo guarda en los avisos pendientes de este chatbot. Se llama desde el hilo del lanzador.
+
+        Args:
+            ruta: Archivo que no se pudo abrir.
+            mensaje: Error del lanzador.
+        """
+        aviso = f"❌ No se pudo abrir '{ruta}': {mensaje}"
+        self.avisos_pendientes.append(aviso)
+        print(f"{self.colores['aviso']}{aviso}{self.colores['reset']}")
 
-    def abrir_archivo(self, ruta: str) -> str:
+    @staticmethod
+    def abrir_archivo(ruta: str) -> str:
         """
-        Abre un archivo con la aplicación predeterminada del sistema operativo.
+        Abre un archivo con la aplicación predeterminada del sistema operativo, sin esperar
+        a que se cierre (ver LanzadorArchivos).
 
         Args:
             ruta: Ruta del archivo a abrir.
 
         Returns:
-            Un mensaje indicando si el archivo se abrió correctamente o si hubo un error.
+            Un mensaje indicando que se está abriendo el archivo o el error al lanzarlo.
         """
         try:
-            if SISTEMA_OPERATIVO == "Windows":
-                os.startfile(ruta)
-            elif SISTEMA_OPERATIVO == "Darwin":
-                subprocess.run(["open", ruta])
-            else:
-                subprocess.run(["xdg-open", ruta])
-            return f"Archivo '{ruta}' abierto correctamente."
+            # No se espera a la aplicación: algunos lanzadores no vuelven hasta que se cierra el visor
+            LANZADOR_ARCHIVOS.abrir(ruta)
+            return f"Abriendo '{ruta}'."
         except Exception as e:
             logger.error(f"Error al abrir el archivo: {e}")
             return f"Error al abrir el archivo '{ruta}': {str(e)}"
 
-    def obtener_archivo(self, ruta: str) -> str:
+    @staticmethod
+    def obtener_archivo(ruta: str) -> str:
         """
         Obtiene la ruta absoluta de un archivo.
 
@@ -1199,7 +6701,26 @@ class Chatbot:
         """
         return os.path.abspath(ruta)
 
-    def obtener_escritorio(self) -> str:
+    @staticmethod
+    def leer_archivo(ruta: str, lineas: Optional[int] = None, desde: Optional[int] = None,
+                     hasta: Optional[int] = None, final: bool = False) -> str:
+        """
+        Lee una parte acotada de un archivo de texto sin cargarlo entero.
+
+        Args:
+            ruta: Ruta del archivo.
+            lineas: Número de líneas (por defecto MAX_LINEAS_LECTURA).
+            desde: Primera línea de un rango (empezando en 1).
+            hasta: Última línea del rango.
+            final: Si es True, se leen las últimas líneas.
+
+        Returns:
+            La vista previa del fragmento leído, con su posición en el archivo.
+        """
+        return leer_archivo_acotado(ruta, lineas, desde, hasta, final).vista()
+
+    @staticmethod
+    def obtener_escritorio() -> str:
         """
         Obtiene la ruta al escritorio del usuario.
 
@@ -1208,7 +6729,8 @@ class Chatbot:
         """
         return str(Path.home() / "Desktop")
 
-    def obtener_documentos(self) -> str:
+    @staticmethod
+    def obtener_documentos() -> str:
         """
         Obtiene la ruta a la carpeta de documentos del usuario.
 
@@ -1217,7 +6739,8 @@ class Chatbot:
         """
         return str(Path.home() / "Documents")
 
-    def obtener_descargas(self) -> str:
+    @staticmethod
+    def obtener_descargas() -> str:
         """
         Obtiene la ruta a la carpeta de descargas del usuario.
 
@@ -1228,7 +6751,8 @@ class Chatbot:
 
     def ejecutar_comando(self, comando: str) -> str:
         """
-        Ejecuta un comando del sistema de forma segura.
+        Ejecuta un comando del sistema de forma segura, con la configuración y el límite
+        de comandos simultáneos del chatbot.
 
         Args:
             comando: Comando a ejecutar.
@@ -1236,23 +6760,22 @@ class Chatbot:
         Returns:
             La salida del comando.
         """
-        try:
-            result = subprocess.run(
-                comando,
-                shell=True,
-                capture_output=True,
-                text=True,
-                check=True,
-                cwd=os.getcwd(),
-                env=os.environ,
-            )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error al ejecutar el comando: {e}")
-            return f"Error: {e.stderr.strip()}"
-        except Exception as e:
-            logger.error(f"Error inesperado al ejecutar el comando: {e}")
-            return f"Error inesperado: {str(e)}"
+        return self.ejecutor_comandos.ejecutar_texto(comando)
+
+    async def mostrar_linea_comando(self, flujo: str, linea: str) -> None:
+        """
+        Muestra una línea de salida de un comando en cuanto llega (y la envía al cliente en modo servidor).
+
+        Args:
+            flujo: "stdout" o "stderr".
+            linea: Línea de salida.
+        """
+        if flujo == "stderr":
+            print(f"{self.colores['aviso']}{linea}{self.colores['reset']}")
+        else:
+            print(linea)
+        if self.oyente_fragmentos is not None:
+            await self.oyente_fragmentos(linea + "\n")
 
     def detectar_intencion(self, comando: str) -> Optional[str]:
         """
@@ -1264,45 +6787,14 @@ class Chatbot:
         Returns:
             La intención detectada o None si no se pudo detectar.
         """
-        comando = comando.lower()
-
-        # Lista de intenciones y sus palabras clave
-        intenciones = {
-            "buscar_archivos": ["buscar", "archivos", "encontrar", "listar"],
-            "leer_archivo": ["leer", "archivo", "contenido"],
-            "crear_archivo": ["crear", "archivo", "nuevo"],
-            "crear_y_abrir_archivo": ["crear", "abrir", "archivo"],
-            "borrar_archivo": ["borrar", "eliminar", "archivo"],
-            "copiar_archivo": ["copiar", "archivo"],
-            "mover_archivo": ["mover", "archivo"],
-            "renombrar_archivo": ["renombrar", "archivo"],
-            "crear_directorio": ["crear", "directorio", "carpeta"],
-            "borrar_directorio": ["borrar", "eliminar", "directorio", "carpeta"],
-            "obtener_info_sistema": ["información", "sistema", "cpu", "memoria", "disco"],
-            "ejecutar_comando": ["ejecutar", "comando"],
-            "abrir_pagina_web": ["abrir", "pagina", "web", "navegador"],
-        }
-
-        # Buscar la intención que coincida con las palabras clave del comando
-        for intencion, palabras_clave in intenciones.items():
-            if all(palabra in comando for palabra in palabras_clave):
-                return intencion
-
-        # Si no se encontró una coincidencia exacta, buscar la mejor coincidencia parcial
-        mejor_intencion = None
-        max_coincidencias = 0
-        
-        for intencion, palabras_clave in intenciones.items():
-            coincidencias = sum(1 for palabra in palabras_clave if palabra in comando)
-            if coincidencias > max_coincidencias:
-                max_coincidencias = coincidencias
-                mejor_intencion = intencion
-        
-        # Solo devolver la intención si hay al menos una coincidencia
-        if max_coincidencias > 0:
-            return mejor_intencion
-
-        return None
+        opciones = self.config.get("clasificador_intenciones") or {}
+        clasificador = None
+        if opciones.get("habilitado", True):
+            clasificador = obtener_clasificador(ruta_modelo_intenciones(self.config))
+        intencion, confianza = detectar_intencion_local(comando, clasificador, opciones.get("umbral", 0.8))
+        if intencion and confianza < 1.0:
+            logger.info(f"Intención {intencion} detectada por el clasificador (confianza {confianza:.2f})")
+        return intencion
 
     def extraer_parametros(self, comando: str, intencion: str) -> Dict[str, Any]:
         """
@@ -1315,97 +6807,7 @@ class Chatbot:
         Returns:
             Un diccionario con los parámetros extraídos.
         """
-        parametros = {}
-
-        if intencion == "buscar_archivos":
-            # Extraer el patrón de búsqueda
-            match = re.search(r"buscar archivos con patrón (.*)", comando)
-            if match:
-                parametros["patron"] = match.group(1).strip()
-            else:
-                # Intentar extraer cualquier patrón mencionado
-                palabras = comando.split()
-                for i, palabra in enumerate(palabras):
-                    if palabra in ["buscar", "encontrar", "listar"] and i+1 < len(palabras):
-                        parametros["patron"] = palabras[i+1]
-                        break
-
-        elif intencion == "leer_archivo":
-            # Extraer la ruta del archivo
-            match = re.search(r"leer archivo (.*)", comando)
-            if match:
-                parametros["ruta"] = match.group(1).strip()
-
-        elif intencion == "crear_archivo" or intencion == "crear_y_abrir_archivo":
-            # Extraer la ruta del archivo
-            match = re.search(r"crear archivo (.*?)(?: en (.*))?$", comando)
-            if match:
-                nombre_archivo = match.group(1).strip()
-                ubicacion = match.group(2).strip() if match.group(2) else "escritorio"
-                
-                parametros["nombre_archivo"] = nombre_archivo
-                parametros["ubicacion"] = ubicacion
-            else:
-                # Buscar cualquier nombre de archivo mencionado
-                palabras = comando.split()
-                for palabra in palabras:
-                    if "." in palabra:
-                        parametros["nombre_archivo"] = palabra
-                        parametros["ubicacion"] = "escritorio"
-                        break
-
-        elif intencion == "borrar_archivo":
-            # Extraer la ruta del archivo
-            match = re.search(r"borrar archivo (.*)", comando)
-            if match:
-                parametros["ruta"] = match.group(1).strip()
-
-        elif intencion == "copiar_archivo":
-            # Extraer la ruta del archivo origen y destino
-            match = re.search(r"copiar archivo (.*) a (.*)", comando)
-            if match:
-                parametros["origen"] = match.group(1).strip()
-                parametros["destino"] = match.group(2).strip()
-
-        elif intencion == "mover_archivo":
-            # Extraer la ruta del archivo origen y destino
-            match = re.search(r"mover archivo (.*) a (.*)", comando)
-            if match:
-                parametros["origen"] = match.group(1).strip()
-                parametros["destino"] = match.group(2).strip()
-
-        elif intencion == "renombrar_archivo":
-            # Extraer la ruta del archivo origen y destino
-            match = re.search(r"renombrar archivo (.*) a (.*)", comando)
-            if match:
-                parametros["origen"] = match.group(1).strip()
-                parametros["destino"] = match.group(2).strip()
-
-        elif intencion == "crear_directorio":
-            # Extraer la ruta del directorio
-            match = re.search(r"crear directorio (.*)", comando)
-            if match:
-                parametros["ruta"] = match.group(1).strip()
-
-        elif intencion == "borrar_directorio":
-            # Extraer la ruta del directorio
-            match = re.search(r"borrar directorio (.*)", comando)
-            if match:
-                parametros["ruta"] = match.group(1).strip()
-
-        elif intencion == "ejecutar_comando":
-            # Extraer el comando a ejecutar
-            match = re.search(r"ejecutar comando (.*)", comando)
-            if match:
-                parametros["comando"] = match.group(1).strip()
-
-        elif intencion == "abrir_pagina_web":
-            # Extraer la URL de la página web
-            match = re.search(r"abrir página web (.*)", comando)
-            if match:
-                parametros["url"] = match.group(1).strip()
-
-        return parametros
+        return extraer_parametros_gramatica(comando, intencion)
 
     def generar_codigo_desde_plantilla(self, intencion: str, parametros: Dict[str, Any]) -> Optional[str]:
         """
@@ -1420,13 +6822,12 @@ class Chatbot:
         """
         # Si hay una plantilla predefinida para esta intención, usarla
         if intencion in PLANTILLAS:
-            try:
-                # Reemplazar los parámetros en la plantilla
-                codigo_generado = PLANTILLAS[intencion].format(**parametros)
-                return codigo_generado
-            except KeyError as e:
-                logger.error(f"Falta el parámetro {e} para la plantilla de {intencion}")
+            variables = variables_plantilla(intencion, parametros)
+            if variables is None:
                 return None
+            # El texto solo se muestra y se guarda en memoria; se ejecuta la plantilla compilada
+            asignaciones = "".join(f"{nombre} = {valor!r}\n" for nombre, valor in variables.items())
+            return asignaciones + PLANTILLAS[intencion]
         
         return None
 
@@ -1516,37 +6917,26 @@ class Chatbot:
         if await self.handle_memory_commands(command):
             return
             
-        self.conversation_history.append({"role": "user", "content": command})
+        self.agregar_al_historial({"role": "user", "content": command})
 
-        if len(self.conversation_history) > MAX_HISTORIAL:
-            self.conversation_history = self.conversation_history[-MAX_HISTORIAL:]
-
-        # Verificar si el comando hace referencia a resultados anteriores
-        command_with_context = await self.resolve_references(command)
-        if command_with_context != command:
-            logger.info(f"Comando con referencias resueltas: {command_with_context}")
-            print(f"{self.colores['secundario']}Entendiendo: {command_with_context}{self.colores['reset']}")
+        tiempos = TiemposEtapas()
+        self.ultimos_tiempos = tiempos
         
-        # Obtener contexto relacionado de la memoria
-        context = self.memory.get_related_context(command_with_context)
+        # Etapas previas al LLM: referencias, después contexto e intención en paralelo
+        command_with_context, context_prompt, intencion, parametros = await self.preparar_comando(command, tiempos)
+        self.ultima_intencion = intencion
         
-        # Formatear el contexto para incluirlo en el prompt
-        context_prompt = ""
-        if any(len(context[key]) > 0 for key in context) or context.get("recent_results"):
-            context_prompt = self.memory.format_context_for_prompt(context)
-            logger.info("Se encontró contexto relevante en la memoria")
-        
-        # Detectar intención y generar código desde plantilla si es posible
-        intencion = self.detectar_intencion(command_with_context)
+        # Resolver la intención con un manejador nativo si es posible
+        if intencion and await self.ejecutar_manejador(command, intencion, parametros, tiempos):
+            return
+
+        # Generar código desde plantilla si es posible
         if intencion:
-            logger.info(f"Intención detectada: {intencion}")
-            parametros = self.extraer_parametros(command_with_context, intencion)
-            logger.info(f"Parámetros extraídos: {parametros}")
             codigo_generado = self.generar_codigo_desde_plantilla(intencion, parametros)
             
             if codigo_generado:
-                # Validar el código generado
-                valid, error_msg = self.validate_code(codigo_generado)
+                # Validar la plantilla (los parámetros son datos, no código; queda en caché)
+                valid, error_msg = self.validate_code(PLANTILLAS[intencion])
                 if valid:
                     # Generar una respuesta que incluya el código
                     response = f"He entendido que quieres {intencion.replace('_', ' ')}. Aquí tienes el código:\n\nCODIGO:\n{codigo_generado}"
@@ -1564,11 +6954,13 @@ class Chatbot:
                     print("-" * 40)
                     
                     try:
-                        with self.timer("ejecución de código"):
-                            result = self.execute_code(codigo_generado)
+                        with self.timer("ejecución de código"), tiempos.medir("ejecucion"):
+                            result = await self.execute_code(PLANTILLAS_COMPILADAS[intencion],
+                                                             variables_plantilla(intencion, parametros))
+                        tiempos.registrar()
                         
                         executed_code = codigo_generado
-                        code_result = result
+                        code_result = result.texto_resultado()
                         
                         # Extraer referencias a archivos del código y registrarlas
                         file_refs = self.memory.extract_file_references(codigo_generado)
@@ -1579,15 +6971,17 @@ class Chatbot:
                         self.store_command_results(codigo_generado, result)
                         
                         # Si hay un resultado, lo decimos
-                        if result and result != "Código ejecutado sin errores, pero no se encontró un resultado explícito.":
-                            await self.speak(f"Resultado: {result}")
+                        if result.valor and result.valor != SIN_RESULTADO:
+                            await self.speak(f"Resultado: {resumir_valor(result.valor)}")
                         
                         # Añadir a la memoria
                         self.current_conversation_id = self.memory.add_conversation(
                             command,
                             response,
                             executed_code,
-                            code_result
+                            code_result,
+                            intencion,
+                            result.recursos
                         )
                         
                         return
@@ -1601,12 +6995,14 @@ class Chatbot:
                         await self.speak(f"Hubo un error al ejecutar el código: {str(e)}")
         
         # Si no se pudo generar código desde plantilla o hubo un error, usar GPT
-        with self.timer("generación de respuesta"):
-            response = await self.get_gpt_response(context_prompt, command_with_context)
+        with self.timer("generación de respuesta"), tiempos.medir("llm"):
+            response = await self.get_gpt_response(context_prompt, command_with_context, intencion)
+        tiempos.registrar()
         
-        # Variables para almacenar código ejecutado y resultado
+        # Variables para almacenar código ejecutado, resultado y recursos consumidos
         executed_code = None
         code_result = None
+        recursos = None
         
         # Verificar si la respuesta contiene código para ejecutar
         if "CODIGO:" in response:
@@ -1641,10 +7037,11 @@ class Chatbot:
             if valid:
                 try:
                     with self.timer("ejecución de código"):
-                        result = self.execute_code(code)
+                        result = await self.execute_code(code)
                     
                     executed_code = code
-                    code_result = result
+                    code_result = result.texto_resultado()
+                    recursos = result.recursos
                     
                     # Extraer referencias a archivos del código y registrarlas
                     file_refs = self.memory.extract_file_references(code)
@@ -1655,8 +7052,8 @@ class Chatbot:
                     self.store_command_results(code, result)
                     
                     # Si hay un resultado, lo decimos
-                    if result:
-                        await self.speak(f"Resultado: {result}")
+                    if result.valor:
+                        await self.speak(f"Resultado: {resumir_valor(result.valor)}")
                     else:
                         await self.speak("Código ejecutado con éxito.")
                 except Exception as e:
@@ -1674,10 +7071,7 @@ class Chatbot:
                 await self.speak(f"El código generado no es válido: {error_msg}")
         else:
             # Si no hay código, simplemente respondemos
-            self.conversation_history.append({"role": "assistant", "content": response})
-            await self.speak(response)
-        
-        #  "assistant", "content": response})
+            self.agregar_al_historial({"role": "assistant", "content": response})
             await self.speak(response)
         
         # Añadir a la memoria
@@ -1685,9 +7079,127 @@ class Chatbot:
             command,
             response,
             executed_code,
-            code_result
+            code_result,
+            intencion or inferir_intencion_de_codigo(executed_code),
+            recursos
         )
     
+    async def ejecutar_manejador(self, command: str, intencion: str, parametros: Dict[str, Any],
+                                 tiempos: "TiemposEtapas") -> bool:
+        """
+        Resuelve la intención con su manejador nativo, sin generar ni ejecutar código.
+
+        Args:
+            command: Comando original del usuario.
+            intencion: Intención detectada.
+            parametros: Parámetros extraídos.
+            tiempos: Registro de tiempos por etapa.
+
+        Returns:
+            True si el comando se resolvió (con éxito o con error), False si la intención
+            no tiene manejador o faltan parámetros (o no son válidos) y debe resolverse por otra vía.
+        """
+        manejador = MANEJADORES_INTENCION.get(intencion)
+        if (manejador is None or not self.config.get("manejadores_nativos", True)
+                or not parametros_completos(intencion, parametros)):
+            return False
+        if not parametros_validos(intencion, parametros):
+            logger.info(f"Los parámetros de {intencion} no permiten resolverla localmente; se usará GPT")
+            return False
+
+        llamada = f"{manejador.__name__}({', '.join(f'{k}={v!r}' for k, v in parametros.items())})"
+        logger.info(f"Resolviendo {intencion} con el manejador nativo: {llamada}")
+        await self.speak(f"He entendido que quieres {intencion.replace('_', ' ')}.")
+        medidor = MedidorRecursos(por_hilo=True)
+        try:
+            with self.timer("manejador nativo"), tiempos.medir("ejecucion"):
+                if asyncio.iscoroutinefunction(manejador):
+                    # En el bucle de eventos la CPU y los archivos del hilo incluirían los de
+                    # otras sesiones: de los manejadores asíncronos solo se guarda el tiempo
+                    inicio = time.perf_counter()
+                    try:
+                        mensaje, resultado = await manejador(self, **parametros)
+                    finally:
+                        medidor.consumo = {"tiempo_ms": round((time.perf_counter() - inicio) * 1000, 2)}
+                else:
+                    mensaje, resultado = await asyncio.to_thread(medidor.medir, manejador, self, **parametros)
+            self.memory.store_command_result(intencion, resultado)
+            accion = "read" if intencion == "leer_archivo" else "modify"
+            for clave in ("ruta", "origen", "destino"):
+                if isinstance(parametros.get(clave), str) and os.path.exists(parametros[clave]):
+                    self.memory.add_file_interaction(parametros[clave], accion, self.current_conversation_id)
+            code_result = mensaje
+            await self.speak(f"Resultado: {mensaje}" if mensaje else "Hecho.")
+        except Exception as e:
+            logger.error(f"Error en el manejador de {intencion}: {e}")
+            mensaje = f"No he podido {intencion.replace('_', ' ')}: {e}"
+            code_result = f"Error: {e}"
+            await self.speak(mensaje)
+        tiempos.registrar()
+
+        recursos = dict(medidor.consumo, bytes_salida=len(code_result.encode("utf-8"))) if medidor.consumo else None
+        self.current_conversation_id = self.memory.add_conversation(
+            command, mensaje, llamada, code_result, intencion, recursos
+        )
+        return True
+
+    async def preparar_comando(self, command: str,
+                               tiempos: "TiemposEtapas") -> Tuple[str, str, Optional[str], Dict[str, Any]]:
+        """
+        Ejecuta las etapas previas a la llamada al modelo.
+        Primero se resuelven las referencias (el resto depende de ellas); después
+        la recuperación de contexto (bloqueante, en un hilo) y la detección de
+        intención se ejecutan en paralelo.
+
+        Args:
+            command: Comando original del usuario.
+            tiempos: Registro de tiempos por etapa.
+
+        Returns:
+            Tupla con el comando con referencias resueltas, el contexto formateado
+            para el prompt, la intención detectada y sus parámetros.
+        """
+        with tiempos.medir("referencias"):
+            command_with_context = await self.resolve_references(command)
+        if command_with_context != command:
+            logger.info(f"Comando con referencias resueltas: {command_with_context}")
+            print(f"{self.colores['secundario']}Entendiendo: {command_with_context}{self.colores['reset']}")
+
+        async def etapa_contexto() -> str:
+            with tiempos.medir("contexto"):
+                context = await asyncio.to_thread(self.memory.get_related_context, command_with_context)
+            with tiempos.medir("formato_contexto"):
+                if any(len(context[key]) > 0 for key in context):
+                    logger.info("Se encontró contexto relevante en la memoria")
+                    return self.memory.format_context_for_prompt(context)
+            return ""
+
+        async def etapa_intencion() -> Tuple[Optional[str], Dict[str, Any]]:
+            with tiempos.medir("intencion"):
+                intencion = self.detectar_intencion(command_with_context)
+                parametros = {}
+                if intencion:
+                    logger.info(f"Intención detectada: {intencion}")
+                    parametros = self.extraer_parametros(command_with_context, intencion)
+                    logger.info(f"Parámetros extraídos: {parametros}")
+            return intencion, parametros
+
+        context_prompt, (intencion, parametros) = await asyncio.gather(etapa_contexto(), etapa_intencion())
+        tiempos.registrar()
+        return command_with_context, context_prompt, intencion, parametros
+
+    def agregar_al_historial(self, mensaje: Dict[str, str]) -> None:
+        """
+        Añade un mensaje al historial de conversación. Si el historial está lleno,
+        el mensaje más antiguo se pasa al resumidor en lugar de perderse.
+
+        Args:
+            mensaje: Mensaje con "role" y "content".
+        """
+        if len(self.conversation_history) == self.conversation_history.maxlen:
+            self.resumidor.agregar_turnos([self.conversation_history[0]])
+        self.conversation_history.append(mensaje)
+
     async def resolve_references(self, command: str) -> str:
         """
         Resuelve referencias a resultados anteriores en el comando
@@ -1718,6 +7230,9 @@ class Chatbot:
                         command,
                         flags=re.IGNORECASE
                     )
+                # Referencia por nombre: se sustituye el nombre por la ruta encontrada
+                if file_path not in command:
+                    command = command.replace(file_reference, f'"{file_path}"', 1)
         
         # Verificar referencias a la última operación
         last_op = self.memory.get_last_operation()
@@ -1726,44 +7241,40 @@ class Chatbot:
                 command = command.replace("último resultado", f'"{last_op["result"]}"')
             elif isinstance(last_op["result"], list) and last_op["result"]:
                 command = command.replace("último resultado", f'"{last_op["result"][0]}"')
+            elif isinstance(last_op["result"], dict) and "ruta" in last_op["result"]:
+                command = command.replace("último resultado", f'"{last_op["result"]["ruta"]}"')
         
         return command
     
-    def store_command_results(self, code: str, result: Any) -> None:
+    def store_command_results(self, code: str, resultado: ResultadoEjecucion) -> None:
         """
         Analiza el código ejecutado y almacena resultados relevantes en la memoria
         
         Args:
             code: Código ejecutado
-            result: Resultado de la ejecución
+            resultado: Resultado estructurado de la ejecución
         """
+        result = resultado.valor
+
         # Detectar búsqueda de archivos
-        if "glob.glob" in code or "os.listdir" in code:
+        if isinstance(resultado.salidas.get("archivos_encontrados"), list):
+            # La plantilla buscar_archivos (y el código que la imita) deja la lista en archivos_encontrados
+            self.memory.store_command_result("buscar_archivos", resultado.salidas["archivos_encontrados"])
+
+        elif "glob.glob" in code or "os.listdir" in code or "os.walk" in code:
             # Extraer rutas de archivos del resultado
             if isinstance(result, str):
                 # Intentar extraer rutas de archivos del texto
                 file_paths = re.findall(r'(?:\/|[A-Za-z]:\\)(?:[^:\n]+)', result)
                 if file_paths:
                     self.memory.store_command_result("buscar_archivos", file_paths)
-            
-            # Si no se pudo extraer del resultado, intentar extraer del código
-            if "archivos_encontrados" in code:
-                # El código probablemente usa la plantilla buscar_archivos
-                # que guarda los resultados en archivos_encontrados
-                try:
-                    # Ejecutar una versión modificada del código para obtener solo los archivos
-                    modified_code = re.sub(r'print$$.*?$$', '', code)
-                    modified_code += "\n__result = archivos_encontrados"
-                    
-                    local_vars = {}
-                    exec(modified_code, self.safe_environment, local_vars)
-                    
-                    if "__result" in local_vars and isinstance(local_vars["__result"], list):
-                        self.memory.store_command_result("buscar_archivos", local_vars["__result"])
-                except Exception as e:
-                    logger.error(f"Error al extraer archivos encontrados: {e}")
         
         # Detectar lectura de archivo
+        elif "leer_archivo(" in code:
+            match = re.search(r'leer_archivo\(\s*[\'"]([^\'"]+)[\'"]', code)
+            if match:
+                self.memory.store_command_result("leer_archivo", {"ruta": match.group(1)})
+
         elif "open(" in code and "read" in code:
             # Extraer ruta del archivo
             match = re.search(r'open\([\'"]([^\'"]+)[\'"]', code)
@@ -1789,30 +7300,16 @@ class Chatbot:
                 file_path = match.group(1)
                 self.memory.store_command_result("crear_archivo", file_path)
     
-    async def get_gpt_response(self, context_prompt: str = "", resolved_command: str = "") -> str:
-        """Obtiene una respuesta de GPT basada en el historial de conversación y el contexto"""
-        if not OPENAI_DISPONIBLE:
+    async def get_gpt_response(self, context_prompt: str = "", resolved_command: str = "",
+                               intencion: Optional[str] = None) -> str:
+        """
+        Obtiene una respuesta de GPT basada en el historial de conversación y el contexto.
+        La intención ya la ha detectado process_command; aquí solo se usa como pista en el prompt.
+        """
+        if self.proveedor_llm is None:
             return "Lo siento, OpenAI no está disponible. No puedo generar respuestas."
             
         try:
-            # Obtener el último comando del usuario
-            ultimo_comando = resolved_command or self.conversation_history[-1]["content"]
-            
-            # Detectar intención y generar código desde plantilla si es posible
-            intencion = self.detectar_intencion(ultimo_comando)
-            if intencion:
-                parametros = self.extraer_parametros(ultimo_comando, intencion)
-                codigo_generado = self.generar_codigo_desde_plantilla(intencion, parametros)
-                
-                if codigo_generado:
-                    # Validar el código generado
-                    valid, error_msg = self.validate_code(codigo_generado)
-                    if valid:
-                        # Generar una respuesta que incluya el código
-                        respuesta = f"He entendido que quieres {intencion.replace('_', ' ')}. Aquí tienes el código:\n\nCODIGO:\n{codigo_generado}"
-                        return respuesta
-            
-            # Si no se pudo generar código desde plantilla, usar GPT
             system_prompt = f"""Eres JARVIS, la IA creada por Tony Stark. Puedes generar código Python para ejecutar comandos del usuario.
             
             IMPORTANTE: Cuando el usuario te pida realizar una acción en el sistema, DEBES responder con 'CODIGO:' seguido del código Python en una nueva línea.
@@ -1822,12 +7319,15 @@ class Chatbot:
             El usuario está ejecutando este programa en un sistema {SISTEMA_OPERATIVO}.
 
 Tienes acceso a las siguientes funciones multiplataforma:
-- abrir_archivo(ruta): Abre un archivo con la aplicación predeterminada
+- abrir_archivo(ruta): Abre un archivo con la aplicación predeterminada (vuelve al momento, sin esperar a que se cierre)
 - obtener_archivo(ruta): Obtiene la ruta absoluta de un archivo
 - obtener_escritorio(): Devuelve la ruta al escritorio
 - obtener_documentos(): Devuelve la ruta a documentos
 - obtener_descargas(): Devuelve la ruta a descargas
-- ejecutar_comando(comando): Ejecuta un comando del sistema de forma segura
+- ejecutar_comando(comando): Ejecuta un comando del sistema de forma segura; muestra la salida en vivo y la devuelve como texto (no hace falta imprimirla)
+- buscar_rutas(patron, ruta_base, profundidad_max=None, max_resultados=None, difusa=False): Busca archivos también en subcarpetas (en paralelo, sin distinguir mayúsculas, admite * y ?) y devuelve las rutas según aparecen; úsala en lugar de os.walk o glob
+- buscar_contenido(texto, ruta_base=".", patron="", max_coincidencias=None, distinguir_mayusculas=False): Busca un texto dentro de los archivos (también en subcarpetas, en paralelo, saltando los binarios) y devuelve tuplas (ruta, número de línea, línea) según aparecen; úsala en lugar de abrir y leer cada archivo
+- leer_archivo(ruta, lineas=None, desde=None, hasta=None, final=False): Lee una parte acotada de un archivo de texto (las primeras líneas, las últimas con final=True o el rango desde-hasta) detectando la codificación y devuelve el texto; úsala en lugar de open().read(), que carga el archivo entero
 
 Tienes acceso a los siguientes módulos y funciones:
 
@@ -1851,7 +7351,7 @@ Tienes acceso a los siguientes módulos y funciones:
 IMPORTANTE SOBRE SEGURIDAD:
 - PUEDES crear y modificar archivos usando open() con modos 'w', 'a', etc.
 - PUEDES crear directorios con os.mkdir o os.makedirs
-- NO PUEDES eliminar archivos o directorios (os.remove, os.unlink, shutil.rmtree están bloqueados)
+- NO PUEDES eliminar archivos o directorios (os.remove, os.unlink, os.rmdir, shutil.rmtree, Path.unlink y los comandos rm/del están bloqueados)
 
 GUÍA PARA GENERAR CÓDIGO ÓPTIMO:
 
@@ -1877,6 +7377,10 @@ Puedo recordar los resultados de comandos anteriores. Si el usuario hace referen
             if context_prompt:
                 system_prompt += f"\n\nCONTEXTO RELEVANTE DE INTERACCIONES PREVIAS:\n{context_prompt}"
             
+            # Añadir la intención detectada localmente como pista
+            if intencion:
+                system_prompt += f"\n\nINTENCIÓN DETECTADA: {intencion}"
+            
             # Añadir información sobre la última operación
             last_op = self.memory.get_last_operation()
             if last_op["type"]:
@@ -1904,18 +7408,22 @@ Puedo recordar los resultados de comandos anteriores. Si el usuario hace referen
                 {"role": "system", "content": system_prompt}
             ]
             
+            # Añadir el resumen de los turnos que ya salieron del historial
+            mensaje_resumen = self.resumidor.mensaje_resumen()
+            if mensaje_resumen:
+                messages.append(mensaje_resumen)
+            
             messages.extend(self.conversation_history)
             
             # Añadir manejo de errores más detallado
             try:
-                response = self.client_openai.chat.completions.create(
+                response_text = await self.proveedor_llm.completar(
+                    self.oyente_fragmentos,
                     model=self.config["modelo_gpt"],
                     messages=messages,
                     max_tokens=self.config["max_tokens"],
                     temperature=self.config["temperatura"]
                 )
-            
-                response_text = response.choices[0].message.content
                 return response_text
             except Exception as e:
                 logger.error(f"Error específico en la solicitud a OpenAI: {e}")
@@ -1931,6 +7439,10 @@ Puedo recordar los resultados de comandos anteriores. Si el usuario hace referen
         """Bucle principal del chatbot."""
         print(f"{self.colores['principal']}¡Bienvenido a JARVIS! Estoy listo para ayudarte.{self.colores['reset']}")
         print(f"{self.colores['secundario']}Escribe 'salir' para terminar o 'config' para abrir el menú de configuración.{self.colores['reset']}")
+        await self.actualizar_voz()
+        # En modo interactivo el índice se prepara desde el principio para la primera búsqueda
+        if self.indice_archivos is not None:
+            self.indice_archivos.iniciar()
         
         while True:
             try:
@@ -1941,6 +7453,7 @@ Puedo recordar los resultados de comandos anteriores. Si el usuario hace referen
                 elif command.lower() in ["config", "configuracion", "configuración", "settings"]:
                     config_menu = ConfigMenu(DEFAULT_CONFIG_PATH)
                     self.config = config_menu.run()
+                    await self.actualizar_voz()
                     continue
                 await self.process_command(command)
             except KeyboardInterrupt:
@@ -1951,12 +7464,1092 @@ Puedo recordar los resultados de comandos anteriores. Si el usuario hace referen
                 print(f"{self.colores['error']}Error: {str(e)}{self.colores['reset']}")
                 traceback.print_exc()
 
+    async def cerrar(self) -> None:
+        """Libera los recursos compartidos (conexiones al modelo, sandbox, etc.)."""
+        if self.proveedor_llm is not None:
+            await self.proveedor_llm.cerrar()
+        if self.voz is not None:
+            await self.voz.cerrar()
+            self.voz = None
+        if self.sandbox_propio:
+            self.sandbox.cerrar()
+        if self.indice_propio:
+            liberar_indice_archivos(self.indice_archivos)
+        if self.buscador_contenido_propio:
+            self.buscador_contenido.cerrar()
+        if self.muestreador_propio:
+            self.muestreador_sistema.detener()
+
+
+# Comandos por defecto para el benchmark del pipeline
+COMANDOS_BENCHMARK = [
+    "buscar archivos con patrón .txt",
+    "¿Qué hora es?",
+    "Cuéntame un chiste",
+    "Dime cuánta memoria RAM estoy usando",
+    "mostrar archivos",
+]
+
+
+async def benchmark_pipeline(chatbot: Chatbot, comandos: List[str],
+                             repeticiones: int = 3) -> Dict[str, float]:
+    """
+    Mide la latencia y el throughput de process_command de punta a punta.
+
+    Args:
+        chatbot: Chatbot a medir (normalmente con el proveedor simulado).
+        comandos: Comandos a procesar en cada repetición.
+        repeticiones: Número de veces que se procesa la lista completa.
+
+    Returns:
+        Diccionario con el número de comandos, throughput y percentiles de latencia.
+    """
+    if chatbot.sandbox is not None:
+        await chatbot.sandbox.preparar()
+    latencias = []
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for comando in comandos:
+            inicio_comando = time.perf_counter()
+            await chatbot.process_command(comando)
+            latencias.append(time.perf_counter() - inicio_comando)
+    total = time.perf_counter() - inicio
+
+    resumen = {
+        "comandos": len(latencias),
+        "throughput": len(latencias) / total if total > 0 else 0.0,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "max_ms": max(latencias) * 1000,
+    }
+    print(
+        f"\nBenchmark del pipeline: {resumen['comandos']} comandos, "
+        f"{resumen['throughput']:.2f} comandos/s, p50 {resumen['p50_ms']:.1f} ms, "
+        f"p95 {resumen['p95_ms']:.1f} ms, máx {resumen['max_ms']:.1f} ms"
+    )
+    return resumen
+
+
+# Comandos de ejemplo por intención para comparar los manejadores nativos con GPT
+# (abrir_pagina_web no se incluye para no abrir el navegador en cada repetición)
+COMANDOS_MANEJADORES = {
+    "leer_archivo": "lee el archivo ejemplo.txt",
+    "copiar_archivo": "copia ejemplo.txt a copia.txt",
+    "mover_archivo": "mueve movible.txt a destino",
+    "renombrar_archivo": "renombra original.txt a renombrado.txt",
+    "crear_directorio": "crea una carpeta llamada nueva",
+    "obtener_info_sistema": "dime cuánta memoria RAM estoy usando",
+    "ejecutar_comando": "ejecuta el comando echo hola",
+    "buscar_contenido": "busca la palabra ejemplo dentro de los archivos",
+}
+
+
+def preparar_directorio_benchmark(directorio: str) -> None:
+    """
+    Deja el directorio de trabajo del benchmark de manejadores en su estado inicial.
+
+    Args:
+        directorio: Directorio temporal del benchmark.
+    """
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        if os.path.isdir(ruta):
+            shutil.rmtree(ruta)
+        else:
+            os.remove(ruta)
+    for nombre in ("ejemplo.txt", "movible.txt", "original.txt"):
+        with open(os.path.join(directorio, nombre), "w", encoding="utf-8") as f:
+            f.write("Contenido de ejemplo\n" * 20)
+    os.mkdir(os.path.join(directorio, "destino"))
+
+
+async def benchmark_manejadores(chatbot: Chatbot, repeticiones: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    Compara, por intención, la latencia de process_command resolviendo con el manejador
+    nativo y con la ruta de GPT (manejadores desactivados). Se trabaja en un directorio
+    temporal que se restaura antes de cada comando.
+
+    Args:
+        chatbot: Chatbot a medir (con el proveedor simulado, la ruta GPT usa sus latencias grabadas).
+        repeticiones: Veces que se mide cada intención en cada modo.
+
+    Returns:
+        Diccionario intención -> {"manejador_ms", "gpt_ms"} con la mediana de cada modo.
+    """
+    resultados = {}
+    directorio_original = os.getcwd()
+    activados = chatbot.config.get("manejadores_nativos", True)
+    with tempfile.TemporaryDirectory() as directorio:
+        os.chdir(directorio)
+        try:
+            for intencion, comando in COMANDOS_MANEJADORES.items():
+                for modo, nativos in (("manejador_ms", True), ("gpt_ms", False)):
+                    chatbot.config["manejadores_nativos"] = nativos
+                    latencias = []
+                    for _ in range(repeticiones):
+                        preparar_directorio_benchmark(directorio)
+                        inicio = time.perf_counter()
+                        with redirect_stdout(io.StringIO()):
+                            await chatbot.process_command(comando)
+                        latencias.append(time.perf_counter() - inicio)
+                    resultados.setdefault(intencion, {})[modo] = percentil(latencias, 50) * 1000
+        finally:
+            os.chdir(directorio_original)
+            chatbot.config["manejadores_nativos"] = activados
+
+    print(f"\n{'Intención':<24}{'Manejador':>12}{'GPT':>12}{'Mejora':>10}")
+    for intencion, tiempos in resultados.items():
+        mejora = tiempos["gpt_ms"] / tiempos["manejador_ms"] if tiempos["manejador_ms"] > 0 else 0.0
+        print(f"{intencion:<24}{tiempos['manejador_ms']:>9.1f} ms{tiempos['gpt_ms']:>9.1f} ms{mejora:>9.0f}x")
+    return resultados
+
+
+# Búsqueda recursiva al estilo del código que genera GPT, para el benchmark de búsqueda
+CODIGO_BUSQUEDA_BENCHMARK = """
+import os
+archivos_encontrados = []
+for raiz, _, archivos in os.walk(ruta_base):
+    for nombre in archivos:
+        if patron in nombre:
+            archivos_encontrados.append(os.path.join(raiz, nombre))
+print(f"🔍 Se encontraron {len(archivos_encontrados)} archivos")
+"""
+
+
+def crear_arbol_benchmark(directorio: str, carpetas: int = 100, archivos_por_carpeta: int = 200) -> int:
+    """
+    Crea un árbol de directorios con archivos vacíos para los benchmarks de búsqueda.
+
+    Args:
+        directorio: Directorio raíz.
+        carpetas: Número de subcarpetas (repartidas en dos niveles).
+        archivos_por_carpeta: Archivos por subcarpeta.
+
+    Returns:
+        El número de archivos creados.
+    """
+    for i in range(carpetas):
+        carpeta = os.path.join(directorio, f"grupo_{i % 10}", f"carpeta_{i}")
+        os.makedirs(carpeta, exist_ok=True)
+        for j in range(archivos_por_carpeta):
+            open(os.path.join(carpeta, f"archivo_{i}_{j}.txt"), "w").close()
+    return carpetas * archivos_por_carpeta
+
+
+async def benchmark_busqueda(chatbot: Chatbot, directorio: Optional[str] = None,
+                             repeticiones: int = 3) -> Dict[str, float]:
+    """
+    Mide el coste de una búsqueda de archivos: ejecución más captura de resultados.
+    La captura ahora es una consulta a las salidas de la ejecución; como referencia se
+    mide también la re-ejecución que hacía antes store_command_results. Además se mide
+    MotorBusqueda con el mismo patrón: tiempo hasta el primer resultado y total.
+
+    Args:
+        chatbot: Chatbot con el que se ejecuta el código.
+        directorio: Árbol en el que buscar; por defecto se crea uno temporal de 20.000 archivos.
+        repeticiones: Número de mediciones (se usa la mediana).
+
+    Returns:
+        Diccionario con las medianas en ms de cada fase y el total antes y ahora.
+    """
+    temporal = None
+    if directorio is None:
+        temporal = tempfile.TemporaryDirectory()
+        directorio = temporal.name
+        print(f"Creados {crear_arbol_benchmark(directorio)} archivos en {directorio}")
+    if chatbot.sandbox is not None:
+        await chatbot.sandbox.preparar()
+
+    variables = {"ruta_base": directorio, "patron": "_7"}
+    fases = {"ejecucion": [], "captura": [], "reejecucion": [], "motor_primero": [], "motor_total": []}
+    motor = MotorBusqueda(dict(chatbot.config.get("busqueda") or {}, max_resultados=0))
+    try:
+        for _ in range(repeticiones):
+            with redirect_stdout(io.StringIO()):
+                inicio = time.perf_counter()
+                resultado = await chatbot.execute_code(CODIGO_BUSQUEDA_BENCHMARK, variables)
+                fases["ejecucion"].append(time.perf_counter() - inicio)
+
+                inicio = time.perf_counter()
+                chatbot.store_command_results(CODIGO_BUSQUEDA_BENCHMARK, resultado)
+                fases["captura"].append(time.perf_counter() - inicio)
+
+                # Referencia: la segunda ejecución completa que se hacía antes para capturar la lista
+                inicio = time.perf_counter()
+                exec(CODIGO_BUSQUEDA_BENCHMARK, crear_espacio_ejecucion(chatbot.safe_environment, variables))
+                fases["reejecucion"].append(time.perf_counter() - inicio)
+
+                inicio = time.perf_counter()
+                encontrados_motor = 0
+                for _ in motor.buscar(variables["patron"], directorio):
+                    if not encontrados_motor:
+                        fases["motor_primero"].append(time.perf_counter() - inicio)
+                    encontrados_motor += 1
+                fases["motor_total"].append(time.perf_counter() - inicio)
+    finally:
+        if temporal is not None:
+            temporal.cleanup()
+
+    # Sin coincidencias no hay tiempo hasta el primer resultado: esa fase se omite
+    resumen = {fase: percentil(tiempos, 50) * 1000 for fase, tiempos in fases.items() if tiempos}
+    resumen["total_antes"] = resumen["ejecucion"] + resumen["reejecucion"]
+    resumen["total_ahora"] = resumen["ejecucion"] + resumen["captura"]
+    encontrados = len(chatbot.memory.get_command_result("buscar_archivos") or [])
+    print(f"\nBenchmark de búsqueda ({encontrados} archivos encontrados): ejecución {resumen['ejecucion']:.1f} ms, "
+          f"captura {resumen['captura']:.2f} ms (antes, re-ejecución {resumen['reejecucion']:.1f} ms)")
+    print(f"Total por búsqueda: {resumen['total_ahora']:.1f} ms (antes {resumen['total_antes']:.1f} ms)")
+    if fases["motor_primero"]:
+        print(f"MotorBusqueda ({motor.hilos} hilos, {encontrados_motor} archivos): primer resultado "
+              f"{resumen['motor_primero']:.1f} ms, total {resumen['motor_total']:.1f} ms")
+    else:
+        print(f"MotorBusqueda ({motor.hilos} hilos): ningún archivo coincide, total {resumen['motor_total']:.1f} ms")
+    return resumen
+
+
+def benchmark_indice(config: Dict[str, Any], directorio: Optional[str] = None,
+                     repeticiones: int = 3) -> Dict[str, float]:
+    """
+    Mide el índice de archivos: construcción completa, refresco sin cambios, refresco tras
+    cambiar un directorio y latencia de consulta frente a recorrer el árbol con MotorBusqueda.
+
+    Args:
+        config: Configuración (secciones "busqueda" e "indice_archivos").
+        directorio: Árbol a indexar; por defecto se crea uno temporal de 200.000 archivos.
+        repeticiones: Número de mediciones (se usa la mediana).
+
+    Returns:
+        Diccionario con las medianas en ms de cada fase.
+    """
+    temporal = tempfile.TemporaryDirectory()
+    if directorio is None:
+        directorio = os.path.join(temporal.name, "arbol")
+        print(f"Creados {crear_arbol_benchmark(directorio, carpetas=1000)} archivos en {directorio}")
+    opciones_busqueda = dict(config.get("busqueda") or {}, max_resultados=0)
+    opciones_indice = dict(config.get("indice_archivos") or {},
+                           archivo=os.path.join(temporal.name, "indice.json.gz"), raices=[directorio])
+    motor = MotorBusqueda(opciones_busqueda)
+    fases = {"construccion": [], "refresco_sin_cambios": [], "refresco_un_cambio": [],
+             "consulta": [], "motor": []}
+    patron = "_7"
+    try:
+        for repeticion in range(repeticiones):
+            indice = IndiceArchivos(opciones_indice, opciones_busqueda.get("ignorar"))
+            indice.raices = [os.path.abspath(directorio)]
+            inicio = time.perf_counter()
+            indice.refrescar()
+            fases["construccion"].append(time.perf_counter() - inicio)
+
+            inicio = time.perf_counter()
+            indice.refrescar()
+            fases["refresco_sin_cambios"].append(time.perf_counter() - inicio)
+
+            # Un archivo nuevo cambia el mtime de un único directorio
+            nuevo = os.path.join(directorio, f"nuevo_{repeticion}.txt")
+            open(nuevo, "w").close()
+            inicio = time.perf_counter()
+            releidos = indice.refrescar()
+            fases["refresco_un_cambio"].append(time.perf_counter() - inicio)
+
+            # La consulta incluye la comprobación de mtime de los directorios consultados
+            inicio = time.perf_counter()
+            encontrados = len(indice.consultar(patron, directorio, max_resultados=0))
+            fases["consulta"].append(time.perf_counter() - inicio)
+            os.remove(nuevo)
+
+            inicio = time.perf_counter()
+            encontrados_motor = sum(1 for _ in motor.buscar(patron, directorio))
+            fases["motor"].append(time.perf_counter() - inicio)
+    finally:
+        temporal.cleanup()
+
+    resumen = {fase: percentil(tiempos, 50) * 1000 for fase, tiempos in fases.items()}
+    print(f"\nÍndice de archivos ({indice.total} archivos, {len(indice.directorios)} directorios): "
+          f"construcción {resumen['construccion']:.0f} ms, refresco sin cambios "
+          f"{resumen['refresco_sin_cambios']:.0f} ms, refresco con un cambio "
+          f"{resumen['refresco_un_cambio']:.0f} ms ({releidos} directorios releídos)")
+    print(f"Consulta '{patron}' ({encontrados} archivos): índice {resumen['consulta']:.1f} ms, "
+          f"MotorBusqueda {resumen['motor']:.1f} ms ({encontrados_motor} archivos)")
+    return resumen
+
+
+# Frases con las que se componen las respuestas del benchmark de voz
+FRASES_BENCHMARK_VOZ = [
+    "El uso de CPU es del {n} por ciento.",
+    "He encontrado {n} archivos que coinciden con la búsqueda en la carpeta de documentos.",
+    "La memoria disponible es suficiente para seguir trabajando sin problemas.",
+    "Puedo abrir cualquiera de ellos si me dices cuál, por ejemplo el número {n}.",
+]
+
+
+async def benchmark_voz(config: Dict[str, Any], repeticiones: int = 3) -> Dict[int, Dict[str, float]]:
+    """
+    Mide el tiempo hasta el primer audio de CanalVoz con el motor local según la longitud
+    de la respuesta, frente a sintetizar la respuesta entera antes de reproducirla, y el
+    tiempo que tarda en parar una respuesta larga al interrumpirla.
+
+    Args:
+        config: Configuración (sección "voz"; las latencias del motor local se aceleran para
+            que el benchmark dure poco).
+        repeticiones: Número de mediciones por longitud (se usa la mediana).
+
+    Returns:
+        Diccionario por número de frases con las medianas en ms.
+    """
+    opciones = dict(config.get("voz") or {})
+    opciones["local"] = {"latencia_base": 0.03, "latencia_por_caracter": 0.0005, "segundos_por_caracter": 0.002}
+    motor = MotorVozLocal(opciones)
+    canal = CanalVoz(motor, ReproductorAudio(motor.frecuencia, simulado=True), opciones)
+    resultados = {}
+    print(f"\n{'Frases':>6}  {'Caracteres':>10}  {'Primer audio':>12}  {'Sin canalizar':>13}  {'Total':>9}")
+    try:
+        for cantidad in (1, 4, 16, 32):
+            texto = " ".join(FRASES_BENCHMARK_VOZ[i % len(FRASES_BENCHMARK_VOZ)].format(n=i + 2)
+                             for i in range(cantidad))
+            primer_audio, sin_canalizar, total = [], [], []
+            for _ in range(repeticiones):
+                medicion = await canal.decir(texto)
+                primer_audio.append(medicion["primer_audio_ms"])
+                total.append(medicion["total_ms"])
+                # Sin canalización el primer audio llega cuando termina de sintetizarse todo
+                inicio = time.perf_counter()
+                for frase in dividir_frases(texto, canal.max_caracteres_frase):
+                    await motor.sintetizar(frase)
+                sin_canalizar.append((time.perf_counter() - inicio) * 1000)
+            resultados[cantidad] = {"primer_audio": percentil(primer_audio, 50),
+                                    "sin_canalizar": percentil(sin_canalizar, 50),
+                                    "total": percentil(total, 50)}
+            print(f"{cantidad:>6}  {len(texto):>10}  {resultados[cantidad]['primer_audio']:>9.0f} ms  "
+                  f"{resultados[cantidad]['sin_canalizar']:>10.0f} ms  {resultados[cantidad]['total']:>6.0f} ms")
+
+        # Interrupción a mitad de una respuesta larga
+        tarea = asyncio.create_task(canal.decir(texto))
+        while canal.tarea_sintesis is None:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        sintetizadas = motor.sintetizadas
+        inicio = time.perf_counter()
+        canal.interrumpir()
+        medicion = await tarea
+        print(f"\nInterrupción: paró en {(time.perf_counter() - inicio) * 1000:.0f} ms tras "
+              f"{medicion['reproducidas']}/{medicion['frases']} frases; "
+              f"{motor.sintetizadas - sintetizadas} frases sintetizadas después de interrumpir")
+    finally:
+        await canal.cerrar()
+    return resultados
+
+
+def es_direccion_local(host: str) -> bool:
+    """
+    Indica si una dirección de escucha solo es accesible desde esta máquina.
+
+    Args:
+        host: Dirección o nombre de host.
+
+    Returns:
+        True si es "localhost" o una dirección de loopback.
+    """
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ServidorJarvis:
+    """
+    Servidor HTTP/WebSocket que expone process_command como servicio compartido.
+    Cada sesión tiene su propio Chatbot (historial y memoria a corto plazo), todos en
+    el mismo bucle de eventos; el proveedor de modelo y el índice vectorial se
+    inicializan una sola vez en el chatbot base y se comparten entre sesiones.
+
+    Como los comandos pueden ejecutar código y órdenes de shell, todas las rutas exigen
+    un token (cabecera "Authorization: Bearer <token>" o parámetro "token") y el servidor
+    solo escucha en direcciones locales salvo que se permita expresamente.
+    """
+
+    def __init__(self, base: Chatbot, config: Optional[Dict[str, Any]] = None):
+        """
+        Inicializa el servidor.
+
+        Args:
+            base: Chatbot cuyos recursos compartidos usan todas las sesiones.
+            config: Sección "servidor" de la configuración.
+        """
+        config = config or {}
+        self.base = base
+        self.max_concurrencia = int(config.get("max_concurrencia", 8))
+        self.max_sesiones = int(config.get("max_sesiones", 100))
+        self.inactividad_sesion = float(config.get("inactividad_sesion", 900))
+        self.permitir_remoto = bool(config.get("permitir_remoto", False))
+        # Sin token configurado se genera uno para esta ejecución
+        self.token = str(config.get("token") or secrets.token_urlsafe(24))
+        self.semaforo = asyncio.Semaphore(self.max_concurrencia)
+        self.sesiones = {}
+        self.en_curso = 0
+        self.tarea_purga = None
+
+    def crear_sesion(self) -> Optional[str]:
+        """
+        Crea una sesión nueva, expulsando la más antigua inactiva si se alcanzó el límite.
+
+        Returns:
+            El identificador de la sesión, o None si no hay hueco.
+        """
+        if len(self.sesiones) >= self.max_sesiones:
+            libres = [(datos["ultimo_uso"], sesion_id) for sesion_id, datos in self.sesiones.items()
+                      if not datos["lock"].locked()]
+            if not libres:
+                return None
+            _, expulsada = min(libres)
+            self.eliminar_sesion(expulsada)
+            logger.info(f"Sesión {expulsada} expulsada por límite de sesiones")
+
+        sesion_id = uuid.uuid4().hex
+        self.sesiones[sesion_id] = {
+            "chatbot": self.base.crear_sesion(sesion_id),
+            "lock": asyncio.Lock(),
+            "ultimo_uso": time.monotonic(),
+        }
+        logger.info(f"Sesión creada: {sesion_id}")
+        return sesion_id
+
+    def eliminar_sesion(self, sesion_id: str) -> bool:
+        """
+        Elimina una sesión.
+
+        Args:
+            sesion_id: Identificador de la sesión.
+
+        Returns:
+            True si la sesión existía.
+        """
+        sesion = self.sesiones.pop(sesion_id, None)
+        if sesion is None:
+            return False
+        sesion["chatbot"].memory.olvidar_sesion()
+        return True
+
+    async def purgar_sesiones_inactivas(self) -> None:
+        """Elimina periódicamente las sesiones que llevan demasiado tiempo sin usarse."""
+        while True:
+            await asyncio.sleep(max(1.0, self.inactividad_sesion / 4))
+            limite = time.monotonic() - self.inactividad_sesion
+            inactivas = [sesion_id for sesion_id, datos in self.sesiones.items()
+                         if datos["ultimo_uso"] < limite and not datos["lock"].locked()]
+            for sesion_id in inactivas:
+                self.eliminar_sesion(sesion_id)
+            if inactivas:
+                logger.info(f"Eliminadas {len(inactivas)} sesiones inactivas")
+
+    async def ejecutar_comando(self, sesion_id: str, comando: str,
+                               enviar: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """
+        Ejecuta un comando en una sesión, enviando la salida según se produce.
+
+        Args:
+            sesion_id: Identificador de la sesión.
+            comando: Comando del usuario.
+            enviar: Función asíncrona que recibe cada evento de salida.
+        """
+        sesion = self.sesiones[sesion_id]
+        chatbot = sesion["chatbot"]
+
+        async def al_fragmento(texto: str) -> None:
+            await enviar({"tipo": "fragmento", "texto": texto})
+
+        async def al_hablar(texto: str) -> None:
+            await enviar({"tipo": "mensaje", "texto": texto})
+
+        # Un comando a la vez por sesión; el semáforo limita el total del servidor
+        async with sesion["lock"], self.semaforo:
+            self.en_curso += 1
+            sesion["ultimo_uso"] = time.monotonic()
+            chatbot.oyente_fragmentos = al_fragmento
+            chatbot.oyente_salida = al_hablar
+            inicio = time.perf_counter()
+            try:
+                while chatbot.avisos_pendientes:
+                    await enviar({"tipo": "aviso", "texto": chatbot.avisos_pendientes.popleft()})
+                await chatbot.process_command(comando)
+                await enviar({
+                    "tipo": "fin",
+                    "intencion": chatbot.ultima_intencion,
+                    "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 2),
+                })
+            except Exception as e:
+                logger.error(f"Error en la sesión {sesion_id}: {e}")
+                await enviar({"tipo": "error", "error": str(e)})
+            finally:
+                chatbot.oyente_fragmentos = None
+                chatbot.oyente_salida = None
+                sesion["ultimo_uso"] = time.monotonic()
+                self.en_curso -= 1
+
+    def autorizado(self, request: "web.Request") -> bool:
+        """
+        Comprueba el token de una petición.
+
+        Args:
+            request: Petición recibida.
+
+        Returns:
+            True si la petición trae el token del servidor.
+        """
+        cabecera = request.headers.get("Authorization", "")
+        token = cabecera[len("Bearer "):] if cabecera.startswith("Bearer ") else request.query.get("token", "")
+        return hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    async def manejar_crear_sesion(self, request: "web.Request") -> "web.Response":
+        sesion_id = self.crear_sesion()
+        if sesion_id is None:
+            return web.json_response({"error": "Límite de sesiones alcanzado"}, status=503)
+        return web.json_response({"sesion": sesion_id}, status=201)
+
+    async def manejar_eliminar_sesion(self, request: "web.Request") -> "web.Response":
+        if not self.eliminar_sesion(request.match_info["sesion"]):
+            return web.json_response({"error": "Sesión no encontrada"}, status=404)
+        return web.json_response({"ok": True})
+
+    async def manejar_comando(self, request: "web.Request") -> "web.StreamResponse":
+        """Ejecuta un comando y devuelve la salida como NDJSON en streaming."""
+        sesion_id = request.match_info["sesion"]
+        if sesion_id not in self.sesiones:
+            return web.json_response({"error": "Sesión no encontrada"}, status=404)
+        try:
+            datos = await request.json()
+            comando = str(datos["comando"])
+        except Exception:
+            return web.json_response({"error": "Se esperaba un JSON con 'comando'"}, status=400)
+
+        respuesta = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await respuesta.prepare(request)
+
+        async def enviar(evento: Dict[str, Any]) -> None:
+            await respuesta.write((json.dumps(evento, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+
+        await self.ejecutar_comando(sesion_id, comando, enviar)
+        await respuesta.write_eof()
+        return respuesta
+
+    async def manejar_websocket(self, request: "web.Request") -> "web.WebSocketResponse":
+        """
+        Canal WebSocket de una sesión. Cada mensaje recibido (texto o JSON con
+        "comando") se ejecuta y su salida se envía como eventos JSON.
+        """
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        sesion_id = request.query.get("sesion")
+        if sesion_id not in self.sesiones:
+            sesion_id = self.crear_sesion()
+            if sesion_id is None:
+                await ws.send_json({"tipo": "error", "error": "Límite de sesiones alcanzado"})
+                await ws.close()
+                return ws
+        await ws.send_json({"tipo": "sesion", "sesion": sesion_id})
+
+        async for mensaje in ws:
+            if mensaje.type != aiohttp.WSMsgType.TEXT:
+                continue
+            comando = mensaje.data
+            try:
+                datos = json.loads(comando)
+                if isinstance(datos, dict):
+                    comando = str(datos.get("comando", ""))
+            except json.JSONDecodeError:
+                pass
+            if sesion_id not in self.sesiones:
+                await ws.send_json({"tipo": "error", "error": "La sesión ha expirado"})
+                break
+            await self.ejecutar_comando(sesion_id, comando, ws.send_json)
+        return ws
+
+    async def manejar_estado(self, request: "web.Request") -> "web.Response":
+        return web.json_response({
+            "sesiones": len(self.sesiones),
+            "en_curso": self.en_curso,
+            "max_concurrencia": self.max_concurrencia,
+            "max_sesiones": self.max_sesiones,
+        })
+
+    def crear_app(self) -> "web.Application":
+        """
+        Crea la aplicación aiohttp con todas las rutas.
+
+        Returns:
+            La aplicación.
+        """
+        @web.middleware
+        async def autenticar(request: "web.Request", handler) -> "web.StreamResponse":
+            if not self.autorizado(request):
+                return web.json_response({"error": "Token no válido"}, status=401)
+            return await handler(request)
+
+        app = web.Application(middlewares=[autenticar])
+        app.router.add_post("/sesiones", self.manejar_crear_sesion)
+        app.router.add_delete("/sesiones/{sesion}", self.manejar_eliminar_sesion)
+        app.router.add_post("/sesiones/{sesion}/comandos", self.manejar_comando)
+        app.router.add_get("/ws", self.manejar_websocket)
+        app.router.add_get("/estado", self.manejar_estado)
+        return app
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 8080) -> "web.AppRunner":
+        """
+        Arranca el servidor en el bucle de eventos actual.
+
+        Args:
+            host: Dirección en la que escuchar.
+            puerto: Puerto en el que escuchar (0 para uno libre).
+
+        Returns:
+            El runner de aiohttp, para poder detenerlo con cleanup().
+
+        Raises:
+            ValueError: Si la dirección no es local y no se ha permitido el acceso remoto.
+        """
+        if not self.permitir_remoto and not es_direccion_local(host):
+            raise ValueError(f"El servidor solo escucha en direcciones locales; {host} necesita "
+                             f"--permitir-remoto (o servidor.permitir_remoto en la configuración)")
+        runner = web.AppRunner(self.crear_app())
+        await runner.setup()
+        sitio = web.TCPSite(runner, host, puerto)
+        await sitio.start()
+        self.tarea_purga = asyncio.create_task(self.purgar_sesiones_inactivas())
+        self.puerto = runner.addresses[0][1]
+        logger.info(f"Servidor JARVIS escuchando en http://{host}:{self.puerto}")
+        return runner
+
+    async def detener(self, runner: "web.AppRunner") -> None:
+        """
+        Detiene el servidor.
+
+        Args:
+            runner: Runner devuelto por iniciar().
+        """
+        if self.tarea_purga is not None:
+            self.tarea_purga.cancel()
+            await asyncio.gather(self.tarea_purga, return_exceptions=True)
+        await runner.cleanup()
+
+
+async def prueba_carga(url: str, usuarios: int = 10, comandos_por_usuario: int = 5,
+                       comandos: Optional[List[str]] = None, token: Optional[str] = None) -> Dict[str, float]:
+    """
+    Prueba de carga contra un ServidorJarvis: cada usuario virtual abre una sesión
+    y envía sus comandos uno tras otro, todos los usuarios a la vez.
+
+    Args:
+        url: URL base del servidor (por ejemplo http://127.0.0.1:8080).
+        usuarios: Número de usuarios concurrentes.
+        comandos_por_usuario: Comandos que envía cada usuario.
+        comandos: Comandos a usar (por defecto COMANDOS_BENCHMARK).
+        token: Token de acceso del servidor.
+
+    Returns:
+        Resumen con peticiones, errores, throughput y percentiles de latencia.
+    """
+    comandos = comandos or COMANDOS_BENCHMARK
+    latencias = []
+    primeros_eventos = []
+    errores = 0
+
+    async def usuario(cliente: "aiohttp.ClientSession", numero: int) -> None:
+        nonlocal errores
+        async with cliente.post(f"{url}/sesiones") as respuesta:
+            if respuesta.status != 201:
+                errores += comandos_por_usuario
+                return
+            sesion_id = (await respuesta.json())["sesion"]
+        for i in range(comandos_por_usuario):
+            comando = comandos[(numero + i) % len(comandos)]
+            inicio = time.perf_counter()
+            primer_evento = None
+            try:
+                async with cliente.post(f"{url}/sesiones/{sesion_id}/comandos",
+                                        json={"comando": comando}) as respuesta:
+                    async for linea in respuesta.content:
+                        if primer_evento is None:
+                            primer_evento = time.perf_counter() - inicio
+                        if json.loads(linea).get("tipo") == "error":
+                            errores += 1
+            except Exception as e:
+                logger.error(f"Error en la prueba de carga: {e}")
+                errores += 1
+                continue
+            latencias.append(time.perf_counter() - inicio)
+            if primer_evento is not None:
+                primeros_eventos.append(primer_evento)
+        async with cliente.delete(f"{url}/sesiones/{sesion_id}"):
+            pass
+
+    inicio = time.perf_counter()
+    limite = aiohttp.TCPConnector(limit=usuarios)
+    cabeceras = {"Authorization": f"Bearer {token}"} if token else None
+    async with aiohttp.ClientSession(connector=limite, headers=cabeceras) as cliente:
+        await asyncio.gather(*(usuario(cliente, n) for n in range(usuarios)))
+    total = time.perf_counter() - inicio
+
+    resumen = {"peticiones": len(latencias), "errores": errores,
+               "throughput": len(latencias) / total if total > 0 else 0.0}
+    if latencias:
+        resumen.update({
+            "p50_ms": percentil(latencias, 50) * 1000,
+            "p95_ms": percentil(latencias, 95) * 1000,
+            "primer_evento_p50_ms": percentil(primeros_eventos, 50) * 1000 if primeros_eventos else 0.0,
+        })
+    return resumen
+
+
+def imprimir_resumen_carga(resumen: Dict[str, float], usuarios: int) -> None:
+    """
+    Muestra el resumen de una prueba de carga.
+
+    Args:
+        resumen: Resumen devuelto por prueba_carga.
+        usuarios: Número de usuarios concurrentes usados.
+    """
+    linea = (f"\nPrueba de carga: {usuarios} usuarios, {resumen['peticiones']} peticiones, "
+             f"{resumen['errores']} errores, {resumen['throughput']:.2f} peticiones/s")
+    if resumen["peticiones"]:
+        linea += (f", p50 {resumen['p50_ms']:.1f} ms, p95 {resumen['p95_ms']:.1f} ms, "
+                  f"primer evento p50 {resumen['primer_evento_p50_ms']:.1f} ms")
+    print(linea)
+
+
+def leer_items_batch(lineas) -> List[Dict[str, Any]]:
+    """
+    Convierte las líneas de entrada del modo batch en elementos a procesar.
+    Cada línea puede ser un objeto JSON (con "comando", "command" o "body" y un
+    "id" o "request_id" opcional) o simplemente el texto del comando.
+
+    Args:
+        lineas: Líneas de entrada.
+
+    Returns:
+        Lista de elementos con "id" y "comando".
+    """
+    items = []
+    for numero, linea in enumerate(lineas, 1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            datos = json.loads(linea)
+        except json.JSONDecodeError:
+            datos = linea
+        if not isinstance(datos, dict):
+            items.append({"id": numero, "comando": str(datos)})
+            continue
+        comando = next((datos[clave] for clave in ("comando", "command", "body") if datos.get(clave)), None)
+        if comando is None:
+            logger.warning(f"Línea {numero} sin comando, se ignora")
+            continue
+        items.append({"id": datos.get("id", datos.get("request_id", numero)), "comando": comando})
+    return items
+
+
+async def procesar_item_batch(base: Chatbot, item: Dict[str, Any],
+                              timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Procesa un elemento del modo batch en una sesión aislada.
+
+    Args:
+        base: Chatbot del que se comparten configuración y proveedor.
+        item: Elemento con "id" y "comando".
+        timeout: Tiempo máximo en segundos para el elemento.
+
+    Returns:
+        Resultado estructurado con respuestas, intención, error y tiempos.
+    """
+    sesion = base.crear_sesion()
+    sesion.transcripcion = []
+    error = None
+    inicio = time.perf_counter()
+    try:
+        await asyncio.wait_for(sesion.process_command(item["comando"]), timeout)
+    except asyncio.TimeoutError:
+        error = f"Tiempo máximo de {timeout} segundos agotado"
+    except Exception as e:
+        logger.error(f"Error al procesar el elemento {item['id']}: {e}")
+        error = str(e)
+    finally:
+        sesion.memory.olvidar_sesion()
+    return {
+        "id": item["id"],
+        "comando": item["comando"],
+        "ok": error is None,
+        "error": error,
+        "intencion": sesion.ultima_intencion,
+        "respuestas": sesion.transcripcion,
+        "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 2),
+        "etapas": {nombre: round(ms, 2) for nombre, ms in sesion.ultimos_tiempos.resumen().items()}
+                  if sesion.ultimos_tiempos else {},
+    }
+
+
+async def ejecutar_batch(base: Chatbot, items: List[Dict[str, Any]], salida,
+                         concurrencia: int = 4, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Procesa elementos sin interacción, con concurrencia limitada, escribiendo
+    cada resultado como una línea JSON en cuanto termina.
+
+    Args:
+        base: Chatbot del que se comparten configuración y proveedor.
+        items: Elementos a procesar.
+        salida: Archivo de texto donde escribir los resultados (JSONL).
+        concurrencia: Número máximo de elementos en proceso a la vez.
+        timeout: Tiempo máximo en segundos por elemento.
+
+    Returns:
+        Resumen con el total de elementos, los correctos y el throughput.
+    """
+    cola = asyncio.Queue()
+    for item in items:
+        cola.put_nowait(item)
+    correctos = 0
+
+    async def trabajador():
+        nonlocal correctos
+        while True:
+            try:
+                item = cola.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            resultado = await procesar_item_batch(base, item, timeout)
+            correctos += resultado["ok"]
+            salida.write(json.dumps(resultado, ensure_ascii=False, default=str) + "\n")
+            salida.flush()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(max(1, concurrencia))))
+    total = time.perf_counter() - inicio
+
+    resumen = {
+        "elementos": len(items),
+        "correctos": correctos,
+        "segundos": round(total, 3),
+        "throughput": round(len(items) / total, 2) if total > 0 else 0.0,
+    }
+    logger.info(f"Batch terminado: {correctos}/{len(items)} correctos en {total:.2f} segundos "
+                f"({resumen['throughput']} elementos/s)")
+    return resumen
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Analiza los argumentos de la línea de comandos.
+
+    Args:
+        argv: Argumentos a analizar; por defecto los del proceso.
+
+    Returns:
+        Los argumentos analizados.
+    """
+    parser = argparse.ArgumentParser(description="JARVIS - Asistente virtual")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH,
+                        help="Ruta al archivo de configuración")
+    parser.add_argument("--proveedor", choices=["openai", "mock"],
+                        help="Proveedor de modelo de lenguaje (sobrescribe la configuración)")
+    parser.add_argument("--grabaciones", metavar="ARCHIVO",
+                        help="Respuestas grabadas (JSONL) para el proveedor simulado")
+    modos = parser.add_mutually_exclusive_group()
+    modos.add_argument("--mock-servidor", type=int, metavar="PUERTO",
+                       help="Arranca un servidor local que imita la API de OpenAI")
+    modos.add_argument("--benchmark", nargs="?", const="", metavar="ARCHIVO",
+                       help="Mide process_command con los comandos del archivo (uno por línea)")
+    modos.add_argument("--benchmark-manejadores", action="store_true",
+                       help="Compara por intención la latencia de los manejadores nativos con la ruta GPT")
+    modos.add_argument("--benchmark-busqueda", nargs="?", const="", metavar="DIRECTORIO",
+                       help="Mide una búsqueda de archivos (sin directorio, crea un árbol temporal)")
+    modos.add_argument("--benchmark-indice", nargs="?", const="", metavar="DIRECTORIO",
+                       help="Mide el índice de archivos: construcción, refresco y consultas")
+    modos.add_argument("--benchmark-voz", action="store_true",
+                       help="Mide el tiempo hasta el primer audio de la voz según la longitud de la respuesta")
+    modos.add_argument("--batch", metavar="ARCHIVO",
+                       help="Procesa sin interacción los comandos del archivo (JSONL o texto; '-' para stdin)")
+    modos.add_argument("--evaluar-intenciones", action="store_true",
+                       help="Mide la precisión y el coste de la detección de intenciones")
+    modos.add_argument("--cobertura", action="store_true",
+                       help="Informe de extracción de parámetros y comandos servidos sin GPT")
+    modos.add_argument("--entrenar-intenciones", nargs="?", const="", metavar="MEMORIA",
+                       help="Entrena el clasificador de intenciones con la memoria (por defecto ~/jarvis_memory.json)")
+    modos.add_argument("--recursos", nargs="?", const="", metavar="MEMORIA",
+                       help="Consumo de recursos por intención guardado en la memoria (por defecto ~/jarvis_memory.json)")
+    modos.add_argument("--servidor", action="store_true",
+                       help="Expone JARVIS por HTTP y WebSocket")
+    modos.add_argument("--prueba-carga", nargs="?", const="", metavar="URL",
+                       help="Prueba de carga contra un servidor (sin URL, arranca uno local con el proveedor simulado)")
+    parser.add_argument("--repeticiones", type=int, default=3,
+                        help="Repeticiones del benchmark")
+    parser.add_argument("--salida", default="-", metavar="ARCHIVO",
+                        help="Archivo JSONL de resultados del modo batch ('-' para stdout)")
+    parser.add_argument("--concurrencia", type=int, default=4,
+                        help="Elementos procesados a la vez en el modo batch")
+    parser.add_argument("--timeout-item", type=float, default=None, metavar="SEGUNDOS",
+                        help="Tiempo máximo por elemento en el modo batch")
+    parser.add_argument("--host", help="Dirección del servidor (sobrescribe la configuración)")
+    parser.add_argument("--puerto", type=int, help="Puerto del servidor (sobrescribe la configuración)")
+    parser.add_argument("--token", help="Token de acceso del servidor (por defecto se genera uno)")
+    parser.add_argument("--permitir-remoto", action="store_true",
+                        help="Permite que el servidor escuche en direcciones no locales")
+    parser.add_argument("--usuarios", type=int, default=10,
+                        help="Usuarios concurrentes de la prueba de carga")
+    parser.add_argument("--comandos-por-usuario", type=int, default=5,
+                        help="Comandos que envía cada usuario en la prueba de carga")
+    return parser.parse_args(argv)
+
 
 # Función para ejecutar el chatbot
-async def main():
+async def main(argv: Optional[List[str]] = None):
     """Función principal para ejecutar el chatbot."""
-    chatbot = Chatbot()
-    await chatbot.main_loop()
+    args = parse_args(argv)
+
+    if args.evaluar_intenciones:
+        evaluar_intenciones()
+        return
+
+    if args.recursos is not None:
+        informe_recursos(args.recursos or os.path.join(os.path.expanduser("~"), "jarvis_memory.json"))
+        return
+
+    if args.cobertura or args.entrenar_intenciones is not None:
+        opciones = ConfigMenu(args.config).load_config()
+        umbral = (opciones.get("clasificador_intenciones") or {}).get("umbral", 0.8)
+        if args.cobertura:
+            evaluar_cobertura(clasificador=obtener_clasificador(ruta_modelo_intenciones(opciones)), umbral=umbral)
+        else:
+            memoria = args.entrenar_intenciones or os.path.join(os.path.expanduser("~"), "jarvis_memory.json")
+            entrenar_clasificador_intenciones(memoria, ruta_modelo_intenciones(opciones), umbral)
+        return
+
+    config = None
+    if (args.proveedor or args.grabaciones or args.mock_servidor is not None
+            or args.benchmark is not None or args.benchmark_manejadores
+            or args.benchmark_busqueda is not None or args.benchmark_indice is not None
+            or args.benchmark_voz or args.batch or args.servidor
+            or args.prueba_carga is not None):
+        config = ConfigMenu(args.config).config
+        if args.prueba_carga == "":
+            config["proveedor_llm"] = "mock"
+        if args.proveedor:
+            config["proveedor_llm"] = args.proveedor
+        if args.grabaciones:
+            config["mock_llm"] = dict(config.get("mock_llm") or {}, grabaciones=args.grabaciones)
+
+    if args.mock_servidor is not None:
+        servidor = ServidorMockLLM(ProveedorMock(config.get("mock_llm")), puerto=args.mock_servidor)
+        servidor.iniciar()
+        print(f"Servidor LLM simulado en {servidor.url} (Ctrl+C para salir)")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            servidor.detener()
+        return
+
+    if args.benchmark is not None:
+        comandos = COMANDOS_BENCHMARK
+        if args.benchmark:
+            with open(args.benchmark, "r", encoding="utf-8") as f:
+                comandos = [linea.strip() for linea in f if linea.strip()]
+        chatbot = Chatbot(config=config, memory=JarvisMemory(usar_chromadb=False, persistente=False))
+        try:
+            await benchmark_pipeline(chatbot, comandos, args.repeticiones)
+        finally:
+            await chatbot.cerrar()
+        return
+
+    if args.benchmark_manejadores:
+        chatbot = Chatbot(config=config, memory=JarvisMemory(usar_chromadb=False, persistente=False))
+        try:
+            await benchmark_manejadores(chatbot, args.repeticiones)
+        finally:
+            await chatbot.cerrar()
+        return
+
+    if args.benchmark_busqueda is not None:
+        chatbot = Chatbot(config=config, memory=JarvisMemory(usar_chromadb=False, persistente=False))
+        try:
+            await benchmark_busqueda(chatbot, args.benchmark_busqueda or None, args.repeticiones)
+        finally:
+            await chatbot.cerrar()
+        return
+
+    if args.benchmark_indice is not None:
+        await asyncio.to_thread(benchmark_indice, config, args.benchmark_indice or None, args.repeticiones)
+        return
+
+    if args.benchmark_voz:
+        await benchmark_voz(config, args.repeticiones)
+        return
+
+    if args.batch:
+        if args.batch == "-":
+            items = leer_items_batch(sys.stdin)
+        else:
+            with open(args.batch, "r", encoding="utf-8") as f:
+                items = leer_items_batch(f)
+        salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8")
+        base = Chatbot(config=config, memory=JarvisMemory(usar_chromadb=False, persistente=False))
+        try:
+            # Todo lo que imprima el chatbot va a stderr para no mezclarse con los resultados
+            with redirect_stdout(sys.stderr):
+                await ejecutar_batch(base, items, salida, args.concurrencia, args.timeout_item)
+        finally:
+            await base.cerrar()
+            if salida is not sys.stdout:
+                salida.close()
+        return
+
+    if args.servidor or args.prueba_carga is not None:
+        if not AIOHTTP_DISPONIBLE:
+            print("El modo servidor necesita aiohttp: pip install aiohttp")
+            return
+        if args.prueba_carga:
+            resumen = await prueba_carga(args.prueba_carga.rstrip("/"), args.usuarios,
+                                         args.comandos_por_usuario, token=args.token)
+            imprimir_resumen_carga(resumen, args.usuarios)
+            return
+
+        config_servidor = dict(config.get("servidor") or {})
+        if args.token:
+            config_servidor["token"] = args.token
+        if args.permitir_remoto:
+            config_servidor["permitir_remoto"] = True
+        host = args.host or config_servidor.get("host", "127.0.0.1")
+        puerto = args.puerto if args.puerto is not None else config_servidor.get("puerto", 8080)
+        if args.prueba_carga is not None and args.puerto is None:
+            puerto = 0
+        base = Chatbot(config=config)
+        servidor = ServidorJarvis(base, config_servidor)
+        try:
+            runner = await servidor.iniciar(host, puerto)
+        except ValueError as e:
+            print(e)
+            await base.cerrar()
+            return
+        try:
+            if args.prueba_carga is not None:
+                # La salida de las sesiones va a stderr para que el resumen quede limpio
+                with redirect_stdout(sys.stderr):
+                    resumen = await prueba_carga(f"http://{host}:{servidor.puerto}", args.usuarios,
+                                                 args.comandos_por_usuario, token=servidor.token)
+                imprimir_resumen_carga(resumen, args.usuarios)
+            else:
+                print(f"Servidor JARVIS en http://{host}:{servidor.puerto} (Ctrl+C para salir)")
+                if not config_servidor.get("token"):
+                    print(f"Token de acceso: {servidor.token}")
+                await asyncio.Event().wait()
+        finally:
+            await servidor.detener(runner)
+            await base.cerrar()
+        return
+
+    chatbot = Chatbot(args.config, config=config)
+    try:
+        await chatbot.main_loop()
+    finally:
+        await chatbot.cerrar()
 
 
 # Punto de entrada del programa